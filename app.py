@@ -25,17 +25,35 @@ import sys
 import os
 import socket
 import json
+import hashlib
+import hmac
+import zlib
+import time
+import tempfile
+import uuid
 
 import tornado.web
 import tornado.websocket
 from tornado.httpserver import HTTPServer
 from tornado.options import define, options
 from tornado.ioloop import IOLoop
+from tornado import gen
+from concurrent.futures import ProcessPoolExecutor
 
 import app_db
+import sessions
 from app_conf import read_config, settings
 import utils
 import cnc_agent
+import cnc_sim
+import status_stream
+import jog_stream
+import cycle_time
+import preflight
+import static_assets
+import metrics
+from toolpath_cache import ToolpathCache
+from poll_scheduler import PollScheduler
 import logger
 import logging
 
@@ -43,24 +61,66 @@ APP_VERSION = "1.2.0"
 
 define('port', default=8888, help='port to listen on')
 
-cnc_status_poll_period_ms = 500
-cnc_error_poll_period_ms = 25
-
 # Application global variables
 cnc = None			# linuxcnc agent object
+status_broadcaster = None	# status frames fan-out to websocket clients
+toolpath_cache = None		# on-disk cache of parsed g-code files
+poll_scheduler = None		# linuxcnc polling with adaptive period
+jog_sessions = set()		# jog streams of websocket clients
+estimate_pool = None		# worker process for program run time estimation
 db = None			# sqlite database object 
-logged_in = False	#
+session_store = None		# logged in devices
+
+SESSION_COOKIE = "cnc_session"
+
+def is_authorized(handler):
+	"""Request comes from logged in device (checked in memory, without database)"""
+	if settings["autologin"]:
+		return True
+	return session_store.get(handler.get_cookie(SESSION_COOKIE)) is not None
 
 
 # 
 class CurrentStatusSender():
 	def __init__(self, WebSocketHandler):
 		self.ws = WebSocketHandler
-		self.prev_status = None
-
-	def send(self, status):
-		message_json = json.dumps(cnc_agent.LinuxCNCWorker.current_status_to_response(status))
-		self.ws.write_message(message_json)
+		self.binary = False
+		self.client = ""	# peer address (metrics label)
+		self.writing = None		# future of frame being written to connection
+		self.write_time = None	# time of writing frame start
+		self.dropped = 0		# frames skipped while previous one was written
+		self.on_drain = None	# callback(sender) called when frame is written
+
+	def send(self, frame):
+		"""Write status frame encoded by status broadcaster"""
+		future = self.ws.write_message(frame, binary=self.binary)
+		self.writing = future
+		self.write_time = time.time()
+		future.add_done_callback(self.written)
+
+	def written(self, future):
+		if future is not self.writing:
+			return
+		self.writing = None
+		self.write_time = None
+		if self.on_drain is not None:
+			self.on_drain(self)
+
+	def busy_since(self):
+		"""Start time of frame that is not written yet or None"""
+		return self.write_time
+
+	def close(self):
+		self.ws.close()
+
+	def send_event(self, message):
+		"""Write text event message to both json and binary clients"""
+		self.ws.write_message(message)
+
+	def buffer_size(self):
+		"""Bytes written to connection but not sent yet"""
+		stream = self.ws.stream
+		return getattr(stream, "_write_buffer_size", 0) if stream is not None else 0
 
 #
 class CurrentErrorsSender():
@@ -68,8 +128,7 @@ class CurrentErrorsSender():
 		self.ws = WebSocketHandler
 
 	def send(self, error):
-		message_json = json.dumps(error)
-		logger.debug("CNC Error :" + message_json)
+		logger.debug("CNC Error: %s", error)
 		try:
 			self.ws.write_message(error)
 		except Exception as ex:
@@ -83,31 +142,91 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 		logger.debug("New websocket Connection...")
 		self.status_sender = CurrentStatusSender(self)
 		self.errors_sender = CurrentErrorsSender(self)
+		self.jog_session = None
 		self.subprotocol = None
+		self.authorized = False
 
 	def open(self, arg):
 		self.stream.socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+		self.status_sender.client = "%s:%d" % self.stream.socket.getpeername()[:2]
+		# Status, errors and jog streams are only for logged in devices
+		if not is_authorized(self):
+			logger.warning("WEBSOCKET CLOSED: client (%s) not logged in", self.status_sender.client)
+			self.close()
+			return
+		self.authorized = True
+
+		if(self.subprotocol in ("linuxcnc_status", "linuxcnc_status_bin")):
+			self.status_sender.binary = (self.subprotocol == "linuxcnc_status_bin")
+			self.status_sender.on_drain = status_broadcaster.on_drain
+			schema = status_broadcaster.add_subscriber(self.status_sender, 
+								"binary" if self.status_sender.binary else "json")
+			# Binary frames layout is sent as text message before first frame
+			if schema is not None:
+				self.write_message(schema)
+			# Startup progress for client connected while linuxcnc is down
+			if not cnc.is_alive:
+				self.status_sender.send_event(json.dumps(cnc.supervisor.event()))
+		if(self.subprotocol == "linuxcnc_errors"):
+			cnc.add_errors_observer(self.errors_sender.send)
+		if(self.subprotocol == "linuxcnc_jog"):
+			self.jog_session = jog_stream.JogSession(cnc, self.write_message, settings["jog_deadman_timeout"])
+			jog_sessions.add(self.jog_session)
+		# Speed up polling for new client
+		poll_scheduler.update()
 
 	def on_close(self):
-		logger.debug("WebSocket (%s) closed" % self.subprotocol)
+		logger.debug("WebSocket (%s) closed", self.subprotocol)
+		# Nothing was registered for rejected client
+		if not self.authorized:
+			return
+
 		# Remove corresponding observer
-		if(self.subprotocol == "linuxcnc_status"):
-			cnc.del_status_observer(self.status_sender.send)
+		if(self.subprotocol in ("linuxcnc_status", "linuxcnc_status_bin")):
+			status_broadcaster.del_subscriber(self.status_sender)
 
 		if(self.subprotocol == "linuxcnc_errors"):
 			cnc.del_errors_observer(self.errors_sender.send)
 
+		# Don't leave axes moving after client is gone
+		if(self.jog_session is not None):
+			self.jog_session.close()
+			jog_sessions.discard(self.jog_session)
+
+		poll_scheduler.update()
+
 	def on_message(self, message): 
-		logger.debug("GOT message: " + message)
+		# Jog intents and heartbeats are streamed at high rate
+		if(self.jog_session is not None):
+			self.jog_session.on_message(message)
+			return
+
+		logger.debug("GOT message: %s", message)
+
+		# Reconnected errors client requests errors it has missed: {"after_id": N}
+		if(self.subprotocol == "linuxcnc_errors"):
+			try:
+				after_id = int(json.loads(message)["after_id"])
+			except Exception as ex:
+				logger.exception(ex)
+				return
+
+			for error in cnc.get_errors_after(after_id):
+				self.errors_sender.send(error)
 
 	def select_subprotocol(self, subprotocols):
-		logger.debug("WEBSOCKET Subprotocols: " + subprotocols.__str__())
-		if ( 'linuxcnc_status' in subprotocols ):
-			cnc.add_status_observer(self.status_sender.send)
+		logger.debug("WEBSOCKET Subprotocols: %s", subprotocols)
+		# Binary status frames are preferred, JSON ones are fallback (subscribed at open)
+		if ( 'linuxcnc_status_bin' in subprotocols ):
+			self.subprotocol = "linuxcnc_status_bin"
+			return self.subprotocol
+		elif ( 'linuxcnc_status' in subprotocols ):
 			self.subprotocol = "linuxcnc_status"
 			return self.subprotocol
+		elif ( 'linuxcnc_jog' in subprotocols ):
+			self.subprotocol = "linuxcnc_jog"
+			return self.subprotocol
 		elif ( 'linuxcnc_errors' in subprotocols ):
-			cnc.add_errors_observer(self.errors_sender.send)
 			self.subprotocol = "linuxcnc_errors"
 			return self.subprotocol
 
@@ -116,7 +235,7 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 			self.subprotocol = ""
 			return self.subprotocol 
 		else:
-			logger.error("WEBSOCKET CLOSED: sub protocol '%s' not supported" % subprotocols.__str__())
+			logger.error("WEBSOCKET CLOSED: sub protocol '%s' not supported", subprotocols)
 			self.close()
 			return None
 
@@ -148,25 +267,27 @@ class BaseHandler(tornado.web.RequestHandler):
 class MainHandler(tornado.web.RequestHandler):
 	def get(self, *args, **kwargs):
 
-		logger.debug("HTTP GET " + args[0])
-		logger.debug(self.request.headers)
+		logger.debug("HTTP GET %s", args[0])
+		logger.debug("%s", self.request.headers)
 
 		req_uri = args[0].upper()
 
+		authorized = is_authorized(self)
+
 		if (req_uri in [ '', 'INDEX.HTML', 'INDEX.HTM', 'INDEX', 'RETURN_MAINMENU']):
-			if settings["autologin"] or logged_in:
+			if authorized:
 				self.render( 'cnc_main.html', serv_version=APP_VERSION )
 			else:
 				self.render( 'cnc_login.html', serv_version=APP_VERSION )
 		else:
-			logger.debug("Autologin: " + str(settings["autologin"]) + ", logged_in: " + str(logged_in))
+			logger.debug("Autologin: %s, authorized: %s", settings["autologin"], authorized)
 
 			if (req_uri.find(".HTML") == -1):
 				uri = "cnc_" + args[0] + ".html"
 			else:
 				uri = args[0]
 
-			if settings["autologin"] or logged_in:
+			if authorized:
 				self.render(uri, serv_version=APP_VERSION)
 			else:
 				self.render( 'cnc_login.html', serv_version=APP_VERSION )
@@ -181,75 +302,353 @@ class MainHandler(tornado.web.RequestHandler):
 # Handler for AJAX requests
 class CommandHandler(tornado.web.RequestHandler):
 
+	@gen.coroutine
 	def get(self, *args, **kwargs):
 		"""Handle ajax get"""
 		req_uri = ''.join(*args)
-		logger.debug("GET " + req_uri)
-		res = cnc.handle_command(req_uri)
+		logger.debug("GET %s", req_uri)
+		# Query arguments (e.g. gcode_lines?from=1&count=100) are passed as command args
+		req_args = dict((name, self.get_argument(name)) for name in self.request.arguments) or None
+		if is_authorized(self):
+			res = yield cnc.handle_command_async(req_uri, req_args)
+		else:
+			res = {"result": {'text': "not logged in", 'code': -10}}
 		self.set_header("Content-Type", "application/json")
-		self.write(json.dumps(res))
+		self.write((yield CommandHandler.dump_result(req_uri, res)))
 		self.finish()
 
 	@staticmethod
-	def handle_login(json):
+	@gen.coroutine
+	def dump_result(cmd_name, res):
+		"""Serialize command result, file commands (e.g. whole g-code content) are serialized on thread pool"""
+		if cmd_name in cnc_agent.LinuxCNCWorker.IO_CMDS:
+			text = yield IOLoop.current().run_in_executor(None, json.dumps, res)
+			raise gen.Return(text)
+		raise gen.Return(json.dumps(res))
+
+	@staticmethod
+	@gen.coroutine
+	def check_user(user_name, password):
+		"""Check user with single row lookup, password hashing is slow on purpose so it's done on thread pool"""
+		stored_hash = db.users.get_password_hash(user_name)
+		if stored_hash is None:
+			logger.debug("Login: user ('%s') not found", user_name)
+			raise gen.Return({"result": {'text': "no such user", 'code': -1}})
+
+		executor = IOLoop.current().run_in_executor
+		match, upgrade = yield executor(None, app_db.verify_password, password, stored_hash)
+		if not match:
+			logger.debug("Login: invalid password for user ('%s')", user_name)
+			raise gen.Return({"result": {'text': "invalid password", 'code': -2}})
+
+		# Old md5 hash is replaced at first successful login
+		if upgrade:
+			new_hash = yield executor(None, app_db.hash_password, password)
+			db.users.set_password_hash(user_name, new_hash)
+
+		raise gen.Return({"result": {'text': "OK", 'code': 0}})
+
+	@gen.coroutine
+	def handle_login(self, json):
 		"""Handle login request"""
 		res = {"result": {'text': "user check failed", 'code': -10}}
 		try:
-			res = db.users.check_user(json["user_name"], json["password"])
+			res = yield CommandHandler.check_user(json["user_name"], json["password"])
 			if (res["result"]["text"] == "OK"):
-				global logged_in
-				logged_in = True
+				token = session_store.create(json["user_name"], self.request.headers.get("User-Agent", ""))
+				self.set_cookie(SESSION_COOKIE, token, httponly=True)
+				# Doesn't wait for linuxcnc, startup progress is sent to status clients
 				cnc.start_linuxcnc()
 
 		except Exception as ex:
 			logger.exception(ex)
 
-		finally:
-			return res
+		raise gen.Return(res)
 
-	# TODO
-	@staticmethod
-	def handle_logout(json):
+	def handle_logout(self):
 		"""Handle logout request"""
-		logged_in = False
+		session_store.delete(self.get_cookie(SESSION_COOKIE))
+		self.clear_cookie(SESSION_COOKIE)
 		#cnc.stop_linuxcnc()
+		return {"result": {'text': "OK", 'code': 0}}
 
+	@gen.coroutine
 	def post(self, *args, **wargs):
 		"""Handle ajax post"""
 		req_uri = ''.join(*args)
-		logger.debug("POST " + req_uri)
+		logger.debug("POST %s", req_uri)
 		req_data = tornado.escape.json_decode(self.request.body)
 
 		# Login routine 
 		if req_uri == "login":
-			res = CommandHandler.handle_login(req_data)
+			res = yield self.handle_login(req_data)
+		elif req_uri == "logout":
+			res = self.handle_logout()
 		# CNC contol commands
+		elif is_authorized(self):
+			res = yield cnc.handle_command_async(req_uri, req_data)
 		else:
-			res = cnc.handle_command(req_uri, req_data)
+			res = {"result": {'text': "not logged in", 'code': -10}}
 
 		#logger.debug(req_data)
 		#logger.debug(req_data["param"])
 		
+		self.set_header("Content-Type", "application/json")
+		self.write((yield CommandHandler.dump_result(req_uri, res)))
+		self.finish()
+
+# Handler for streaming g-code file upload. Request body is file content
+# (optionally gzip-compressed) that is written to disk by chunks as they arrive.
+# Concurrent uploads (even of the same file name) use own temporary files,
+# progress is kept by upload id: query argument 'id' or generated one
+@tornado.web.stream_request_body
+class GcodeUploadHandler(tornado.web.RequestHandler):
+	uploads = {}	# upload id: upload progress
+
+	def prepare(self):
+		# Uploaded program is opened in linuxcnc - only for logged in devices
+		if not is_authorized(self):
+			raise tornado.web.HTTPError(403)
+
+		if self.request.method != "POST":
+			return
+
+		self.name = os.path.basename(self.path_args[0])
+		if not self.name.endswith(".ngc"):
+			raise tornado.web.HTTPError(400, "file extension .ngc required")
+
+		self.path = os.path.join("/tmp", self.name)
+		logger.debug("Receiving gcode file: %s", self.path)
+
+		# Tornado default (100 MB) is replaced with configured limit, gzip body can't be larger either
+		self.max_size = settings["upload_max_size"]
+		self.request.connection.set_max_body_size(self.max_size)
+
+		fd, self.part_path = tempfile.mkstemp(dir="/tmp", prefix=self.name + ".", suffix=".part")
+		self.file = os.fdopen(fd, "wb")
+		self.sha = hashlib.sha1()
+		self.size = 0
+		self.error = None
+		self.decompressor = None
+		if self.request.headers.get("Content-Encoding", "") == "gzip":
+			self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+		self.progress = {"received": 0, "total": int(self.request.headers.get("Content-Length", 0))}
+		self.upload_id = self.get_argument("id", None)
+		if (not self.upload_id) or (self.upload_id in GcodeUploadHandler.uploads):
+			self.upload_id = uuid.uuid4().hex
+		GcodeUploadHandler.uploads[self.upload_id] = self.progress
+
+	def write_chunk(self, data):
+		if self.size + len(data) > self.max_size:
+			raise ValueError("file is larger than %d MB" % (self.max_size // 1048576))
+		self.file.write(data)
+		self.sha.update(data)
+		self.size += len(data)
+
+	def data_received(self, chunk):
+		if self.error:
+			return
+
+		self.progress["received"] += len(chunk)
+		try:
+			if self.decompressor:
+				# Output is capped one byte over the limit, so gzip bomb is stopped at first chunk exceeding it
+				chunk = self.decompressor.decompress(chunk, self.max_size - self.size + 1)
+			self.write_chunk(chunk)
+		except Exception as ex:
+			logger.exception(ex)
+			self.error = str(ex)
+
+	def close_file(self):
+		if not self.file.closed:
+			self.file.close()
+
+	@gen.coroutine
+	def post(self, *args, **kwargs):
+		"""Upload finished: check program against soft limits and push file to linuxcnc"""
+		try:
+			if self.decompressor and not self.error:
+				self.write_chunk(self.decompressor.flush())
+			self.close_file()
+		except Exception as ex:
+			logger.exception(ex)
+			self.error = str(ex)
+
+		if self.error:
+			os.remove(self.part_path)
+			res = {"result": {'text': self.error, 'code': -1}}
+		else:
+			os.rename(self.part_path, self.path)
+			key = self.sha.hexdigest()
+			offset = yield cnc.run_async(cnc.get_work_offset)
+			soft_limits = yield cnc.run_async(cnc.get_soft_limits)
+			check = None
+			# Limits are unknown (linuxcnc is down) or call is cancelled by safety command
+			if isinstance(soft_limits, list) and isinstance(offset, list):
+				check = yield IOLoop.current().run_in_executor(None, self.preflight, key, 
+									soft_limits, offset)
+			res = yield cnc.run_async(cnc.open_gcode_file, self.path)
+			res["hash"] = key
+			res["size"] = self.size
+			res["preflight"] = check
+			res["upload_id"] = self.upload_id
+
+		self.set_header("Content-Type", "application/json")
+		self.write(json.dumps(res))
+		self.finish()
+
+	def preflight(self, key, soft_limits, offset):
+		"""Parse program to toolpath cache and check its extents against soft limits"""
+		try:
+			data = toolpath_cache.load(self.path, key)
+		except Exception as ex:
+			logger.exception(ex)
+			return None
+
+		try:
+			return preflight.check(data, soft_limits, offset)
+		except Exception as ex:
+			logger.exception(ex)
+			return None
+		finally:
+			data.close()
+
+	def get(self, *args, **kwargs):
+		"""Get progress of upload with given id"""
+		progress = GcodeUploadHandler.uploads.get(args[0])
+		if progress is None:
+			res = {"result": {'text': "no such upload", 'code': -1}}
+		else:
+			res = {"result": {'text': "OK", 'code': 0}, "progress": progress}
+
 		self.set_header("Content-Type", "application/json")
 		self.write(json.dumps(res))
 		self.finish()
 
+	def on_connection_close(self):
+		# Upload aborted by client
+		if self.request.method == "POST" and hasattr(self, "file"):
+			self.close_file()
+			try:
+				os.remove(self.part_path)
+			except OSError:
+				pass
+
+	def on_finish(self):
+		if self.request.method == "POST" and hasattr(self, "upload_id"):
+			GcodeUploadHandler.uploads.pop(self.upload_id, None)
+
+# Handler for toolpath of opened g-code file (binary buffer for browser's BufferGeometry)
+class ToolpathHandler(tornado.web.RequestHandler):
+	chunk_size = 262144
+
+	def prepare(self):
+		if not is_authorized(self):
+			raise tornado.web.HTTPError(403)
+
+	@gen.coroutine
+	def get(self, *args, **kwargs):
+		snapshot = cnc.snapshot
+		if (snapshot is None) or (snapshot.file == ""):
+			raise tornado.web.HTTPError(404)
+
+		logger.debug("Loading toolpath of '%s'", snapshot.file)
+		try:
+			data = yield IOLoop.current().run_in_executor(None, toolpath_cache.load, snapshot.file)
+		except (IOError, OSError) as ex:
+			logger.exception(ex)
+			raise tornado.web.HTTPError(404)
+
+		# Stream mapped toolpath file by chunks
+		self.set_header("Content-Type", "application/octet-stream")
+		self.set_header("Content-Length", len(data))
+		try:
+			for offset in range(0, len(data), ToolpathHandler.chunk_size):
+				self.write(data[offset : offset + ToolpathHandler.chunk_size])
+				yield self.flush()
+		finally:
+			data.close()
+
+		self.finish()
+
+# Handler for estimation of current program run time, cut/rapid lengths and
+# per tool breakdown. Estimation runs in worker process
+class EstimateHandler(tornado.web.RequestHandler):
+
+	def prepare(self):
+		if not is_authorized(self):
+			raise tornado.web.HTTPError(403)
+
+	@gen.coroutine
+	def get(self, *args, **kwargs):
+		snapshot = cnc.snapshot
+		if (snapshot is None) or (snapshot.file == ""):
+			raise tornado.web.HTTPError(404)
+
+		executor = IOLoop.current().run_in_executor
+		try:
+			key = yield executor(None, ToolpathCache.file_hash, snapshot.file)
+			data = yield executor(None, toolpath_cache.load, snapshot.file, key)
+			data.close()
+			res = yield executor(estimate_pool, cycle_time.estimate_file, 
+								toolpath_cache.cache_path(key), cnc.get_motion_limits())
+		except (IOError, OSError, ValueError) as ex:
+			logger.exception(ex)
+			raise tornado.web.HTTPError(404)
+
+		res["result"] = {'text': "OK", 'code': 0}
+		self.set_header("Content-Type", "application/json")
+		self.write(json.dumps(res))
+		self.finish()
+
+# Handler for Prometheus scrapes
+class MetricsHandler(tornado.web.RequestHandler):
+	"""Prometheus metrics. Labels include status clients' ip:port, so they are served only
+	to logged in devices or to scraper sending configured metrics_token as bearer token"""
+	def prepare(self):
+		if is_authorized(self):
+			return
+		token = settings["metrics_token"]
+		header = self.request.headers.get("Authorization", "")
+		if not (token and hmac.compare_digest(str(header), str("Bearer " + token))):
+			raise tornado.web.HTTPError(403)
+
+	def get(self, *args, **kwargs):
+		self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.write(metrics.REGISTRY.render())
+
+def status_clients_buffers():
+	"""Outbound buffer size of every status websocket client"""
+	return [({"client": sender.client}, sender.buffer_size()) for sender in status_broadcaster.subscribers]
+
+def status_clients_dropped():
+	"""Number of frames skipped for every status websocket client"""
+	return [({"client": sender.client}, sender.dropped) for sender in status_broadcaster.subscribers]
+
 #
 def make_app(app_path):
 	return tornado.web.Application([
+        (r"/toolpath", ToolpathHandler, {} ),
+        (r"/estimate", EstimateHandler, {} ),
+        (r"/metrics", MetricsHandler, {} ),
+        (r"/upload/(.*)", GcodeUploadHandler, {} ),
         (r"/([^\\/]*)", MainHandler, {}),
         (r"/command/(.*)", CommandHandler, {} ),
         (r"/websocket/(.*)", WebSocketHandler, {} ),
     	],
-    	debug=True,
+    	# production mode: compiled templates and static file hashes are cached, no autoreload
+    	debug=settings["debug"],
     	template_path=os.path.join(app_path, "templates"),
     	static_path=os.path.join(app_path, "static"),
+    	static_handler_class=static_assets.StaticFileHandler,
+    	ui_methods={"import_map": static_assets.import_map},
     	#default_handler_class= 404 page
     )
 
 
 def cnc_errors_handler(error_text_json):
-	logger.error("CNC Error: %s" % error_text_json)
+	logger.error("CNC Error: %s", error_text_json)
 
 
 # auto start if executed from the command line
@@ -261,6 +660,12 @@ if __name__ == "__main__":
 
 		read_config(os.path.join(app_path, "app.config"))
 
+		"""Estimation worker process"""
+		# Worker is forked before any thread is started (logger writer, pollers,
+		# cache warming), so it can't inherit lock held by other thread
+		estimate_pool = ProcessPoolExecutor(1)
+		estimate_pool.submit(int).result()
+
 		# Create application directories
 		log_path = os.path.join(app_path, "log")	# directory for log files
 		try:
@@ -269,6 +674,13 @@ if __name__ == "__main__":
 			# if not exists already - error
 			if not os.path.isdir(log_path): 
 				raise 
+
+		cache_path = os.path.join(app_path, "cache")	# directory for cached toolpaths and line indexes
+		try:
+			os.makedirs(cache_path) 
+		except OSError: 
+			if not os.path.isdir(cache_path): 
+				raise 
 		
 		"""Logger setup"""
 		# Disable tornado log routine, because we will use self-made
@@ -287,25 +699,63 @@ if __name__ == "__main__":
 					file_max_size = 4*1048576, 
 					use_console= settings["log_to_console"])
 
+		"""Toolpath cache init"""
+		toolpath_cache = ToolpathCache(cache_path, settings["toolpath_cache_size"], settings["toolpath_cache_warm"])
+		toolpath_cache.warm_in_background()
+
 		"""Database init"""
 		db = app_db.Database('my.db')
 		db.users.add_user("admin", "admin")
+		session_store = sessions.SessionStore(settings["session_timeout"] * 60)
 
 		"""Construct and serve the tornado application."""		
 		app = make_app(app_path)
+		if not settings["debug"]:
+			static_assets.init_import_map(app.settings)
+			# Compress static files missed at build time
+			static_assets.precompress_in_background(os.path.join(app_path, "static"))
 		http_server = HTTPServer(app)
 		http_server.listen(options.port)
 
+		"""Machine backend"""
+		if settings["backend"] == "sim":
+			logger.info("Using simulated machine (speed: %s)", settings["sim_speed"])
+			cnc_sim.configure(settings["sim_speed"])
+			cnc_agent.set_backend(cnc_sim)
+		elif cnc_agent.linuxcnc is None:
+			raise RuntimeError("linuxcnc python module not found (use backend = sim to run simulated machine)")
+
 		"""Create periodic polling of CNC"""
-		cnc = cnc_agent.LinuxCNCWorker(settings["cnc_ini_path"])
-		cnc_status_scheduler = tornado.ioloop.PeriodicCallback( cnc.poll_status, 100 )
-		cnc_status_scheduler.start()
-		cnc_errors_scheduler = tornado.ioloop.PeriodicCallback( cnc.poll_errors, 5 )
-		cnc_errors_scheduler.start()
+		cnc = cnc_agent.LinuxCNCWorker(settings["cnc_ini_path"], settings["status_poll_period"],
+										settings["errors_buffer_size"], settings["errors_coalesce_period"], cache_path,
+										settings["position_history_size"],
+										{"start_timeout_s": settings["start_timeout"],
+										 "backoff_s": settings["restart_backoff"],
+										 "max_restarts": settings["max_restarts"]})
+		status_broadcaster = status_stream.StatusBroadcaster(settings["status_delta"], settings["status_keyframe_period"],
+															settings["status_stall_timeout"])
+		# Line indexes share cache directory and size budget with toolpaths
+		cnc.gcode_lines.on_build = toolpath_cache.evict
+		cnc.add_status_observer(status_broadcaster.broadcast)
+		cnc.supervisor.add_observer(status_broadcaster.broadcast_event)
+		metrics.REGISTRY.gauge("websocket_outbound_buffer_bytes", 
+								"Bytes queued for status websocket client", status_clients_buffers)
+		metrics.REGISTRY.gauge("websocket_dropped_frames", 
+								"Status frames skipped for websocket client", status_clients_dropped)
+		metrics.REGISTRY.gauge("status_subscribers", 
+								"Number of status websocket clients", lambda: len(status_broadcaster.subscribers))
+		metrics.LoopLagMonitor(metrics.IOLOOP_LAG).start()
+		poll_scheduler = PollScheduler(cnc, 
+									lambda: len(status_broadcaster.subscribers) + len(cnc.errors_observers) + len(jog_sessions),
+									settings["status_poll_period"],
+									settings["poll_active_period"],
+									settings["poll_idle_period"],
+									settings["poll_no_clients_period"])
+		poll_scheduler.start()
 		if settings["autologin"]:
 			cnc.start_linuxcnc()
 		
-		logger.info('Listening on http://%s:%i' % (utils.get_current_ip(), options.port))
+		logger.info('Listening on http://%s:%i', utils.get_current_ip(), options.port)
 		# IOLoop.current().start()
 		IOLoop.instance().start()
 
@@ -9,15 +9,44 @@ settings = {
 	"log_level": "info",		# logger messaging level
 	"log_to_console": False,	# permission for stdout log printing
 	"log_files_dir": "./log",	# directory for storing rotated log files
-	"log_max_size": 4,			# max size of log file [MB]
+	"log_max_size": 4*1048576,	# max size of log file [bytes] (config file: [MB])
 	"cnc_ini_path": "",			# path to ini file to run linuxcnc with
+	"backend": "linuxcnc",		# machine backend: "linuxcnc" or "sim" (simulated machine, no linuxcnc needed)
+	"sim_speed": 1.0,			# virtual time speed factor of simulated machine
+	"status_poll_period": 20,	# status polling thread period while program runs or axis jogs [ms]
+	"errors_buffer_size": 256,	# number of linuxcnc errors kept for replay
+	"errors_coalesce_period": 1000,	# identical errors within this period are merged [ms]
+	"position_history_size": 65536,	# number of position samples kept for trajectory restore
+	"jog_deadman_timeout": 500,	# jogging axes are stopped when jog client is silent for this period [ms]
+	"start_timeout": 60,		# linuxcnc not available during this period after launch is restarted [sec]
+	"restart_backoff": 2,		# delay of first linuxcnc restart, doubled on every next one [sec]
+	"max_restarts": 5,			# number of linuxcnc restarts in a row before giving up
+	"poll_active_period": 100,	# status publish period while program runs or axis jogs [ms]
+	"poll_idle_period": 200,	# status poll period while interpreter is idle [ms]
+	"poll_no_clients_period": 2000,	# status poll period while no websocket clients [ms]
+	"toolpath_cache_size": 256*1048576,	# size budget of toolpath and line index cache [bytes] (config file: [MB])
+	"toolpath_cache_warm": 3,	# number of last programs prepared at start
 	"autologin": False,			# permission for ignoring authentication page
+	"session_timeout": 720,		# login session of device expires after this period of inactivity [min]
+	"debug": False,				# development mode: autoreload, no template and static caching
+	"status_delta": True,		# send only changed status fields between keyframes
+	"status_keyframe_period": 2000,	# period of full status frames [ms]
+	"status_stall_timeout": 10000,	# status client not receiving frame for this period is disconnected [ms]
+	"metrics_token": "",		# bearer token of /metrics scraper, empty - only logged in devices
+	"upload_max_size": 64*1048576,	# max size of uploaded g-code file, after decompression [bytes] (config file: [MB])
 }
 
-def try_to_set(root, name, value, is_boolean=False):
+def try_to_set(root, name, value, is_boolean=False, is_integer=False, is_float=False):
+	# Section getters return None for missing key
+	if name not in root:
+		return value
 	try:
 		if is_boolean:
 			return root.getboolean(name)
+		if is_integer:
+			return root.getint(name)
+		if is_float:
+			return root.getfloat(name)
 		return root[name]
 	except Exception:
 		#logger.debug("'" + name + "' not found in config file. Using default: " + str(value))
@@ -40,15 +69,43 @@ def read_config(path):
 		settings["log_level"] = try_to_set(common, "log_level", settings["log_level"])
 		settings["log_to_console"] = try_to_set(common, "log_to_console", settings["log_to_console"])
 		settings["log_files_dir"] = try_to_set(common, "log_files_dir", settings["log_files_dir"])
-		settings["log_max_size"] = try_to_set(common, "log_max_size", settings["log_max_size"]) * 1048576	# MB -> Bytes
+		settings["log_max_size"] = try_to_set(common, "log_max_size", settings["log_max_size"] // 1048576, is_integer=True) * 1048576	# MB -> Bytes
 
 	if "LINUXCNC" in config:
 		cnc_settings = config["LINUXCNC"]
 		settings["cnc_ini_path"] = try_to_set(cnc_settings, "ini_path", settings["cnc_ini_path"])
+		settings["backend"] = try_to_set(cnc_settings, "backend", settings["backend"])
+		settings["sim_speed"] = try_to_set(cnc_settings, "sim_speed", settings["sim_speed"], is_float=True)
+		settings["status_poll_period"] = try_to_set(cnc_settings, "status_poll_period", settings["status_poll_period"], is_integer=True)
+		settings["errors_buffer_size"] = try_to_set(cnc_settings, "errors_buffer_size", settings["errors_buffer_size"], is_integer=True)
+		settings["errors_coalesce_period"] = try_to_set(cnc_settings, "errors_coalesce_period", settings["errors_coalesce_period"], is_integer=True)
+		settings["position_history_size"] = try_to_set(cnc_settings, "position_history_size", settings["position_history_size"], is_integer=True)
+		settings["jog_deadman_timeout"] = try_to_set(cnc_settings, "jog_deadman_timeout", settings["jog_deadman_timeout"], is_integer=True)
+		settings["start_timeout"] = try_to_set(cnc_settings, "start_timeout", settings["start_timeout"], is_integer=True)
+		settings["restart_backoff"] = try_to_set(cnc_settings, "restart_backoff", settings["restart_backoff"], is_integer=True)
+		settings["max_restarts"] = try_to_set(cnc_settings, "max_restarts", settings["max_restarts"], is_integer=True)
+
+	if "POLLING" in config:
+		polling = config["POLLING"]
+		settings["poll_active_period"] = try_to_set(polling, "active_period", settings["poll_active_period"], is_integer=True)
+		settings["poll_idle_period"] = try_to_set(polling, "idle_period", settings["poll_idle_period"], is_integer=True)
+		settings["poll_no_clients_period"] = try_to_set(polling, "no_clients_period", settings["poll_no_clients_period"], is_integer=True)
+
+	if "CACHE" in config:
+		cache = config["CACHE"]
+		settings["toolpath_cache_size"] = try_to_set(cache, "toolpath_size", settings["toolpath_cache_size"] // 1048576, is_integer=True) * 1048576	# MB -> Bytes
+		settings["toolpath_cache_warm"] = try_to_set(cache, "toolpath_warm", settings["toolpath_cache_warm"], is_integer=True)
 
 	if "SERVER" in config:
 		sever = config["SERVER"]
 		settings["autologin"] = try_to_set(sever, "autologin", settings["autologin"], True)
+		settings["session_timeout"] = try_to_set(sever, "session_timeout", settings["session_timeout"], is_integer=True)
+		settings["debug"] = try_to_set(sever, "debug", settings["debug"], True)
+		settings["status_delta"] = try_to_set(sever, "status_delta", settings["status_delta"], True)
+		settings["status_keyframe_period"] = try_to_set(sever, "status_keyframe_period", settings["status_keyframe_period"], is_integer=True)
+		settings["status_stall_timeout"] = try_to_set(sever, "status_stall_timeout", settings["status_stall_timeout"], is_integer=True)
+		settings["metrics_token"] = try_to_set(sever, "metrics_token", settings["metrics_token"])
+		settings["upload_max_size"] = try_to_set(sever, "upload_max_size", settings["upload_max_size"] // 1048576, is_integer=True) * 1048576	# MB -> Bytes
 
 	return True 	# Config file exists
 
@@ -58,4 +115,4 @@ if __name__ == "__main__":
 	logger.init("debug", "log/app_conf.log")
 	if read_config('app.config'):
 		for key in settings:
-			logger.debug( key + ": " + str(settings[key]) )
+			logger.debug("%s: %s", key, settings[key])
@@ -1,5 +1,7 @@
 import sqlite3
 import hashlib
+import hmac
+import binascii
 import time
 from datetime import datetime
 import os
@@ -12,10 +14,40 @@ def execute_sql(connection, cursor, sql, *args):
 			connection.commit()
 			return rows
 		except sqlite3.Error as error:
-			logger.error("sqlite execute error: %s" % error)
+			logger.error("sqlite execute error: %s", error)
 			raise
 
 
+# Password hash format: pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+# (hashes of old databases are plain md5 hex, they are upgraded at login)
+PBKDF2_ITERATIONS = 100000
+
+def to_bytes(password):
+	if not isinstance(password, bytes):
+		password = password.encode('utf-8')
+	return password
+
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+	"""Make salted password hash (slow on purpose - call it off IOLoop)"""
+	salt = os.urandom(16)
+	digest = hashlib.pbkdf2_hmac('sha256', to_bytes(password), salt, iterations)
+	return "pbkdf2_sha256$%d$%s$%s" % (iterations, binascii.hexlify(salt), binascii.hexlify(digest))
+
+def verify_password(password, stored_hash):
+	"""Check password against stored hash. Returns (match, hash needs upgrade)"""
+	password = to_bytes(password)
+	parts = stored_hash.split('$')
+	if len(parts) == 4 and parts[0] == "pbkdf2_sha256":
+		iterations = int(parts[1])
+		digest = hashlib.pbkdf2_hmac('sha256', password, binascii.unhexlify(parts[2]), iterations)
+		match = hmac.compare_digest(binascii.hexlify(digest), str(parts[3]))
+		return match, (iterations < PBKDF2_ITERATIONS)
+
+	# Legacy md5 hash
+	match = hmac.compare_digest(hashlib.md5(password).hexdigest(), str(stored_hash))
+	return match, True
+
+
 class UsersTable():
 	def __init__(self, connection, cursor):
 		self.name = "Users"		# Table name
@@ -27,20 +59,22 @@ class UsersTable():
 			password_hash TEXT,
 			registration_date TEXT
 			);''' % self.name)
+		# Drop duplicated users of old databases, so that name can be unique
+		self.cur.execute("DELETE FROM %s WHERE id NOT IN (SELECT MIN(id) FROM %s GROUP BY name);" % (self.name, self.name))
+		self.cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS %s_name ON %s (name);" % (self.name, self.name))
 		self.con.commit()
 
 	def add_user(self, user_name, password):
 		now = datetime.now()
 		reg_date = now.strftime("%Y-%m-%d %H:%M:%S")
-		pass_hash = hashlib.md5(password).hexdigest()
 
 		# check if table aready contains this user
-		execute_sql(self.con, self.cur, "SELECT * FROM %s WHERE name='%s';" % (self.name, user_name))
-		if(self.cur.fetchall() != []):
-			logger.debug("UsersTable: user ('%s') already exists. Ignoring adding" % user_name)
+		if(self.get_password_hash(user_name) is not None):
+			logger.debug("UsersTable: user ('%s') already exists. Ignoring adding", user_name)
 			return False
 
-		logger.debug("UsersTable: adding new user ('%s')" % user_name)
+		pass_hash = hash_password(password)
+		logger.debug("UsersTable: adding new user ('%s')", user_name)
 
 		execute_sql(self.con, self.cur, '''INSERT INTO %s (name, password_hash, registration_date) 
 			VALUES (?, ?, ?);''' % self.name, (user_name, pass_hash, reg_date))
@@ -48,8 +82,8 @@ class UsersTable():
 		return True
 
 	def delete_user(self, user_name):
-		logger.debug("UsersTable: deleting user ('%s')" % user_name)
-		execute_sql(self.con, self.cur, "DELETE FROM %s WHERE name='%s';" % (self.name, user_name))
+		logger.debug("UsersTable: deleting user ('%s')", user_name)
+		execute_sql(self.con, self.cur, "DELETE FROM %s WHERE name=?;" % self.name, (user_name,))
 
 	def get_users(self):
 		users = []
@@ -61,25 +95,36 @@ class UsersTable():
 		logger.debug(users_tuple)
 		return users_tuple
 
+	def get_password_hash(self, user_name):
+		"""Stored password hash of user (None - no such user). Single row lookup by unique name"""
+		rows = execute_sql(self.con, self.cur, "SELECT password_hash FROM %s WHERE name=?;" % self.name, (user_name,))
+		row = rows.fetchone()
+		return row[0] if row is not None else None
+
+	def set_password_hash(self, user_name, pass_hash):
+		execute_sql(self.con, self.cur, "UPDATE %s SET password_hash=? WHERE name=?;" % self.name, (pass_hash, user_name))
+
 	def check_user(self, user_name, password):
+		"""Blocking user check (login handler verifies hash on thread pool instead)"""
 		res = {"result": {'text': "invalid user name or password", 'code': -3}}
-		pass_hash = hashlib.md5(password).hexdigest()
-		rows = execute_sql(self.con, self.cur, "SELECT * FROM %s;" % self.name)
-		for row in rows:
-			if(user_name == row[1]):
-				logger.debug("UsersTable: user ('%s') found" % user_name)
-				if (pass_hash == row[2]):
-					res["result"]["text"] = "OK"
-					res["result"]["code"] = 0
-				else:
-					logger.debug("UsersTable: invalid password for user ('%s')" % user_name)
-					res["result"]["text"] = "invalid password"
-					res["result"]["code"] = -2
-			else:
-				logger.debug("UsersTable: user ('%s') not found" % user_name)
-				res["result"]["text"] = "no such user"
-				res["result"]["code"] = -1
-
+		stored_hash = self.get_password_hash(user_name)
+		if stored_hash is None:
+			logger.debug("UsersTable: user ('%s') not found", user_name)
+			res["result"]["text"] = "no such user"
+			res["result"]["code"] = -1
+			return res
+
+		match, upgrade = verify_password(password, stored_hash)
+		if not match:
+			logger.debug("UsersTable: invalid password for user ('%s')", user_name)
+			res["result"]["text"] = "invalid password"
+			res["result"]["code"] = -2
+			return res
+
+		if upgrade:
+			self.set_password_hash(user_name, hash_password(password))
+		res["result"]["text"] = "OK"
+		res["result"]["code"] = 0
 		return res
 
 class Database():
@@ -89,7 +134,7 @@ class Database():
 			self.cur = self.con.cursor()
 			self.users = UsersTable(self.con, self.cur)
 		except sqlite3.Error as error:
-			logger.error("sqlite init error: %s" % error)
+			logger.error("sqlite init error: %s", error)
 
 
 	def deinit(self):
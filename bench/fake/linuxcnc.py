@@ -0,0 +1,72 @@
+# *****************************************************
+# Stand-in of linuxcnc python module for benchmarks: status channel
+# returns state of module-level 'machine' (benchmarks change it between
+# polls), commands are recorded and complete at once
+# *****************************************************
+
+# Constants, error and ini reader are shared with simulator backend
+from cnc_sim import (STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON,
+                     MODE_MANUAL, MODE_AUTO, MODE_MDI,
+                     INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING,
+                     RCS_DONE, RCS_EXEC, RCS_ERROR,
+                     JOG_STOP, JOG_CONTINUOUS, JOG_INCREMENT,
+                     AUTO_RUN, AUTO_PAUSE, AUTO_RESUME, AUTO_STEP,
+                     NML_ERROR, NML_TEXT, NML_DISPLAY,
+                     OPERATOR_ERROR, OPERATOR_TEXT, OPERATOR_DISPLAY,
+                     TRAJ_MODE_FREE, TRAJ_MODE_COORD,
+                     MOTION_TYPE_TRAVERSE, MOTION_TYPE_FEED, MOTION_TYPE_ARC,
+                     error, ini)
+
+# Status values returned by stat.poll()
+machine = {
+    "task_state": STATE_ON,
+    "estop": 0,
+    "enabled": True,
+    "task_mode": MODE_AUTO,
+    "interp_state": INTERP_READING,
+    "position": (10.0, 20.0, 5.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+    "homed": (1, 1, 1, 0, 0, 0, 0, 0, 0),
+    "axes": 3,
+    "current_line": 1,
+    "motion_line": 1,
+    "motion_mode": 1,
+    "motion_type": 2,
+    "read_line": 1,
+    "file": "",
+    "command": "",
+    "tool_in_spindle": 1,
+    "current_vel": 10.0,
+    "g5x_offset": (0.0,) * 9,
+    "g92_offset": (0.0,) * 9,
+    "tool_offset": (0.0,) * 9,
+}
+
+# Commands called on command channels: (name, args)
+commands = []
+
+# Errors returned by error_channel.poll(): (kind, text)
+errors = []
+
+
+class stat(object):
+    def __init__(self):
+        self.poll()
+
+    def poll(self):
+        self.__dict__.update(machine)
+
+
+class command(object):
+    def __getattr__(self, name):
+        def call(*args):
+            commands.append((name, args))
+        return call
+
+    def wait_complete(self, timeout=5.0):
+        return RCS_DONE
+
+
+class error_channel(object):
+    def poll(self):
+        return errors.pop(0) if errors else None
+
@@ -0,0 +1,253 @@
+# *****************************************************
+# Benchmarks of server hot paths with stand-in linuxcnc module
+# (bench/fake/linuxcnc.py), so they run on any box without LinuxCNC.
+#
+# Usage (from project directory):
+#   python -m bench.run [-o results.json] [--compare old_results.json] [--filter name]
+#
+# Results are JSON: time per call of every benchmark (best, median and
+# mean of repeats [us]) plus extra values (e.g. bytes per frame)
+# *****************************************************
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# Fake linuxcnc module is found first
+sys.path.insert(0, os.path.join(BENCH_DIR, "fake"))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(1, ROOT_DIR)
+
+import linuxcnc
+import cnc_agent
+import gcode_parser
+import logger
+import status_stream
+
+REPEATS = 5
+MIN_BATCH_TIME = 0.05   # calls are timed in batches of at least this duration [sec]
+
+
+def measure(fn, repeats=REPEATS):
+    """Time per call of fn [us]: best, median and mean of repeated batches"""
+    # Calibrate batch size
+    calls = 1
+    while True:
+        start = time.time()
+        for i in range(calls):
+            fn()
+        elapsed = time.time() - start
+        if elapsed >= MIN_BATCH_TIME:
+            break
+        calls *= 2
+
+    # Slow calls (e.g. parsing of big file) are not repeated much
+    if elapsed > 1.0:
+        repeats = 1
+    times = [elapsed / calls]
+    for r in range(repeats - 1):
+        start = time.time()
+        for i in range(calls):
+            fn()
+        times.append((time.time() - start) / calls)
+
+    times.sort()
+    return {"calls": calls * len(times),
+            "best_us": times[0] * 1e6,
+            "median_us": times[len(times) // 2] * 1e6,
+            "mean_us": sum(times) / len(times) * 1e6}
+
+
+# *****************************************************
+# Websocket client stand-in counting written bytes
+# *****************************************************
+class FakeSubscriber(object):
+    def __init__(self):
+        self.client = "bench"
+        self.dropped = 0
+        self.frames = 0
+        self.bytes = 0
+
+    def busy_since(self):
+        # Writes complete at once
+        return None
+
+    def close(self):
+        pass
+
+    def send(self, frame):
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def send_event(self, message):
+        self.send(message)
+
+
+def moving_snapshots(num=1000):
+    """Snapshots of machine running program: position and lines change every poll"""
+    snapshots = []
+    status = linuxcnc.stat()
+    for i in range(num):
+        linuxcnc.machine["position"] = (10.0 + i * 0.01, 20.0 - i * 0.01, 5.0) + (0.0,) * 6
+        linuxcnc.machine["current_line"] = linuxcnc.machine["motion_line"] = i // 10 + 1
+        status.poll()
+        snapshots.append(cnc_agent.StatusSnapshot(status))
+    return snapshots
+
+
+def bench_status(results):
+    status = linuxcnc.stat()
+    results["status.current_status_to_response"] = measure(
+        lambda: cnc_agent.LinuxCNCWorker.current_status_to_response(status))
+    results["status.snapshot"] = measure(lambda: cnc_agent.StatusSnapshot(status))
+
+    snapshots = moving_snapshots()
+    for codec in ("json", "binary"):
+        for clients_num in (1, 10, 50):
+            broadcaster = status_stream.StatusBroadcaster()
+            subscribers = [FakeSubscriber() for i in range(clients_num)]
+            for subscriber in subscribers:
+                broadcaster.add_subscriber(subscriber, codec)
+
+            state = {"next": 0}
+            def broadcast():
+                broadcaster.broadcast(snapshots[state["next"] % len(snapshots)])
+                state["next"] += 1
+
+            res = measure(broadcast)
+            res["bytes_per_frame"] = float(subscribers[0].bytes) / max(1, subscribers[0].frames)
+            results["status.broadcast.%s.%d_clients" % (codec, clients_num)] = res
+
+
+def make_tool_table(path, tools_num=1000):
+    with open(path, "w") as file:
+        for num in range(1, tools_num + 1):
+            file.write("T%d P%d X0 Y0 Z%.3f D%.3f ;tool %d\n" % (num, num, num * 0.1, 1 + num % 20, num))
+
+
+def bench_tool_table(results, tmp_dir):
+    path = os.path.join(tmp_dir, "tool.tbl")
+    make_tool_table(path)
+    editor = cnc_agent.ToolTableEditor(path)
+
+    def load():
+        editor.stamp = None
+        editor.load()
+    results["tool_table.load_1k"] = measure(load)
+    results["tool_table.read_1k"] = measure(editor.read)
+
+    state = {"next": 2000}
+    def add_remove():
+        num = state["next"]
+        state["next"] += 1
+        editor.add({"T": num, "P": num, "D": "3.0", ";": "bench"})
+        editor.remove([num])
+    results["tool_table.add_remove_1k"] = measure(add_remove)
+
+    tools = editor.read()["tools"]
+    def update():
+        tools[0]["D"] = "%.3f" % (float(tools[0]["D"]) + 0.001)
+        editor.update(tools)
+    results["tool_table.update_1k"] = measure(update)
+
+
+def bench_gcode(results, gcode_paths):
+    # Worker with fake linuxcnc, its threads are not needed
+    worker = cnc_agent.LinuxCNCWorker(os.path.join(ROOT_DIR, "cnc_ini", "axis_mm.ini"),
+                                      cache_dir=tempfile.mkdtemp(prefix="bench_cache_"))
+    worker.poller.stop()
+    worker.error_reader.stop()
+    worker.poller.join()
+    worker.error_reader.join()
+    status = linuxcnc.stat()
+
+    for path in gcode_paths:
+        name = os.path.basename(path)
+        status.file = path
+        worker.poller.snapshot = cnc_agent.StatusSnapshot(status)
+        res = measure(lambda: worker.get_gcode_content())
+        res["file_bytes"] = os.path.getsize(path)
+        results["gcode.content.%s" % name] = res
+
+        res = measure(lambda: gcode_parser.parse_file(path), repeats=3)
+        res["segments"] = len(gcode_parser.parse_file(path))
+        results["gcode.parse.%s" % name] = res
+
+    shutil.rmtree(worker.gcode_lines.dir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR).strip().decode()
+    except Exception:
+        return None
+
+
+def compare(results, base_path):
+    with open(base_path, "r") as file:
+        base = json.load(file)["results"]
+
+    print("%-48s %12s %12s %8s" % ("benchmark", "base [us]", "now [us]", "ratio"))
+    for name in sorted(results):
+        if name not in base:
+            continue
+        old, new = base[name]["median_us"], results[name]["median_us"]
+        print("%-48s %12.2f %12.2f %8.2f" % (name, old, new, new / old if old else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of cnc web server hot paths")
+    parser.add_argument("-o", "--output", help="write JSON results to file (default: stdout)")
+    parser.add_argument("--compare", help="JSON results of previous run to compare with")
+    parser.add_argument("--filter", default="", help="run only benchmarks with this prefix (status, tool_table, gcode)")
+    args = parser.parse_args()
+
+    logger.init("error", use_console=True)
+    results = {}
+    tmp_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        if "status".startswith(args.filter) or args.filter.startswith("status"):
+            bench_status(results)
+        if "tool_table".startswith(args.filter) or args.filter.startswith("tool_table"):
+            bench_tool_table(results, tmp_dir)
+        if "gcode".startswith(args.filter) or args.filter.startswith("gcode"):
+            bench_gcode(results, sorted(glob.glob(os.path.join(ROOT_DIR, "gcodes", "*.ngc"))))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results = dict((name, res) for name, res in results.items() if name.startswith(args.filter))
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,8 +29,23 @@ cp app.py "$BUILD_DIR"
 cp app_conf.py "$BUILD_DIR"
 cp app_db.py "$BUILD_DIR"
 cp cnc_agent.py "$BUILD_DIR"
+cp status_stream.py "$BUILD_DIR"
+cp poll_scheduler.py "$BUILD_DIR"
+cp gcode_parser.py "$BUILD_DIR"
+cp toolpath_cache.py "$BUILD_DIR"
+cp gcode_lines.py "$BUILD_DIR"
+cp position_history.py "$BUILD_DIR"
+cp cycle_time.py "$BUILD_DIR"
+cp preflight.py "$BUILD_DIR"
+cp static_assets.py "$BUILD_DIR"
 cp logger.py "$BUILD_DIR"
 cp utils.py "$BUILD_DIR"
+cp command_scheduler.py "$BUILD_DIR"
+cp jog_stream.py "$BUILD_DIR"
+cp cnc_supervisor.py "$BUILD_DIR"
+cp sessions.py "$BUILD_DIR"
+cp metrics.py "$BUILD_DIR"
+cp cnc_sim.py "$BUILD_DIR"
 
 cp ./templates/cnc_login.html "$BUILD_DIR"/templates/
 cp ./templates/cnc_main.html "$BUILD_DIR"/templates/
@@ -50,6 +65,9 @@ cp ./static/js/cnc_main.js "$BUILD_DIR"/static/js
 cp ./static/js/cnc_gcode_loader.js "$BUILD_DIR"/static/js
 cp ./static/js/common.module.js "$BUILD_DIR"/static/js
 
+# Precompressed variants of static files (gzip, brotli if installed)
+python static_assets.py "$BUILD_DIR"/static
+
 
 BUILD_NAME="../web_linuxcnc_"$APP_VERSION"_"$COMMIT_ID_SHORT"_"$BUILD_TIME".tar.gz"
 
@@ -1,20 +1,41 @@
 
-import linuxcnc
-import subprocess
+try:
+    import linuxcnc
+except ImportError:
+    # No linuxcnc on this box, simulated backend can be set (see set_backend)
+    linuxcnc = None
+import io
+import shutil
+import threading
 import time
 import os
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from datetime import datetime
+from cnc_supervisor import LinuxCNCSupervisor
+from command_scheduler import CommandScheduler, LANE_NORMAL, LANE_SAFETY, LANE_JOG, LANE_IO
+import gcode_lines
 import logger
+import metrics
+from position_history import PositionHistory
 
 import utils
 
+def set_backend(module):
+    """Use other implementation of linuxcnc module (e.g. cnc_sim). Call before worker creation"""
+    global linuxcnc
+    linuxcnc = module
+
 # *****************************************************
-# Class for work with cnc linuxcnctool table file
+# Class for work with cnc linuxcnctool table file.
+# Table is parsed once into dict by tool number and parsed again only
+# when file is changed by somebody else (linuxcnc, text editor).
+# File is rewritten atomically, previous versions are kept as backups
 # *****************************************************
 class ToolTableEditor():
-    def __init__(self, tbl_file_path="tool.tbl"):
+    def __init__(self, tbl_file_path="tool.tbl", backups_num=5):
         self.file = tbl_file_path
+        self.backups_num = backups_num      # number of kept previous file versions
         # file format demands strict order
         # 'parametr_name' <-> 'separator'
         self.parse_data = OrderedDict([
@@ -36,129 +57,117 @@ class ToolTableEditor():
             (';', '\n')
         ])
 
-    def read(self):
-        """Read current tool table file and return tool-data as json"""
-        logger.debug("Reading tool table file (%s) content.." % self.file)
+        self.tools = OrderedDict()  # tool number: tool data (in file order)
+        self.stamp = None           # (mtime, size, inode) of parsed file
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def file_stamp(path):
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def load(self):
+        """Parse tool table file if it was changed since last parsing"""
+        stamp = ToolTableEditor.file_stamp(self.file)
+        if stamp == self.stamp:
+            return
 
-        tools = []
+        logger.debug("Reading tool table file (%s) content..", self.file)
+        tools = OrderedDict()
+        with io.open(self.file, "r", encoding="utf-8", errors="replace") as file:
+            for line in file:
+                tool_data = self.parse_tool_line(line)
+                try:
+                    tools[int(tool_data["T"])] = tool_data
+                except (KeyError, ValueError):
+                    if tool_data:
+                        logger.error("Invalid .tbl line format detected")
+
+        self.tools = tools
+        self.stamp = stamp
 
+    def read(self):
+        """Read current tool table file and return tool-data as json"""
         try:
-            with open(self.file, "r") as file:
-                for line in file:
-                    if line != "\n":
-                        td = self.parse_tool_line(line)
-                        tools.append(td)
-            #logger.debug(tools)
+            with self.lock:
+                self.load()
+                tools = list(self.tools.values())
         except Exception as ex:
             logger.exception(ex)
             return {"result": {'text': str(ex), 'code': -1}}
 
         return {"result": {'text': "OK", 'code': 0}, "tools": tools}
 
-    def do_backup(method_to_decorate):
-        """Decorator to backup current tool table fiele"""
-        def wrapper(self, *args, **kwargs):
- 
-            backup_file = self.file + ".bak"
-            lines = []
-
-            try:
-                with open(self.file, "r") as file:
-                    for line in file:
-                        lines.append(line)
+    def backup_path(self, num):
+        return "%s.bak.%d" % (self.file, num)
 
-                #logger.info("Backuping ")
-                #logger.info(lines)
+    def backup(self):
+        """Shift backups and keep current file version as the newest one"""
+        if not os.path.exists(self.file):
+            return
 
-                with open(backup_file, "w") as file:
-                    file.writelines(lines)
+        for num in range(self.backups_num - 1, 0, -1):
+            if os.path.exists(self.backup_path(num)):
+                os.rename(self.backup_path(num), self.backup_path(num + 1))
 
-            except Exception as ex:
-                logger.exception(ex)
-                return {"result": {'text': str(ex), 'code': -1}}
+        # Current file is replaced by rename, so hard link keeps its content
+        try:
+            os.link(self.file, self.backup_path(1))
+        except OSError:
+            shutil.copy2(self.file, self.backup_path(1))
 
-            return method_to_decorate(self, *args, **kwargs)
+    def save(self, tools):
+        """Make backup and atomically rewrite tool table file with tools"""
+        self.backup()
 
-        return wrapper
+        tmp_path = self.file + ".tmp"
+        with io.open(tmp_path, "w", encoding="utf-8") as file:
+            for tool_data in tools.values():
+                file.write(self.format_tool_line(tool_data))
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(tmp_path, self.file)
 
-    @staticmethod
-    def find_between(str, start, end):
-        """Simple implementation of getting substr between two symbols from input str"""
-        istart = str.find(start)
-        if istart == -1:
-            return None
-        iend = str.find(end, istart)
-        if iend == -1:
-            return None
-
-        if (istart+1) == iend:
-            return ""
-
-        return str[istart+1 : iend]
+        self.tools = tools
+        self.stamp = ToolTableEditor.file_stamp(self.file)
 
     def parse_tool_line(self, line):
         """Get tool-data from current file line and return it as json"""
         # Input ex: T69 P69 X1 Y2 Z3 A4 B5 C6 U7 V8 W9 D33 I0 J5 Q9 ;Added 20210621
         tool_data = {}
 
-        # Lowercase comments to exclude it from parameters parsing
+        line = line.rstrip("\r\n")
         ci = line.find(';')
         if ci != -1:
-            ie = line.find('\n', ci)
-            if ie != -1:
-                old_comment = line[ci+1 : ie]   
-                new_comment = old_comment.lower()
-                line = line.replace(old_comment, new_comment)
-                line = line[:ie-1] + '\n' # exclude last 'space' symb also
-                #logger.debug("new line: '%s'" % line)
-
-        def get_if_exists (data, line, s, e): 
-            tmp = ToolTableEditor.find_between(line, s, e)
-            if tmp and (data != None):
-                data[s] = tmp 
-                
-        # Get tool data from formatted line 
-        for key, value in self.parse_data.iteritems():
-            get_if_exists( tool_data, line, key, value )
+            comment = line[ci+1:].rstrip()
+            if comment:
+                tool_data[';'] = comment
+            line = line[:ci]
 
-        return tool_data
+        for word in line.split():
+            key = word[0].upper()
+            if (key in self.parse_data) and (len(word) > 1):
+                tool_data[key] = word[1:]
 
-    @staticmethod
-    def tool_in_line(str, tool_num_arr):
-        tmp = ToolTableEditor.find_between(str, 'T', ' ')
-        if (tmp == None) or (str[0] != 'T'):
-            logger.error("Invalid .tbl line format detected")
-            return False
+        return tool_data
 
-        for tool_num in tool_num_arr:
-            if tool_num == int(tmp):
-                return True
+    def format_tool_line(self, tool_data):
+        """Make file line from tool-data in specified format"""
+        line = u""
+        for key in self.parse_data:
+            if key in tool_data:
+                line += u"%s%s " % (key, tool_data[key])
+        return line + u"\n"
 
-        return False
-
-    @staticmethod
-    def add_if_exists(line, idx, data, key):
-            try:
-                value = str(data[key])
-                line[idx] += key
-                line[idx] += value
-                line[idx] += " "
-                #logger.debug("line '%s'" % line[idx])
-            except KeyError:
-                pass
-            except Exception as ex:
-                logger.exception(ex)
+    def clean_tool_data(self, tool_data):
+        """Keep only known parameters as strings"""
+        return dict((key, u"%s" % value) for key, value in tool_data.items()
+                    if (key in self.parse_data) and (u"%s" % value != u""))
 
     def add(self, tool_data):
         """Save new tool in tool table file"""
-        # make str as list to be changable object 
-        tool_line = [""]
-
-        tool_num_arr = []
-
-        # check if determined tool already exists in file
         try:
-            tool_num_arr[0] = int(tool_data["T"])
+            tool_num = int(tool_data["T"])
         except KeyError:
             logger.error("No tool-number provided. Ignoring adding")
             return {"result": {'text': "No tool-number provided", 'code': -1}}
@@ -166,27 +175,18 @@ class ToolTableEditor():
             logger.exception(ex)
             return {"result": {'text': str(ex), 'code': -2}}
 
-        with open(self.file, "r") as file:
-            for line in file:
-                if ToolTableEditor.tool_in_line(line, tool_num_arr):
-                    logger.info("Tool (%d) already exists in .tbl file. Ignoring adding" % tool_num_arr[0])
+        try:
+            with self.lock:
+                self.load()
+                # check if determined tool already exists in file
+                if tool_num in self.tools:
+                    logger.info("Tool (%d) already exists in .tbl file. Ignoring adding", tool_num)
                     return {"result": {'text': "already exists in .tbl file", 'code': 1}}
 
-        # Fill line that will be written to the file with tool data in specified format
-        for key in self.parse_data:
-            ToolTableEditor.add_if_exists(tool_line, 0, tool_data, key)
-
-        logger.debug("Adding line '%s' to .tbl file" % tool_line[0])
-
-        if tool_line[0] == "":
-            logger.debug("Tool-line is empty. Ignoring adding")
-            return {"result": {'text': "Invalid tool-data provided", 'code': -3}}
-
-        tool_line[0] += "\n"
-
-        try:
-            with open(self.file, "a") as file:
-                file.write(tool_line[0])
+                tools = OrderedDict(self.tools)
+                tools[tool_num] = self.clean_tool_data(tool_data)
+                logger.debug("Adding tool %d to .tbl file", tool_num)
+                self.save(tools)
 
         except Exception as ex:
             logger.exception(ex)
@@ -194,27 +194,22 @@ class ToolTableEditor():
 
         return {"result": {'text': "OK", 'code': 0}}
 
-    @do_backup
     def remove(self, tool_num_arr):
         """Delete array of tools from tool table file"""
-        logger.info("Removing tools: " + str(tool_num_arr))
+        logger.info("Removing tools: %s", tool_num_arr)
 
         # Ignore Dummy deletion
         for tool_num in tool_num_arr:
             if tool_num < 0:
                 return {"result": {'text': "OK", 'code': 0}}
 
-        new_lines = []
-
         try:
-            with open(self.file, "r") as file:
-                for line in file:
-                    # create new lines list (file content) without determined tool_num
-                    if not ToolTableEditor.tool_in_line(line, tool_num_arr):
-                        new_lines.append(line)
-
-            with open(self.file, "w") as file:
-                file.writelines(new_lines)
+            with self.lock:
+                self.load()
+                removed = set(int(tool_num) for tool_num in tool_num_arr)
+                tools = OrderedDict((num, tool_data) for num, tool_data in self.tools.items()
+                                    if num not in removed)
+                self.save(tools)
 
         except Exception as ex:
             logger.exception(ex)
@@ -222,21 +217,18 @@ class ToolTableEditor():
 
         return {"result": {'text': "OK", 'code': 0}}
 
-    @do_backup
     def update(self, tools_data_arr):
         """Make backup and rewrite current .tbl file with new tools array"""
-        tools_lines = [""]
-        idx = 0
-        # Fill lines that will be written to the file with tool data in specified format
+        tools = OrderedDict()
         for tool_data in tools_data_arr:
-            for key in self.parse_data:
-                ToolTableEditor.add_if_exists(tools_lines, idx, tool_data, key)
-            tools_lines[idx] += "\n"
-            ++idx
+            try:
+                tools[int(tool_data["T"])] = self.clean_tool_data(tool_data)
+            except (KeyError, ValueError):
+                logger.error("Invalid tool-data provided: %s", tool_data)
 
         try:
-            with open(self.file, "w") as file:
-                file.writelines(tools_lines)
+            with self.lock:
+                self.save(tools)
 
         except Exception as ex:
             logger.exception(ex)
@@ -244,17 +236,299 @@ class ToolTableEditor():
 
         return {"result": {'text': "OK", 'code': 0}}
 
+# *****************************************************
+# Compact record of readable cnc status values. Made once per status poll
+# and shared by all status consumers
+# *****************************************************
+class StatusSnapshot(object):
+    # Fields sent to clients
+    FIELDS = ("position", "estop", "task_state", "task_mode", "homed",
+              "current_line", "motion_line", "motion_mode", "motion_type",
+              "read_line", "interp_state", "file", "command", "tool_in_spindle")
+
+    __slots__ = FIELDS + ("current_vel",)
+
+    TASK_STATES = ("off", "on", "estop", "estop_reset")
+    ESTOP_STATES = ("estop reset", "estop")
+    TASK_MODES = ("unknown", "manual", "auto", "mdi")
+    INTERP_STATES = ("unknown", "idle", "reading", "paused", "waiting")
+
+    def __init__(self, status):
+        # Conversion to readable values
+        if status.task_state == 2:
+            self.task_state = "off"
+        elif status.task_state == 4:
+            self.task_state = "on"
+        else:
+            self.task_state = "estop" if status.estop else "estop_reset"
+
+        self.position = tuple(status.position[:3])
+        self.estop = StatusSnapshot.ESTOP_STATES[status.estop]
+        self.task_mode = StatusSnapshot.TASK_MODES[status.task_mode]
+        self.homed = status.homed
+        self.current_line = status.current_line
+        self.motion_line = status.motion_line
+        self.motion_mode = status.motion_mode
+        self.motion_type = status.motion_type
+        self.read_line = status.read_line
+        self.interp_state = StatusSnapshot.INTERP_STATES[status.interp_state]
+        self.file = status.file
+        self.command = status.command
+        self.tool_in_spindle = status.tool_in_spindle
+        self.current_vel = status.current_vel
+
+    def is_moving(self):
+        """Program is running or axis is jogging"""
+        return (self.interp_state not in ("idle", "unknown")) or (self.current_vel > 0)
+
+    def delta(self, prev_snapshot):
+        """Get names of fields that differ from previous snapshot"""
+        return [name for name in StatusSnapshot.FIELDS
+                if getattr(self, name) != getattr(prev_snapshot, name)]
+
+    def to_response(self, fields=FIELDS):
+        """Make readable dict with given snapshot fields"""
+        response = {"result": {'text':"OK", 'code': 0}}
+        for name in fields:
+            response[name] = getattr(self, name)
+
+        if "position" in response:
+            x, y, z = self.position
+            response["position"] = {'x': x, 'y': y, 'z': z}
+
+        return response
+
+# *****************************************************
+# Background thread that keeps linuxcnc status channel open, polls it at
+# high rate and publishes status snapshots. Published snapshots are never
+# changed, so IOLoop reads the last one without any locking
+# *****************************************************
+class StatusPoller(threading.Thread):
+    def __init__(self, period_ms=20, history=None):
+        super(StatusPoller, self).__init__(name="StatusPoller")
+        self.daemon = True
+        self.period = period_ms / 1000.0    # poll period [sec]
+        self.running = True    # cleared by stop(), also before thread is started
+        self.wakeup = threading.Event()
+        self.history = history              # position samples recorded at every poll
+
+        # Published data
+        self.snapshot = None
+        self.cnc_alive = False
+
+    def run(self):
+        logger.debug("Status poller started (period: %d ms)", self.period * 1000)
+        status = None
+
+        while self.running:
+            start = time.time()
+
+            try:
+                # Channel is reopened only after failure (linuxcnc restart)
+                if status is None:
+                    status = linuxcnc.stat()
+                status.poll()
+                metrics.STAT_POLL.observe(time.time() - start)
+                snapshot = StatusSnapshot(status)
+                if self.history is not None:
+                    self.history.record(snapshot.position, snapshot.motion_line, start)
+                self.snapshot = snapshot
+                self.cnc_alive = True
+            except Exception:
+                status = None
+                self.cnc_alive = False
+                metrics.STAT_FAILURES.inc()
+
+            self.wakeup.wait(max(0, self.period - (time.time() - start)))
+            self.wakeup.clear()
+
+        logger.debug("Status poller stopped")
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def set_period(self, period_ms):
+        """Change poll period. New period is applied immediately"""
+        self.period = period_ms / 1000.0
+        self.wakeup.set()
+
+# *****************************************************
+# Record of linuxcnc error message stored in errors ring buffer
+# *****************************************************
+class ErrorRecord(object):
+    __slots__ = ("id", "kind", "type", "text", "time", "repeat",
+                 "last_time", "seq", "publish_time", "dirty")
+
+    def __init__(self, error_id, kind, text, now):
+        if kind in (linuxcnc.NML_ERROR, linuxcnc.OPERATOR_ERROR):
+            self.type = "error"
+        else:
+            self.type = "info"
+        self.id = error_id
+        self.kind = kind
+        self.text = text
+        self.repeat = 1
+        self.last_time = now
+        self.time = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+
+        # publishing state
+        self.seq = 0
+        self.publish_time = 0
+        self.dirty = False
+
+    def to_dict(self):
+        return {"kind": self.kind,
+                "type": self.type,
+                "text": self.text,
+                "time": self.time,
+                "id": self.id,
+                "repeat": self.repeat,
+        }
+
+# *****************************************************
+# Background thread that waits for linuxcnc error messages and stores
+# them in bounded ring buffer. Identical errors repeated within coalesce
+# period are merged into one record with repeat counter
+# *****************************************************
+class ErrorReader(threading.Thread):
+    def __init__(self, buffer_size=256, coalesce_period_ms=1000, period_ms=10, first_id=0):
+        super(ErrorReader, self).__init__(name="ErrorReader")
+        self.daemon = True
+        self.period = period_ms / 1000.0                 # channel poll period [sec]
+        self.coalesce_period = coalesce_period_ms / 1000.0
+        self.running = True    # cleared by stop(), also before thread is started
+        self.reopen_channel = False
+        self.wakeup = threading.Event()
+
+        self.lock = threading.Lock()
+        self.records = deque(maxlen=buffer_size)
+        self.next_id = first_id
+        self.seq = 0            # incremented on every published change
+        self.dirty_num = 0      # repeats that are not published yet
+
+    def run(self):
+        logger.debug("Error reader started (buffer: %d)", self.records.maxlen)
+        channel = None
+
+        while self.running:
+            try:
+                if (channel is None) or self.reopen_channel:
+                    self.reopen_channel = False
+                    channel = linuxcnc.error_channel()
+                error = channel.poll()
+            except Exception:
+                channel = None
+                error = None
+
+            if error:
+                kind, text = error
+                self.add(kind, text)
+                # Read all queued errors without delay
+                continue
+
+            self.wakeup.wait(max(self.period, 0.5) if channel is None else self.period)
+            self.wakeup.clear()
+
+        logger.debug("Error reader stopped")
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def set_period(self, period_ms):
+        """Change channel poll period. New period is applied immediately"""
+        self.period = period_ms / 1000.0
+        self.wakeup.set()
+
+    def reopen(self):
+        """Reopen error channel (after linuxcnc restart)"""
+        self.reopen_channel = True
+
+    def publish(self, record, now):
+        self.seq += 1
+        record.seq = self.seq
+        record.publish_time = now
+        if record.dirty:
+            record.dirty = False
+            self.dirty_num -= 1
+
+    def add(self, kind, text):
+        now = time.time()
+
+        with self.lock:
+            last = self.records[-1] if self.records else None
+
+            # Coalesce storm of identical errors
+            if (last is not None) and (last.kind == kind) and (last.text == text) and \
+               (now - last.last_time) < self.coalesce_period:
+                last.repeat += 1
+                last.last_time = now
+                last.time = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+                if (now - last.publish_time) >= self.coalesce_period:
+                    self.publish(last, now)
+                elif not last.dirty:
+                    last.dirty = True
+                    self.dirty_num += 1
+                return
+
+            if (last is not None) and last.dirty:
+                self.publish(last, now)
+
+            record = ErrorRecord(self.next_id, kind, text, now)
+            self.next_id += 1
+            self.records.append(record)
+            self.publish(record, now)
+
+    def changed_since(self, seq):
+        """Get records published after given sequence number and current sequence number"""
+        now = time.time()
+
+        with self.lock:
+            # Publish pending repeats once per coalesce period
+            if self.dirty_num:
+                for record in self.records:
+                    if record.dirty and (now - record.publish_time) >= self.coalesce_period:
+                        self.publish(record, now)
+
+            if seq == self.seq:
+                return [], seq
+
+            changed = [record.to_dict() for record in self.records if record.seq > seq]
+            return changed, self.seq
+
+    def after(self, error_id):
+        """Get buffered records with id greater than given one"""
+        with self.lock:
+            return [record.to_dict() for record in self.records if record.id > error_id]
+
 # *****************************************************
 # Class to poll linuxcnc for status.  Other classes can request to be notified
 # when a poll happens with the add/del_observer methods
 # *****************************************************
 class LinuxCNCWorker(object):
-    def __init__(self, ini_file_path="axis_mm.ini"):
+    # Commands that only read memory (or start a thread) and are handled right away
+    INLINE_CMDS = frozenset(["current_state", "ini_params", "errors_history", "position_history",
+                             "command_latency", "start_cnc", "supervisor_state"])
+    # Commands doing file and line index work, run on io lane
+    IO_CMDS = frozenset(["gcode_content", "gcode_lines", "gcode_tools",
+                         "tools_data", "delete_tools", "update_tools"])
+    # Commands run on safety lane (with own command channel), preempting queued commands
+    SAFETY_CMDS = frozenset(["stop_gcode", "pause_gcode"])
+    SAFETY_STATES = frozenset(["estop", "off"])
+
+    def __init__(self, ini_file_path="axis_mm.ini", status_poll_period_ms=20,
+                 errors_buffer_size=256, errors_coalesce_period_ms=1000, cache_dir="cache",
+                 position_history_size=65536, supervisor_settings=None):
 
         # open communications with linuxcnc
         self.status = linuxcnc.stat()
-        self.errors = linuxcnc.error_channel()
         self.command = linuxcnc.command()
+        # separate channels of safety and jog lanes, not shared with waiting normal commands
+        self.lane_commands = {}
+        self.open_lane_channels()
+        # command channel used by current lane thread
+        self.lane_channel = threading.local()
 
         # create dictionary with supported commands
         self.init_cmd_dict()
@@ -263,7 +537,7 @@ class LinuxCNCWorker(object):
             self.status.poll()
             self.is_alive = True
         except linuxcnc.error, detail:
-            logger.exception("linuxcnc not running (%s)" % detail)
+            logger.exception("linuxcnc not running (%s)", detail)
             self.is_alive = False
 
         # error data
@@ -272,19 +546,48 @@ class LinuxCNCWorker(object):
         
         # linuxcnc ini file for start
         self.ini_file = os.path.abspath(ini_file_path)
-        logger.info("Using cnc ini file: " + self.ini_file)
+        logger.info("Using cnc ini file: %s", self.ini_file)
         self.ini = linuxcnc.ini(self.ini_file)
 
+        # linuxcnc process launching and restarts
+        self.supervisor = LinuxCNCSupervisor(self.ini_file, lambda: self.poller.cnc_alive,
+                                             **(supervisor_settings or {}))
+
         # register listeners
         self.status_observers = [] 
         self.errors_observers = [] 
 
+        # last status snapshot delivered to observers
+        self.snapshot = None
+        self.position_history = PositionHistory(position_history_size)
+        self.poller = StatusPoller(status_poll_period_ms, self.position_history)
+        self.poller.start()
+
+        # errors history, last error sequence number delivered to observers
+        self.errors_seq = 0
+        self.error_reader = ErrorReader(errors_buffer_size, errors_coalesce_period_ms)
+        self.error_reader.start()
+
+        # line indexes of opened g-code files
+        self.gcode_lines = gcode_lines.GcodeLines(cache_dir)
+
+        # linuxcnc commands (and self.status/self.command usage) are serialized
+        # on scheduler lanes, so waiting for command completion doesn't block IOLoop
+        self.scheduler = CommandScheduler()
+
         # tool table editor
         self.init_tool_table_editor()
 
+    def open_lane_channels(self):
+        self.lane_commands = {
+            LANE_SAFETY: linuxcnc.command(),
+            LANE_JOG: linuxcnc.command(),
+        }
+
     def set_ini_file(self, ini_file_path):
-        logger.debug("Setting cnc ini file: " + ini_file_path)
+        logger.debug("Setting cnc ini file: %s", ini_file_path)
         self.ini_file = ini_file_path
+        self.supervisor.ini_file = ini_file_path
         if hasattr(self, 'ini'): del self.ini
         self.ini = linuxcnc.ini(self.ini_file)
         self.init_tool_table_editor()
@@ -324,107 +627,61 @@ class LinuxCNCWorker(object):
         self.errors_obervers = []
 
     def poll_errors(self):
+        """Deliver errors stored by error reader to observers"""
+        start = time.time()
+        errors, self.errors_seq = self.error_reader.changed_since(self.errors_seq)
+
+        for error in errors:
+            self.last_error_text = error
+            self.last_error_id = max(self.last_error_id, error["id"] + 1)
+            # notify all obervers about error
+            for observer in list(self.errors_observers):
+                try:
+                    observer(error)
+                except Exception as ex:
+                    self.del_errors_observer(observer)
 
-        if (not self.is_alive):
-            return
+        metrics.POLL_ERRORS.observe(time.time() - start)
 
-        try:    
-            if hasattr(self, 'errors'): del self.errors
-            self.errors = linuxcnc.error_channel()
-            error = self.errors.poll()
-
-            if error:
-                kind, text = error
-                if kind in (linuxcnc.NML_ERROR, linuxcnc.OPERATOR_ERROR):
-                    typus = "error"
-                else:
-                    typus = "info"
-                now = datetime.now() # current date and time
-                self.last_error_text = {"kind": kind, 
-                                        "type": typus, 
-                                        "text": text, 
-                                        "time": now.strftime("%Y-%m-%d %H:%M:%S"), 
-                                        "id": self.last_error_id 
-                }
-                self.last_error_id = self.last_error_id + 1 
-                # notify all obervers about error
-                for observer in self.errors_observers:
-                    try:
-                        observer(self.last_error_text)
-                    except Exception as ex:
-                        self.del_errors_observer(observer)
-        except:
-            self.errors = None
+    def get_errors_after(self, error_id):
+        """Get buffered errors with id greater than given one"""
+        return self.error_reader.after(error_id)
 
     def poll_status(self):
+        """Take last snapshot published by status poller and notify observers"""
+        start = time.time()
+        alive = self.poller.cnc_alive
 
-        # update linuxcnc status
-        try:
-
-            # Close prevoius channels to prevent memory leaks
-            if hasattr(self, 'status'): del self.status
+        if alive and (not self.is_alive):
+            logger.info("linuxcnc is available")
+            # Reopen command channels after linuxcnc restart
             self.status = linuxcnc.stat()
-            self.status.poll()
-            if (not self.is_alive):
-                logger.info("linuxcnc is available")
-            self.is_alive = True
-            #logger.debug("status poller: position x: %f, y: %f, z: %f" % (self.status.position[0], self.status.position[1], self.status.position[2]))
-        except:
-            self.status = None
+            self.command = linuxcnc.command()
+            self.open_lane_channels()
+            self.error_reader.reopen()
+        elif (not alive) and self.is_alive:
+            logger.error("linuxcnc is unavailable")
             self.command = None
-            if (self.is_alive):
-                logger.error("linuxcnc is unavailable")
-            self.is_alive = False
-            #logger.info("linuxcnc poll failed")
+
+        self.is_alive = alive
 
         # notify all obervers of new status data poll
-        if (self.is_alive):
+        snapshot = self.poller.snapshot
+        if self.is_alive and (snapshot is not self.snapshot):
+            self.snapshot = snapshot
             for observer in self.status_observers:
                 try:
-                    observer(self.status)
+                    observer(snapshot)
                 except Exception as ex:
                     self.del_status_observer(observer)
 
-    """ Commands sections """
-    def start_linuxcnc(self, tries_num=3):
-
-        logger.debug("start_linuxcnc() %s" % self.ini_file)
-        p = subprocess.Popen(['pidof', '-x', 'linuxcnc'], stdout=subprocess.PIPE )
-        result = p.communicate()[0]
-        # Already running
-        if len(result) > 0:
-            logger.debug("linuxcnc already running. ignoring")
-            return {"result": {'text':"already running. ignoring", 'code': -1}}
-
-        #subprocess.Popen(['linuxcnc', self.ini_file], stderr=subprocess.STDOUT )
-        for try_n in range(tries_num):
-            logger.debug("Trying to start linuxcnc (%i).." % try_n)
-            cmd = "linuxcnc " + self.ini_file + " 1>/dev/null 2>/dev/null &"
-            if (os.system(cmd) == 0): 
-                break
-
-        if try_n == tries_num:
-            return {"result": {'text':"linuxcnc start error", 'code': -2}}
-
-        # Wait linuxcnc start
-        while not self.is_alive:
-            self.poll_status()
-            time.sleep(0.3)
+        metrics.POLL_STATUS.observe(time.time() - start)
 
-        logger.debug("linuxcnc start success")
-
-        if hasattr(self, 'status'): del self.status
-        if hasattr(self, 'errors'): del self.errors
-        if hasattr(self, 'command'): del self.command
-
-        self.status = linuxcnc.stat()
-        self.errors = linuxcnc.error_channel()
-        self.command = linuxcnc.command()
-
-        # TODO: Wait axis gui to Clear opened gcode file
-        #self.execute_cmd("reset_interpreter")
-
-        return {"result": {'text':"OK", 'code': 0}}
+    """ Commands sections """
+    def start_linuxcnc(self):
+        """Start linuxcnc with supervisor. Returns at once, progress is reported to supervisor observers"""
+        logger.debug("start_linuxcnc() %s", self.ini_file)
+        return self.supervisor.start()
 
     def stop_linuxcnc(self):
         #TODO
@@ -446,11 +703,12 @@ class LinuxCNCWorker(object):
         #if (not self.is_alive):
         #    return {"result": {'text': "linuxcnc is not running", 'code': -2}}
 
-        if self.command is not None:
+        command = getattr(self.lane_channel, "command", None) or self.command
+        if command is not None:
             # Execute given command
-            self.command.__getattribute__( cmd_name )( *cmd_args )
+            command.__getattribute__( cmd_name )( *cmd_args )
 
-            ret = self.command.wait_complete(cmd_tmout)
+            ret = command.wait_complete(cmd_tmout)
 
             #logger.debug("command result: " + str(ret) + '  ' + str(linuxcnc.RCS_EXEC) + '  ' + str(linuxcnc.RCS_ERROR))
 
@@ -477,34 +735,7 @@ class LinuxCNCWorker(object):
     # Make readable dict from current cnc status
     @staticmethod
     def current_status_to_response(status):
-        # Conversion to readable values
-        if status.task_state == 2:
-            task_state = "off"
-        elif status.task_state == 4:
-            task_state = "on"
-        else:
-            task_state = "estop" if status.estop else "estop_reset"
-
-        estop_state = ("estop reset", "estop")
-        task_modes = ("unknown", "manual", "auto", "mdi")
-        interp_states = ("unknown", "idle", "reading", "paused", "waiting")
-
-        return {"result": {'text':"OK", 'code': 0},
-                "position": {'x': status.position[0], 'y': status.position[1], 'z': status.position[2]},
-                "estop": estop_state[status.estop],
-                "task_state": task_state,
-                "task_mode": task_modes[status.task_mode],
-                "homed": status.homed,
-                "current_line": status.current_line,
-                "motion_line": status.motion_line,
-                "motion_mode": status.motion_mode,
-                "motion_type": status.motion_type,
-                "read_line": status.read_line,
-                "interp_state": interp_states[status.interp_state],
-                "file": status.file,
-                "command": status.command,
-                "tool_in_spindle": status.tool_in_spindle,
-        } 
+        return StatusSnapshot(status).to_response()
 
     # Start linuxcnc with request from UI
     def start_cnc(self, cmd_args):
@@ -514,15 +745,14 @@ class LinuxCNCWorker(object):
     def stop_cnc(self, cmd_args):
         return self.stop_linuxcnc()
 
-    # Get current linuxcnc status
+    # Get current linuxcnc status (last snapshot of status poller)
     @check_linuxcnc_availability
     def get_current_state(self, cmd_args):
-        try:
-            self.status.poll()
-        except linuxcnc.error, detail:
-            return {"result": {'text':"poll failed", 'code': detail}}
+        snapshot = self.poller.snapshot
+        if snapshot is None:
+            return {"result": {'text':"poll failed", 'code': -1}}
 
-        return LinuxCNCWorker.current_status_to_response(self.status)
+        return snapshot.to_response()
 
     def set_state(self, cmd_args):
         """Set new cnc machine state ['on', 'off', 'estop', 'estop_reset']"""
@@ -605,6 +835,27 @@ class LinuxCNCWorker(object):
 
         return ret 
 
+    def ensure_manual_mode(self):
+        """Switch to manual mode unless last status snapshot is already in it"""
+        snapshot = self.poller.snapshot
+        if (snapshot is not None) and (snapshot.task_mode == "manual"):
+            return {"result": {'text':"OK", 'code': 0}}
+
+        return self.execute_cmd("mode", 0, linuxcnc.MODE_MANUAL)
+
+    # action - 'continuous', 'increment' or 'stop'
+    def jog(self, action, axis_num, vel=0, dist=0):
+        if action == "stop":
+            return self.execute_cmd("jog", 0, linuxcnc.JOG_STOP, axis_num)
+
+        res = self.ensure_manual_mode()
+        if res["result"]["code"] != 0:
+            return res
+
+        if action == "continuous":
+            return self.execute_cmd("jog", 0, linuxcnc.JOG_CONTINUOUS, axis_num, vel)
+        return self.execute_cmd("jog", 0, linuxcnc.JOG_INCREMENT, axis_num, vel, dist)
+
     # cmd_args - dictionary: axis_number (int)
     def move_axis_stop(self, cmd_args):
         try:
@@ -613,7 +864,7 @@ class LinuxCNCWorker(object):
             logger.exception(ex)
             return {"result": {"text": str(ex), "code": -1}}
 
-        return self.execute_cmd("jog", 0, linuxcnc.JOG_STOP, axis_num)
+        return self.jog("stop", axis_num)
 
     # cmd_args - dictionary: axis_number, velocity (int, int)
     def move_axis_continuous(self, cmd_args):
@@ -624,8 +875,7 @@ class LinuxCNCWorker(object):
             logger.exception(ex)
             return {"result": {"text": str(ex), "code": -1}}
 
-        self.execute_cmd("mode", 0, linuxcnc.MODE_MANUAL)
-        return self.execute_cmd("jog", 0, linuxcnc.JOG_CONTINUOUS, axis_num, vel)
+        return self.jog("continuous", axis_num, vel)
 
     # cmd_args - dictionary: axis_number, velocity, distance (int, int, int)
     def move_axis_increment(self, cmd_args):
@@ -637,8 +887,7 @@ class LinuxCNCWorker(object):
             logger.exception(ex)
             return {"result": {"text": str(ex), "code": -1}}
 
-        self.execute_cmd("mode", 0, linuxcnc.MODE_MANUAL)
-        return self.execute_cmd("jog", 0, linuxcnc.JOG_INCREMENT, axis_num, vel, dist)
+        return self.jog("increment", axis_num, vel, dist)
 
     #
     @check_linuxcnc_availability
@@ -671,13 +920,81 @@ class LinuxCNCWorker(object):
         #logger.debug(ini_info)
         return ini_info 
 
+    def linear_units_scale(self):
+        """Millimeters in machine linear unit (toolpaths are in mm)"""
+        units = (self.ini.find("TRAJ", "LINEAR_UNITS") or "mm").strip().lower()
+        return 25.4 if units in ("inch", "in", "imperial") else 1.0
+
+    def get_soft_limits(self):
+        """Get (min, max) soft limits of XYZ axes in mm (None - not limited) or None if unknown"""
+        ini_params = self.get_ini_params()
+        if "axis_info" not in ini_params:
+            return None
+
+        try:
+            scale = self.linear_units_scale()
+            limits = []
+            for axis in ini_params["axis_info"][:3]:
+                limits.append((float(axis["min_limit"]) * scale if "min_limit" in axis else None,
+                               float(axis["max_limit"]) * scale if "max_limit" in axis else None))
+        except Exception as ex:
+            logger.exception(ex)
+            return None
+
+        return limits
+
+    def get_work_offset(self):
+        """Get offset of program XYZ coordinates from machine ones in mm: G5x + G92 + tool offset"""
+        try:
+            self.status.poll()
+            scale = self.linear_units_scale()
+            return [(self.status.g5x_offset[axis] + self.status.g92_offset[axis] +
+                     self.status.tool_offset[axis]) * scale for axis in range(3)]
+        except Exception as ex:
+            logger.debug("Work offset is unknown: %s", ex)
+            return [0.0, 0.0, 0.0]
+
+    def find_float(self, section, *names):
+        """Get first found ini parameter of section as float or None"""
+        for name in names:
+            value = self.ini.find(section, name)
+            if value:
+                return float(value)
+        return None
+
+    def get_motion_limits(self):
+        """Get trajectory and XYZ axes velocity/acceleration limits [mm/sec] like toolpaths"""
+        limits = {
+            "max_velocity": self.find_float("TRAJ", "MAX_LINEAR_VELOCITY", "MAX_VELOCITY"),
+            "max_acceleration": self.find_float("TRAJ", "MAX_LINEAR_ACCELERATION", "MAX_ACCELERATION"),
+            "default_velocity": self.find_float("TRAJ", "DEFAULT_LINEAR_VELOCITY", "DEFAULT_VELOCITY"),
+            "axis_velocity": [],
+            "axis_acceleration": [],
+        }
+        for axis, letter in enumerate("XYZ"):
+            # linuxcnc 2.7 numbers axes sections, 2.8 names them by letter
+            sections = ("AXIS_" + str(axis), "AXIS_" + letter)
+            velocity = [self.find_float(section, "MAX_VELOCITY") for section in sections]
+            acceleration = [self.find_float(section, "MAX_ACCELERATION") for section in sections]
+            limits["axis_velocity"].append(velocity[0] or velocity[1] or float("inf"))
+            limits["axis_acceleration"].append(acceleration[0] or acceleration[1] or float("inf"))
+
+        scale = self.linear_units_scale()
+        for name in ("max_velocity", "max_acceleration", "default_velocity"):
+            if limits[name] is not None:
+                limits[name] *= scale
+        for name in ("axis_velocity", "axis_acceleration"):
+            limits[name] = [value * scale for value in limits[name]]
+
+        return limits
+
     # Save new gcode file from client and push it to linuxcnc
     @check_linuxcnc_availability
     def load_gcode_file(self, cmd_args=None):
         res = { "result": {'text':"OK", 'code': 0} }
 
         path = os.path.join( "/tmp", cmd_args["name"] )
-        logger.debug("saving gcode file: " + path)
+        logger.debug("saving gcode file: %s", path)
             
         try:
             fo = open( path, 'w' )
@@ -697,10 +1014,19 @@ class LinuxCNCWorker(object):
                 res['result']['code'] = -2
 
         if (res['result']['code'] == 0):
-            self.reset_interpreter()
-            self.execute_cmd("mode", 3, linuxcnc.MODE_AUTO)
-            res = self.execute_cmd("program_open", 5, path)
-            self.execute_cmd("mode", 3, linuxcnc.MODE_MANUAL)
+            res = self.open_gcode_file(path)
+
+        return res
+
+    # Push saved gcode file to linuxcnc
+    @check_linuxcnc_availability
+    def open_gcode_file(self, path):
+        self.reset_interpreter()
+        # Trail restored by reconnected clients starts with new program
+        self.position_history.clear()
+        self.execute_cmd("mode", 3, linuxcnc.MODE_AUTO)
+        res = self.execute_cmd("program_open", 5, path)
+        self.execute_cmd("mode", 3, linuxcnc.MODE_MANUAL)
 
         return res
 
@@ -712,7 +1038,8 @@ class LinuxCNCWorker(object):
         except:
             line_no = 0
 
-        logger.debug("Starting g-code from line: " + str(line_no));
+        logger.debug("Starting g-code from line: %s", line_no);
+        self.position_history.clear()
 
         return self.execute_cmd("auto", 0, linuxcnc.AUTO_RUN, line_no)
 
@@ -746,25 +1073,82 @@ class LinuxCNCWorker(object):
 
     @check_linuxcnc_availability
     def get_gcode_content(self, cmd_args=None):
-        try:
-            self.status.poll()
-        except linuxcnc.error, detail:
-            return {"result": {'text':"poll failed", 'code': detail}}
+        snapshot = self.poller.snapshot
+        if snapshot is None:
+            return {"result": {'text':"poll failed", 'code': -1}}
 
-        if(self.status.file == ""):
+        if(snapshot.file == ""):
             logger.debug("No gcode file opened")
             return {"result": {'text':"OK", 'code': 0}, "content": ""}
 
-        logger.debug("Getting gcode file (%s) content.." % self.status.file)
-
-        content = ""
+        logger.debug("Getting gcode file (%s) content..", snapshot.file)
 
-        with open(self.status.file, "r") as file:
-            for line in file:
-                content += line
+        with open(snapshot.file, "r") as file:
+            content = file.read()
 
         return {"result": {'text':"OK", 'code': 0}, "content": content}
 
+    def get_gcode_index(self):
+        """Get line index of current g-code file or None if no file opened"""
+        snapshot = self.snapshot or self.poller.snapshot
+        if (snapshot is None) or (snapshot.file == ""):
+            return None
+        return self.gcode_lines.get(snapshot.file)
+
+    def get_gcode_lines(self, cmd_args=None):
+        """Get 'count' lines of current g-code file starting from line number 'from'"""
+        try:
+            first = int(cmd_args["from"]) if cmd_args and ("from" in cmd_args) else 1
+            count = int(cmd_args["count"]) if cmd_args and ("count" in cmd_args) else 100
+            count = max(0, min(count, 1000))
+            index = self.get_gcode_index()
+        except Exception as ex:
+            logger.exception(ex)
+            return {"result": {"text": str(ex), "code": -1}}
+
+        if index is None:
+            return {"result": {'text':"OK", 'code': 0}, "from": 1, "total": 0, "lines": []}
+
+        first = max(1, first)
+        return {"result": {'text':"OK", 'code': 0}, "from": first, "total": index.lines_num,
+                "lines": index.lines(first, count)}
+
+    def get_gcode_tools(self, cmd_args=None):
+        """Get [line number, tool number] pairs of tool selections in current g-code file"""
+        try:
+            index = self.get_gcode_index()
+            tools = sorted(index.get_tools().items()) if index is not None else []
+        except Exception as ex:
+            logger.exception(ex)
+            return {"result": {"text": str(ex), "code": -1}}
+
+        return {"result": {'text':"OK", 'code': 0}, "tools": tools}
+
+    def get_position_history(self, cmd_args=None):
+        """Get position samples since 'since_time' [sec] and/or 'since_line', at most 'max_points'"""
+        try:
+            args = cmd_args or {}
+            since_time = float(args["since_time"]) if "since_time" in args else None
+            since_line = int(args["since_line"]) if "since_line" in args else None
+            max_points = min(int(args.get("max_points", 2000)), 100000)
+            history = self.position_history.query(since_time, since_line, max_points)
+        except Exception as ex:
+            logger.exception(ex)
+            return {"result": {"text": str(ex), "code": -1}}
+
+        history["result"] = {'text':"OK", 'code': 0}
+        return history
+
+    def get_errors_history(self, cmd_args=None):
+        """Get buffered errors with id greater than 'after_id' (all by default)"""
+        try:
+            after_id = int(cmd_args["after_id"]) if cmd_args else -1
+        except Exception as ex:
+            logger.exception(ex)
+            return {"result": {"text": str(ex), "code": -1}}
+
+        return {"result": {'text':"OK", 'code': 0}, "errors": self.get_errors_after(after_id)}
+
     def tool_change(self, cmd_args=None):
         """TODO: signal hal_manualtoolchange component"""
         utils.tool_change()
@@ -807,7 +1191,7 @@ class LinuxCNCWorker(object):
             logger.exception(ex)
             return {"result": {"text": str(ex), "code": -1}}
             
-        logger.debug("Running MDI command: %s" % mdi_cmd)
+        logger.debug("Running MDI command: %s", mdi_cmd)
 
         return self.execute_cmd("mdi", 0, mdi_cmd)
 
@@ -833,22 +1217,79 @@ class LinuxCNCWorker(object):
             "stop_gcode": self.stop_gcode,
             "reset_interpreter": self.reset_interpreter,
             "gcode_content": self.get_gcode_content,
+            "gcode_lines": self.get_gcode_lines,
+            "gcode_tools": self.get_gcode_tools,
+            "errors_history": self.get_errors_history,
+            "position_history": self.get_position_history,
             "tool_change": self.tool_change,
             "tools_data": self.get_tools_data,
             "delete_tools": self.delete_tools,
             "reload_tool_table": self.reload_tools,
             "update_tools": self.update_tools,
             "run_mdi": self.run_mdi,
+            "supervisor_state": self.get_supervisor_state,
+            "command_latency": self.get_command_latency,
         }
 
     # cmd_name - string-key name of API command for linuxcnc
     # cmd_dic - dictionary with command arguments
     def handle_command(self, cmd_name, cmd_dic=None):
         if cmd_name not in self.cmd_dict:
-            logger.debug("Unsupported command (%s)" % cmd_name);
+            logger.debug("Unsupported command (%s)", cmd_name);
             return {"result": {'text':"unsupported command", 'code': -3}}
         #logger.debug(cmd_dic)
-        return self.cmd_dict[cmd_name](cmd_dic)
+        start = time.time()
+        res = self.cmd_dict[cmd_name](cmd_dic)
+        metrics.COMMAND.labels(cmd_name).observe(time.time() - start)
+        return res
+
+    def run_async(self, method, *args):
+        """Run blocking linuxcnc call on normal command lane. Returns future"""
+        return self.scheduler.submit(LANE_NORMAL, method.__name__, method, *args)
+
+    def command_lane(self, cmd_name, cmd_dic):
+        if cmd_name in LinuxCNCWorker.SAFETY_CMDS:
+            return LANE_SAFETY
+        if (cmd_name == "set_state") and isinstance(cmd_dic, dict) and \
+                (cmd_dic.get("state") in LinuxCNCWorker.SAFETY_STATES):
+            return LANE_SAFETY
+        return LANE_NORMAL
+
+    def call_on_lane(self, lane, method, *args):
+        """Call method on lane thread using command channel of lane"""
+        self.lane_channel.command = self.lane_commands.get(lane)
+        return method(*args)
+
+    def handle_command_async(self, cmd_name, cmd_dic=None):
+        """Handle command without blocking caller. Returns future of command result"""
+        if cmd_name in LinuxCNCWorker.INLINE_CMDS:
+            future = Future()
+            future.set_result(self.handle_command(cmd_name, cmd_dic))
+            return future
+
+        if cmd_name in LinuxCNCWorker.IO_CMDS:
+            return self.scheduler.submit(LANE_IO, cmd_name, self.handle_command, cmd_name, cmd_dic)
+
+        if self.command_lane(cmd_name, cmd_dic) == LANE_SAFETY:
+            return self.scheduler.submit(LANE_SAFETY, cmd_name, self.call_on_lane, 
+                                         LANE_SAFETY, self.handle_command, cmd_name, cmd_dic)
+
+        return self.scheduler.submit(LANE_NORMAL, cmd_name, self.handle_command, cmd_name, cmd_dic)
+
+    def jog_async(self, action, axis_num, vel=0, dist=0):
+        """Run jog intent of jog stream on jog lane. Returns future of command result"""
+        return self.scheduler.submit(LANE_JOG, "jog_" + action, self.call_on_lane, 
+                                     LANE_JOG, self.jog, action, axis_num, vel, dist)
+
+    def get_supervisor_state(self, cmd_args=None):
+        """Linuxcnc startup progress"""
+        res = self.supervisor.event()
+        res["result"] = {'text':"OK", 'code': 0}
+        return res
+
+    def get_command_latency(self, cmd_args=None):
+        """Queue wait and execution latency of commands [ms]"""
+        return {"result": {'text':"OK", 'code': 0}, "commands": self.scheduler.get_stats()}
 
 
 
@@ -0,0 +1,430 @@
+import math
+import re
+import threading
+import time
+from collections import deque
+
+import gcode_parser
+import logger
+
+# *****************************************************
+# Simulated machine: pure python replacement of linuxcnc module
+# (stat, command, error_channel, ini) for UI development and load
+# tests on any box. Loaded program is "run" in virtual time (real time
+# multiplied by speed factor) at programmed feed rates. State advances
+# on every status poll, so no simulation thread is needed.
+# Use: cnc_agent.set_backend(cnc_sim)
+# *****************************************************
+
+# Constants of linuxcnc 2.7
+STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON = 1, 2, 3, 4
+MODE_MANUAL, MODE_AUTO, MODE_MDI = 1, 2, 3
+INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING = 1, 2, 3, 4
+RCS_DONE, RCS_EXEC, RCS_ERROR = 1, 2, 3
+JOG_STOP, JOG_CONTINUOUS, JOG_INCREMENT = 0, 1, 2
+AUTO_RUN, AUTO_PAUSE, AUTO_RESUME, AUTO_STEP = 0, 1, 2, 3
+NML_ERROR, NML_TEXT, NML_DISPLAY = 1, 2, 3
+OPERATOR_ERROR, OPERATOR_TEXT, OPERATOR_DISPLAY = 11, 12, 13
+TRAJ_MODE_FREE, TRAJ_MODE_COORD = 1, 2
+MOTION_TYPE_TRAVERSE, MOTION_TYPE_FEED, MOTION_TYPE_ARC = 1, 2, 3
+
+AXES_NUM = 9
+READ_AHEAD = 10     # segments read by interpreter ahead of motion
+
+# Toolpath motions to status motion types
+# Tool change of MDI command (e.g. "T3 M6"), other MDI commands are accepted without motion
+MDI_TOOL_CHANGE = re.compile(r"\bT\s*(\d+)\b.*\bM0*6\b|\bM0*6\b.*\bT\s*(\d+)\b", re.IGNORECASE)
+
+MOTION_TYPES = {
+    gcode_parser.MOTION_RAPID: MOTION_TYPE_TRAVERSE,
+    gcode_parser.MOTION_FEED: MOTION_TYPE_FEED,
+    gcode_parser.MOTION_ARC_CW: MOTION_TYPE_ARC,
+    gcode_parser.MOTION_ARC_CCW: MOTION_TYPE_ARC,
+}
+
+
+class error(Exception):
+    pass
+
+
+# *****************************************************
+# State of simulated controller shared by all channels
+# *****************************************************
+class SimMachine(object):
+    def __init__(self, speed=1.0, rapid_velocity=50.0, default_velocity=10.0):
+        self.speed = speed                          # virtual time / real time
+        self.rapid_velocity = rapid_velocity        # G0 velocity [units/sec]
+        self.default_velocity = default_velocity    # velocity of feed moves without F [units/sec]
+        self.lock = threading.RLock()
+        self.errors = deque(maxlen=64)              # (kind, text) for error channel
+
+        # Virtual clock
+        self.real_base = time.time()
+        self.virtual_base = 0.0
+        self.last_time = 0.0
+
+        self.task_state = STATE_ESTOP
+        self.estop = 1
+        self.enabled = False
+        self.task_mode = MODE_MANUAL
+        self.interp_state = INTERP_IDLE
+        self.position = [0.0] * AXES_NUM
+        self.homed = [0] * AXES_NUM
+        self.tool_in_spindle = 0
+        self.current_vel = 0.0
+        self.motion_type = 0
+        self.current_line = 0
+        self.motion_line = 0
+        self.read_line = 0
+        self.file = ""
+
+        # Loaded program: segments (line_no, motion_type, start, end, velocity, duration, tool)
+        self.program = []
+        # Running program: segments left and time spent on first of them
+        self.queue = []
+        self.index = 0
+        self.segment_time = 0.0
+        self.stepping = False       # pause at end of current line
+
+        # Jogs by axis: (velocity, target or None for continuous jog)
+        self.jogs = {}
+
+    def now(self):
+        """Virtual time [sec]"""
+        return self.virtual_base + (time.time() - self.real_base) * self.speed
+
+    def set_speed(self, speed):
+        with self.lock:
+            self.virtual_base = self.now()
+            self.real_base = time.time()
+            self.speed = float(speed)
+
+    def error(self, text):
+        logger.debug("Simulator error: %s", text)
+        self.errors.append((OPERATOR_ERROR, text))
+        return RCS_ERROR
+
+    def is_running(self):
+        return self.interp_state in (INTERP_READING, INTERP_WAITING)
+
+    """ Simulation """
+    def update(self):
+        """Advance machine to current virtual time"""
+        with self.lock:
+            now = self.now()
+            dt = now - self.last_time
+            self.last_time = now
+            if self.is_running():
+                self.advance_program(dt)
+            if self.jogs:
+                self.advance_jogs(dt)
+
+    def advance_program(self, dt):
+        queue = self.queue
+        while self.index < len(queue):
+            line_no, motion_type, start, end, velocity, duration, tool = queue[self.index]
+            if self.segment_time + dt < duration:
+                self.segment_time += dt
+                break
+
+            dt -= duration - self.segment_time
+            self.segment_time = 0.0
+            self.index += 1
+            self.position[:3] = end
+            if self.stepping and ((self.index >= len(queue)) or (queue[self.index][0] != line_no)):
+                self.interp_state = INTERP_PAUSED
+                self.current_vel = 0.0
+                return
+
+        if self.index >= len(queue):
+            logger.debug("Simulator: program finished")
+            self.finish()
+            return
+
+        line_no, motion_type, start, end, velocity, duration, tool = queue[self.index]
+        ratio = self.segment_time / duration if duration > 0 else 1.0
+        self.position[:3] = [a + (b - a) * ratio for a, b in zip(start, end)]
+        self.current_vel = velocity
+        self.motion_type = motion_type
+        self.current_line = self.motion_line = line_no
+        self.tool_in_spindle = tool
+        self.read_line = queue[min(self.index + READ_AHEAD, len(queue) - 1)][0]
+        self.interp_state = INTERP_READING if self.index + READ_AHEAD < len(queue) else INTERP_WAITING
+
+    def advance_jogs(self, dt):
+        for axis, (velocity, target) in list(self.jogs.items()):
+            position = self.position[axis] + velocity * dt
+            if (target is not None) and ((position - target) * velocity >= 0):
+                position = target
+                del self.jogs[axis]
+            self.position[axis] = position
+
+        self.current_vel = max([abs(velocity) for velocity, target in self.jogs.values()] or [0.0])
+        self.motion_type = MOTION_TYPE_TRAVERSE if self.jogs else 0
+
+    def finish(self):
+        self.queue = []
+        self.index = 0
+        self.segment_time = 0.0
+        self.stepping = False
+        self.interp_state = INTERP_IDLE
+        self.current_vel = 0.0
+        self.motion_type = 0
+        self.current_line = self.motion_line = 0
+
+    def load(self, path):
+        """Make program segments from g-code file"""
+        program = []
+        with open(path, "r") as file:
+            for line_no, motion, start, end, feed, tool in gcode_parser.iter_segments(file):
+                if motion == gcode_parser.MOTION_RAPID:
+                    velocity = self.rapid_velocity
+                else:
+                    velocity = feed / 60.0 if feed > 0 else self.default_velocity
+                length = math.sqrt(sum((b - a) ** 2 for a, b in zip(start, end)))
+                program.append((line_no, MOTION_TYPES[motion], tuple(start), tuple(end),
+                                velocity, length / velocity, tool))
+        return program
+
+    """ Commands """
+    def state(self, state):
+        if state == STATE_ESTOP:
+            self.abort()
+            self.estop, self.enabled = 1, False
+        elif state == STATE_ESTOP_RESET:
+            self.estop = 0
+        elif state in (STATE_ON, STATE_OFF):
+            if self.estop:
+                return self.error("Can't turn machine %s in estop state" % ("on" if state == STATE_ON else "off"))
+            if state == STATE_OFF:
+                self.abort()
+            self.enabled = (state == STATE_ON)
+        else:
+            return self.error("Unknown state %s" % state)
+
+        self.task_state = state
+        return RCS_DONE
+
+    def mode(self, mode):
+        if (mode != self.task_mode) and (self.interp_state != INTERP_IDLE):
+            return self.error("Can't change mode while program is running")
+        self.task_mode = mode
+        return RCS_DONE
+
+    def home(self, axis):
+        if not self.enabled:
+            return self.error("Can't home axis: machine is off")
+        axes = range(3) if axis == -1 else [axis]
+        for axis in axes:
+            self.jogs.pop(axis, None)
+            self.position[axis] = 0.0
+            self.homed[axis] = 1
+        return RCS_DONE
+
+    def jog(self, action, axis, velocity=0.0, distance=0.0):
+        if action == JOG_STOP:
+            self.jogs.pop(axis, None)
+            return RCS_DONE
+        if (not self.enabled) or (self.task_mode != MODE_MANUAL) or (self.interp_state != INTERP_IDLE):
+            return self.error("Can't jog axis: machine is off or not in manual mode")
+
+        velocity = float(velocity)
+        if action == JOG_CONTINUOUS:
+            self.jogs[axis] = (velocity, None)
+        else:
+            direction = 1 if velocity >= 0 else -1
+            self.jogs[axis] = (velocity, self.position[axis] + direction * abs(float(distance)))
+        return RCS_DONE
+
+    def program_open(self, path):
+        if self.interp_state != INTERP_IDLE:
+            return self.error("Can't open program while it's running")
+        try:
+            self.program = self.load(path)
+        except Exception as ex:
+            logger.exception(ex)
+            return self.error("Can't open program: %s" % ex)
+
+        self.file = path
+        self.read_line = 0
+        logger.debug("Simulator: opened %s (%d segments)", path, len(self.program))
+        return RCS_DONE
+
+    def auto(self, action, line_no=0):
+        if action == AUTO_PAUSE:
+            if self.is_running():
+                self.interp_state = INTERP_PAUSED
+                self.current_vel = 0.0
+            return RCS_DONE
+        if action == AUTO_RESUME:
+            if self.interp_state == INTERP_PAUSED:
+                self.stepping = False
+                self.interp_state = INTERP_READING
+            return RCS_DONE
+
+        if self.interp_state == INTERP_IDLE:
+            if (not self.enabled) or (self.task_mode != MODE_AUTO):
+                return self.error("Can't run program: machine is off or not in auto mode")
+            if not self.program:
+                return self.error("Can't run program: no program opened")
+            self.start(line_no if action == AUTO_RUN else 0)
+            self.stepping = (action == AUTO_STEP)
+        elif action == AUTO_STEP:
+            self.stepping = True
+            self.interp_state = INTERP_READING
+        return RCS_DONE
+
+    def start(self, line_no):
+        """Start program from line, machine goes to start of its first segment at rapid"""
+        queue = [segment for segment in self.program if segment[0] >= line_no] if line_no > 1 else self.program
+        if not queue:
+            return
+        first = queue[0]
+        length = math.sqrt(sum((b - a) ** 2 for a, b in zip(self.position[:3], first[2])))
+        if length > 0:
+            approach = (first[0], MOTION_TYPE_TRAVERSE, tuple(self.position[:3]), first[2],
+                        self.rapid_velocity, length / self.rapid_velocity, self.tool_in_spindle)
+            queue = [approach] + queue
+
+        self.queue = queue
+        self.index = 0
+        self.segment_time = 0.0
+        self.last_time = self.now()
+        self.interp_state = INTERP_READING
+        logger.debug("Simulator: program started from line %s", line_no)
+
+    def abort(self):
+        self.jogs.clear()
+        if self.interp_state != INTERP_IDLE:
+            logger.debug("Simulator: program aborted")
+            self.finish()
+        self.current_vel = 0.0
+        self.motion_type = 0
+        return RCS_DONE
+
+    def reset_interpreter(self):
+        return self.abort()
+
+    def mdi(self, text):
+        if (not self.enabled) or (self.task_mode != MODE_MDI) or (self.interp_state != INTERP_IDLE):
+            return self.error("Can't run MDI command: machine is off or not in MDI mode")
+        match = MDI_TOOL_CHANGE.search(text)
+        if match:
+            self.tool_in_spindle = int(match.group(1) or match.group(2))
+        logger.debug("Simulator: MDI command '%s'", text)
+        return RCS_DONE
+
+    def load_tool_table(self):
+        # Tool offsets are not simulated, nothing to reload
+        return RCS_DONE
+
+
+machine = SimMachine()
+
+
+def configure(speed=1.0, rapid_velocity=None, default_velocity=None):
+    """Set simulation speed factor and velocities [units/sec]"""
+    machine.set_speed(speed)
+    if rapid_velocity:
+        machine.rapid_velocity = float(rapid_velocity)
+    if default_velocity:
+        machine.default_velocity = float(default_velocity)
+
+
+class stat(object):
+    def poll(self):
+        machine.update()
+        with machine.lock:
+            self.task_state = machine.task_state
+            self.estop = machine.estop
+            self.enabled = machine.enabled
+            self.task_mode = machine.task_mode
+            self.interp_state = machine.interp_state
+            self.position = self.actual_position = tuple(machine.position)
+            self.homed = tuple(machine.homed)
+            self.axes = 3
+            self.current_line = machine.current_line
+            self.motion_line = machine.motion_line
+            self.read_line = machine.read_line
+            self.motion_mode = TRAJ_MODE_COORD if machine.is_running() else TRAJ_MODE_FREE
+            self.motion_type = machine.motion_type
+            self.current_vel = machine.current_vel
+            self.file = machine.file
+            self.command = ""
+            self.tool_in_spindle = machine.tool_in_spindle
+            self.paused = (machine.interp_state == INTERP_PAUSED)
+            self.queue = max(0, len(machine.queue) - machine.index)
+            self.g5x_offset = self.g92_offset = self.tool_offset = (0.0,) * AXES_NUM
+
+
+# *****************************************************
+# Command channel: commands are applied to machine at once,
+# wait_complete() returns result of the last one
+# *****************************************************
+class command(object):
+    def __init__(self):
+        self.result = RCS_DONE
+
+    def call(self, method, *args):
+        machine.update()
+        with machine.lock:
+            self.result = method(*args)
+
+    def state(self, state):
+        self.call(machine.state, state)
+
+    def mode(self, mode):
+        self.call(machine.mode, mode)
+
+    def home(self, axis):
+        self.call(machine.home, axis)
+
+    def jog(self, action, axis, *args):
+        self.call(machine.jog, action, axis, *args)
+
+    def program_open(self, path):
+        self.call(machine.program_open, path)
+
+    def auto(self, action, *args):
+        self.call(machine.auto, action, *args)
+
+    def abort(self):
+        self.call(machine.abort)
+
+    def reset_interpreter(self):
+        self.call(machine.reset_interpreter)
+
+    def mdi(self, text):
+        self.call(machine.mdi, text)
+
+    def load_tool_table(self):
+        self.call(machine.load_tool_table)
+
+    def wait_complete(self, timeout=5.0):
+        return self.result
+
+
+class error_channel(object):
+    def poll(self):
+        with machine.lock:
+            return machine.errors.popleft() if machine.errors else None
+
+
+class ini(object):
+    """Ini file reader like linuxcnc one: first value of key wins"""
+    def __init__(self, path):
+        self.values = {}
+        section = None
+        with open(path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if (not line) or (line[0] in "#;"):
+                    continue
+                if line.startswith("[") and line.endswith("]"):
+                    section = line[1:-1].strip()
+                elif ("=" in line) and (section is not None):
+                    key, value = line.split("=", 1)
+                    self.values.setdefault((section, key.strip()), value.strip())
+
+    def find(self, section, key):
+        return self.values.get((section, key))
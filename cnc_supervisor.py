@@ -0,0 +1,183 @@
+import datetime
+import os
+import subprocess
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+import logger
+
+
+def is_linuxcnc_running():
+    """Check for linuxcnc process (blocking, run on executor)"""
+    p = subprocess.Popen(['pidof', '-x', 'linuxcnc'], stdout=subprocess.PIPE)
+    return len(p.communicate()[0]) > 0
+
+
+# *****************************************************
+# Launches linuxcnc process without blocking IOLoop and watches it
+# until it's available on status channel. States:
+#   stopped    - not started by supervisor or exited normally
+#   starting   - process launched, waiting for status channel
+#   running    - linuxcnc is available
+#   restarting - start failed or process crashed, waiting backoff delay
+#   failed     - too many restarts in a row
+# Observers are notified with progress event on every state change
+# and periodically while linuxcnc is starting
+# *****************************************************
+class LinuxCNCSupervisor(object):
+    def __init__(self, ini_file, is_alive, start_timeout_s=60, backoff_s=2,
+                 max_backoff_s=60, max_restarts=5, check_period_ms=500):
+        self.ini_file = ini_file
+        self.is_alive = is_alive            # callable: linuxcnc answers on status channel
+        self.start_timeout = start_timeout_s
+        self.backoff = backoff_s            # first restart delay, doubled on every failure
+        self.max_backoff = max_backoff_s
+        self.max_restarts = max_restarts
+        # running for this period resets failures counter [sec]
+        self.stable_period = start_timeout_s
+
+        self.state = "stopped"
+        self.text = ""
+        self.state_time = time.time()
+        self.retry_time = None
+        self.process = None         # launched linuxcnc (None - not launched by supervisor)
+        self.attempt = 0
+        self.failures = 0
+        self.observers = []
+
+        self.checker = PeriodicCallback(self.check, check_period_ms)
+        self.restart_timeout = None
+
+    def add_observer(self, callback):
+        self.observers.append(callback)
+
+    def del_observer(self, callback):
+        if callback in self.observers:
+            self.observers.remove(callback)
+
+    def event(self):
+        """Startup progress event"""
+        now = time.time()
+        return {"supervisor": {
+            "state": self.state,
+            "text": self.text,
+            "attempt": self.attempt,
+            "elapsed": round(now - self.state_time, 1),
+            "retry_in": round(max(0, self.retry_time - now), 1) if self.retry_time else None,
+            "pid": self.process.pid if self.process is not None else None,
+        }}
+
+    def notify(self):
+        event = self.event()
+        for observer in list(self.observers):
+            try:
+                observer(event)
+            except Exception as ex:
+                logger.exception(ex)
+                self.del_observer(observer)
+
+    def set_state(self, state, text):
+        if state != self.state:
+            logger.info("linuxcnc supervisor: %s -> %s (%s)", self.state, state, text)
+            self.state_time = time.time()
+        self.state = state
+        self.text = text
+        if state != "restarting":
+            self.retry_time = None
+        self.notify()
+
+    def start(self):
+        """Start linuxcnc unless it's already started. Returns at once"""
+        res = self.event()
+        if self.state in ("starting", "running", "restarting"):
+            res["result"] = {'text': "already %s" % self.state, 'code': -1}
+            return res
+
+        self.attempt = 0
+        self.failures = 0
+        IOLoop.current().spawn_callback(self.launch)
+        res["result"] = {'text': "OK", 'code': 0}
+        return res
+
+    @gen.coroutine
+    def launch(self):
+        self.restart_timeout = None
+        self.attempt += 1
+        self.set_state("starting", "checking linuxcnc process")
+
+        running = yield IOLoop.current().run_in_executor(None, is_linuxcnc_running)
+        if running or self.is_alive():
+            # Started outside of supervisor, only wait for it
+            logger.debug("linuxcnc already running, waiting for it")
+            self.process = None
+            self.set_state("starting", "linuxcnc is already running")
+        else:
+            logger.debug("Launching linuxcnc %s (attempt %d)", self.ini_file, self.attempt)
+            try:
+                with open(os.devnull, "wb") as devnull:
+                    self.process = subprocess.Popen(["linuxcnc", self.ini_file], stdout=devnull,
+                                                    stderr=subprocess.STDOUT, close_fds=True)
+            except OSError as ex:
+                logger.exception(ex)
+                self.on_failure("linuxcnc launch error: %s" % ex)
+                return
+            self.set_state("starting", "linuxcnc launched")
+
+        if not self.checker.is_running():
+            self.checker.start()
+
+    def check(self):
+        """Watch launched process and linuxcnc availability"""
+        alive = self.is_alive()
+        code = self.process.poll() if self.process is not None else None
+        elapsed = time.time() - self.state_time
+
+        if self.state == "starting":
+            if alive:
+                self.set_state("running", "linuxcnc is running")
+            elif code is not None:
+                self.on_failure("linuxcnc exited with code %d while starting" % code)
+            elif elapsed > self.start_timeout:
+                self.terminate()
+                self.on_failure("linuxcnc start timed out")
+            else:
+                self.notify()
+
+        elif self.state == "running":
+            if code is not None:
+                self.process = None
+                if code == 0:
+                    self.set_state("stopped", "linuxcnc exited")
+                else:
+                    self.on_failure("linuxcnc exited with code %d" % code)
+            elif (not alive) and (self.process is None):
+                self.set_state("stopped", "linuxcnc is unavailable")
+            elif (self.failures > 0) and (elapsed > self.stable_period):
+                self.failures = 0
+
+        if self.state in ("stopped", "failed", "restarting"):
+            self.checker.stop()
+
+    def on_failure(self, text):
+        self.process = None
+        self.failures += 1
+        if self.failures > self.max_restarts:
+            self.set_state("failed", "%s, no more restarts (%d failed)" % (text, self.failures))
+            return
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        self.retry_time = time.time() + delay
+        self.set_state("restarting", "%s, restart in %d s" % (text, delay))
+        self.restart_timeout = IOLoop.current().add_timeout(datetime.timedelta(seconds=delay), self.launch)
+
+    def terminate(self):
+        if self.process is None:
+            return
+        try:
+            self.process.terminate()
+            # Reap process without waiting for it here
+            IOLoop.current().run_in_executor(None, self.process.wait)
+        except OSError as ex:
+            logger.exception(ex)
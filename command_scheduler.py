@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+LANE_NORMAL = "normal"
+LANE_SAFETY = "safety"
+LANE_JOG = "jog"
+LANE_IO = "io"
+
+
+# *****************************************************
+# Latency samples of one command: time spent in lane queue
+# and time of execution [sec]. Keeps last samples for percentiles
+# *****************************************************
+class LatencyStats(object):
+    def __init__(self, samples_num=256):
+        self.count = 0
+        self.cancelled = 0  # skipped because of safety command
+        self.max_wait = 0.0
+        self.max_exec = 0.0
+        self.waits = deque(maxlen=samples_num)
+        self.execs = deque(maxlen=samples_num)
+
+    def add(self, wait, exec_time):
+        if exec_time is None:
+            self.cancelled += 1
+            return
+
+        self.count += 1
+        self.max_wait = max(self.max_wait, wait)
+        self.max_exec = max(self.max_exec, exec_time)
+        self.waits.append(wait)
+        self.execs.append(exec_time)
+
+    @staticmethod
+    def summary(samples, max_value):
+        """Readable summary of samples in ms"""
+        values = sorted(samples)
+        if not values:
+            return None
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+        return {"last": samples[-1] * 1000, "mean": sum(values) / len(values) * 1000,
+                "p50": percentile(0.5), "p99": percentile(0.99), "max": max_value * 1000}
+
+    def to_dict(self):
+        return {"count": self.count, "cancelled": self.cancelled,
+                "wait_ms": LatencyStats.summary(self.waits, self.max_wait),
+                "exec_ms": LatencyStats.summary(self.execs, self.max_exec)}
+
+
+# *****************************************************
+# Runs blocking commands on per-lane single thread executors:
+#   normal - regular commands, executed one by one in order of arrival
+#   safety - estop/abort/pause, never queued behind normal commands.
+#            Safety command preempts normal lane: commands queued
+#            there before it are skipped, not executed
+#   jog    - manual jog commands streamed by jog websocket clients
+#   io     - g-code file, line index and tool table file work, kept
+#            off IOLoop and never queued behind linuxcnc commands
+# *****************************************************
+class CommandScheduler(object):
+    def __init__(self, samples_num=256):
+        self.lanes = {
+            LANE_NORMAL: ThreadPoolExecutor(1),
+            LANE_SAFETY: ThreadPoolExecutor(1),
+            LANE_JOG: ThreadPoolExecutor(1),
+            LANE_IO: ThreadPoolExecutor(1),
+        }
+        # normal lane commands submitted before this generation are skipped
+        self.generation = 0
+        self.samples_num = samples_num
+        self.stats = {}     # command name: LatencyStats
+        self.lock = threading.Lock()
+
+    def submit(self, lane, name, method, *args):
+        """Schedule method call on given lane. Returns future of its result"""
+        submit_time = time.time()
+        if lane == LANE_SAFETY:
+            self.generation += 1
+        generation = self.generation
+
+        def job():
+            start_time = time.time()
+            if (lane == LANE_NORMAL) and (generation != self.generation):
+                self.record(name, start_time - submit_time, None)
+                return {"result": {'text': "cancelled by safety command", 'code': -4}}
+
+            try:
+                return method(*args)
+            finally:
+                self.record(name, start_time - submit_time, time.time() - start_time)
+
+        return self.lanes[lane].submit(job)
+
+    def record(self, name, wait, exec_time):
+        metrics.COMMAND_WAIT.labels(name).observe(wait)
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = LatencyStats(self.samples_num)
+            stats.add(wait, exec_time)
+
+    def get_stats(self):
+        """Latency summary of every executed command"""
+        with self.lock:
+            return dict((name, stats.to_dict()) for name, stats in self.stats.items())
@@ -0,0 +1,111 @@
+import numpy as np
+
+import gcode_parser
+
+
+def read_toolpath(data):
+    """Get segment arrays (start, end, lines, feeds, tools, motions) of packed toolpath"""
+    magic, version, n, reserved = gcode_parser.HEADER.unpack_from(data)
+    if (magic, version) != (gcode_parser.MAGIC, gcode_parser.VERSION):
+        raise ValueError("unsupported toolpath format")
+
+    offset = gcode_parser.HEADER.size
+    vertices = np.frombuffer(data, dtype="<f4", count=6 * n, offset=offset).reshape(n, 6)
+    offset += 24 * n
+    lines = np.frombuffer(data, dtype="<u4", count=n, offset=offset)
+    offset += 4 * n
+    feeds = np.frombuffer(data, dtype="<f4", count=n, offset=offset)
+    offset += 4 * n
+    tools = np.frombuffer(data, dtype="<u4", count=n, offset=offset)
+    offset += 4 * n
+    motions = np.frombuffer(data, dtype="u1", count=n, offset=offset)
+
+    return (vertices[:, :3].astype(np.float64), vertices[:, 3:].astype(np.float64),
+            lines, feeds.astype(np.float64), tools, motions)
+
+
+def direction_limit(limits, directions):
+    """Path limit of axis limits (velocity or acceleration) for unit direction vectors"""
+    limits = np.asarray(limits, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.min(limits / np.abs(directions), axis=1)
+
+
+def segment_times(length, velocity, acceleration, entry, exit_):
+    """Time of trapezoidal velocity profile on each segment"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accel_dist = (velocity ** 2 - entry ** 2) / (2 * acceleration)
+        decel_dist = (velocity ** 2 - exit_ ** 2) / (2 * acceleration)
+        cruise = accel_dist + decel_dist <= length
+
+        # Cruise velocity is reached
+        t_cruise = ((velocity - entry) / acceleration + (velocity - exit_) / acceleration +
+                    (length - accel_dist - decel_dist) / velocity)
+        # Short segment: accelerate to peak velocity and decelerate at once
+        peak = np.sqrt((2 * acceleration * length + entry ** 2 + exit_ ** 2) / 2)
+        t_peak = (peak - entry) / acceleration + (peak - exit_) / acceleration
+        # Junction velocities can't be both reached - uniform velocity change
+        t_ramp = 2 * length / (entry + exit_)
+
+        times = np.where(cruise, t_cruise,
+                         np.where(peak >= np.maximum(entry, exit_), t_peak, t_ramp))
+
+    return np.where(length > 0, np.nan_to_num(times), 0.0)
+
+
+def estimate(data, limits):
+    """Estimate run time [sec], cut and rapid lengths of packed toolpath in total and per tool.
+       limits: machine limits in units per second:
+         max_velocity, max_acceleration, default_velocity, axis_velocity[3], axis_acceleration[3]"""
+    start, end, lines, feeds, tools, motions = read_toolpath(data)
+
+    delta = end - start
+    length = np.sqrt((delta * delta).sum(axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        directions = np.nan_to_num(delta / length[:, None])
+
+    rapid = (motions == gcode_parser.MOTION_RAPID)
+    max_velocity = limits.get("max_velocity") or np.inf
+    default_velocity = limits.get("default_velocity") or max_velocity
+
+    # Programmed velocity limited by trajectory and axes limits
+    feed_velocity = np.where(feeds > 0, feeds / 60.0, default_velocity)
+    velocity = np.where(rapid, max_velocity, np.minimum(feed_velocity, max_velocity))
+    velocity = np.minimum(velocity, direction_limit(limits.get("axis_velocity") or [np.inf] * 3, directions))
+    velocity = np.maximum(velocity, 1e-9)
+
+    acceleration = np.minimum(limits.get("max_acceleration") or np.inf,
+                              direction_limit(limits.get("axis_acceleration") or [np.inf] * 3, directions))
+
+    # Velocity at junction of segments drops with angle between them (stop at right angle)
+    cos = np.clip((directions[:-1] * directions[1:]).sum(axis=1), 0.0, 1.0)
+    junction = np.minimum(velocity[:-1], velocity[1:]) * cos
+    entry = np.concatenate(([0.0], junction))
+    exit_ = np.concatenate((junction, [0.0]))
+
+    times = segment_times(length, velocity, acceleration, entry, exit_)
+
+    # Per tool breakdown
+    tool_numbers, tool_index = np.unique(tools, return_inverse=True)
+    cut_length = np.where(rapid, 0.0, length)
+    rapid_length = np.where(rapid, length, 0.0)
+    tool_times = np.bincount(tool_index, weights=times, minlength=len(tool_numbers))
+    tool_cut = np.bincount(tool_index, weights=cut_length, minlength=len(tool_numbers))
+    tool_rapid = np.bincount(tool_index, weights=rapid_length, minlength=len(tool_numbers))
+
+    return {
+        "time": float(times.sum()),
+        "cut_length": float(cut_length.sum()),
+        "rapid_length": float(rapid_length.sum()),
+        "segments": len(length),
+        "tools": [{"tool": int(tool), "time": float(tool_times[i]),
+                   "cut_length": float(tool_cut[i]), "rapid_length": float(tool_rapid[i])}
+                  for i, tool in enumerate(tool_numbers)],
+    }
+
+
+def estimate_file(toolpath_path, limits):
+    """Estimate packed toolpath file (entry point of worker process)"""
+    with open(toolpath_path, "rb") as file:
+        data = file.read()
+    return estimate(data, limits)
@@ -0,0 +1,165 @@
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+import gcode_parser
+import logger
+
+tool_re = re.compile(r"T\s*(\d+)", re.IGNORECASE)
+
+
+# *****************************************************
+# Line offsets index of g-code file. Offsets of line starts are stored
+# as uint32 array in cache file (built once per file version) and both
+# index and program are read with mmap, so getting any slice of lines
+# costs only the size of slice. Tool selections found while building
+# are stored after offsets. Index file layout (little-endian uint32):
+#   offsets_num | tools_num | offsets[offsets_num] | (line, tool)[tools_num]
+# *****************************************************
+class LineIndex(object):
+    ITEM = struct.Struct("<I")
+    HEADER = struct.Struct("<II")
+    VERSION = 2     # part of index file name
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        st = os.stat(path)
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        self.tools = None
+        self.built = not os.path.exists(index_path)     # index file is made by this instance
+
+        if self.built:
+            LineIndex.build(path, index_path)
+        else:
+            # Usage time for cache eviction
+            os.utime(index_path, None)
+
+        self.data = LineIndex.map(path)
+        self.index = LineIndex.map(index_path)
+        offsets_num, self.tools_num = LineIndex.HEADER.unpack_from(self.index)
+        # Offsets end with offset of file end
+        self.lines_num = max(0, offsets_num - 1)
+        self.tools_offset = LineIndex.HEADER.size + offsets_num * LineIndex.ITEM.size
+
+    @staticmethod
+    def map(path):
+        """Get read-only mmap of file (empty string for empty file)"""
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def build(path, index_path):
+        """Scan file once and write offsets of line starts and tool selections"""
+        logger.debug("Building line index: %s", path)
+        offsets = array('I', [0])
+        tools = array('I')
+        offset = 0
+        with open(path, "rb") as file:
+            for line_no, line in enumerate(file, 1):
+                offset += len(line)
+                offsets.append(offset)
+                # Only few lines have T word, skip the rest without regex
+                if ("T" in line) or ("t" in line):
+                    match = tool_re.search(gcode_parser.comment_re.sub("", line))
+                    if match:
+                        tools.extend((line_no, int(match.group(1))))
+
+        if sys.byteorder == "big":
+            offsets.byteswap()
+            tools.byteswap()
+
+        tmp_path = "%s.%d.tmp" % (index_path, threading.current_thread().ident)
+        with open(tmp_path, "wb") as file:
+            file.write(LineIndex.HEADER.pack(len(offsets), len(tools) // 2))
+            file.write(offsets.tostring())
+            file.write(tools.tostring())
+        os.rename(tmp_path, index_path)
+
+    def is_actual(self):
+        """Check that file was not changed since index was opened"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_mtime == self.mtime) and (st.st_size == self.size)
+
+    def offset(self, i):
+        return LineIndex.ITEM.unpack_from(self.index, LineIndex.HEADER.size + i * LineIndex.ITEM.size)[0]
+
+    def lines(self, first, count):
+        """Get list of 'count' lines starting from line number 'first' (1-based)"""
+        first = max(1, first)
+        last = min(self.lines_num, first + count - 1)
+        if last < first:
+            return []
+
+        chunk = self.data[self.offset(first - 1):self.offset(last)]
+        return chunk.decode("utf-8", "replace").splitlines()
+
+    def get_tools(self):
+        """Get {line number: tool number} of tool selections in program"""
+        if self.tools is None:
+            tools = array('I')
+            tools.fromstring(self.index[self.tools_offset:self.tools_offset + self.tools_num * 8])
+            if sys.byteorder == "big":
+                tools.byteswap()
+            self.tools = dict(zip(tools[0::2], tools[1::2]))
+
+        return self.tools
+
+    def close(self):
+        for data in (self.data, self.index):
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+# *****************************************************
+# Line indexes of recently used g-code files. Index file is named by
+# hash of index format version, path, modification time and size of g-code file
+# *****************************************************
+class GcodeLines(object):
+    def __init__(self, cache_dir, max_open=4):
+        self.dir = cache_dir
+        self.max_open = max_open        # number of indexes kept open
+        self.indexes = OrderedDict()    # path: LineIndex
+        self.lock = threading.Lock()
+        self.on_build = None            # callback after new index file is written (cache size limit)
+
+    def index_path(self, path):
+        st = os.stat(path)
+        key = hashlib.sha1("%d|%s|%r|%d" % (LineIndex.VERSION, path, st.st_mtime, st.st_size)).hexdigest()
+        return os.path.join(self.dir, key + ".idx")
+
+    def get(self, path):
+        """Get line index of g-code file, index is rebuilt when file changes"""
+        with self.lock:
+            index = self.indexes.pop(path, None)
+            if (index is not None) and not index.is_actual():
+                # Index of previous file version is not needed anymore
+                index.close()
+                try:
+                    os.remove(index.index_path)
+                except OSError:
+                    pass
+                index = None
+
+            if index is None:
+                index = LineIndex(path, self.index_path(path))
+                if index.built and (self.on_build is not None):
+                    self.on_build()
+
+            self.indexes[path] = index
+            while len(self.indexes) > self.max_open:
+                self.indexes.popitem(last=False)[1].close()
+
+            return index
@@ -0,0 +1,326 @@
+import math
+import re
+import struct
+import sys
+from array import array
+
+# Motion types of toolpath segments
+MOTION_RAPID = 0    # G0
+MOTION_FEED = 1     # G1
+MOTION_ARC_CW = 2   # G2
+MOTION_ARC_CCW = 3  # G3
+
+# Drilling canned cycles (G73, G81-G89) made of rapid and feed moves,
+# cycles with feed retraction (tapping, boring)
+CANNED_CYCLES = (73, 81, 82, 83, 84, 85, 86, 87, 88, 89)
+FEED_OUT_CYCLES = (84, 85, 89)
+
+# Non-motion codes with axis words (G4, G10, G28, G30, G53, G92) [x10]
+NON_MOTION_CODES = (40, 100, 280, 300, 530, 920)
+
+# Arc planes: (abscissa, ordinate, normal) axis indexes and center offset words
+PLANES = {
+    17: ((0, 1, 2), ('I', 'J')),    # XY
+    18: ((2, 0, 1), ('K', 'I')),    # ZX
+    19: ((1, 2, 0), ('J', 'K')),    # YZ
+}
+
+AXES = ('X', 'Y', 'Z')
+
+# Binary toolpath header: magic, format version, segments number, reserved
+HEADER = struct.Struct("<4sIII")
+MAGIC = b"TPTH"
+VERSION = 3     # 3: non-motion codes skipped, canned cycles expanded
+
+comment_re = re.compile(r"\([^)]*\)|;.*")
+word_re = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+
+# *****************************************************
+# Toolpath made from g-code program. Each segment is a pair of vertices
+# (x, y, z float32) with source file line number, feed rate, tool in
+# spindle and motion type
+# *****************************************************
+class Toolpath(object):
+    __slots__ = ("vertices", "lines", "feeds", "tools", "motions")
+
+    def __init__(self):
+        self.vertices = array('f')
+        self.lines = array('I')
+        self.feeds = array('f')
+        self.tools = array('I')
+        self.motions = array('B')
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, line_no, motion, start, end, feed=0.0, tool=0):
+        self.vertices.extend(start)
+        self.vertices.extend(end)
+        self.lines.append(line_no)
+        self.feeds.append(feed)
+        self.tools.append(tool)
+        self.motions.append(motion)
+
+    def to_bytes(self):
+        """Pack toolpath to little-endian buffer:
+           header | float32 vertices[6*n] | uint32 lines[n] | float32 feeds[n] |
+           uint32 tools[n] | uint8 motions[n]"""
+        columns = [self.vertices, self.lines, self.feeds, self.tools]
+        if sys.byteorder == "big":
+            columns = [array(column.typecode, column) for column in columns]
+            for column in columns:
+                column.byteswap()
+
+        return b"".join([HEADER.pack(MAGIC, VERSION, len(self), 0)] +
+                        [column.tostring() for column in columns] + [self.motions.tostring()])
+
+
+def parse_words(line):
+    """Get list of (letter, value) g-code words from program line"""
+    line = comment_re.sub("", line).upper()
+    if line.lstrip().startswith('/'):  # block delete
+        return []
+    return [(letter, float(value)) for letter, value in word_re.findall(line)]
+
+
+def arc_points(start, end, center, plane, clockwise, turns, segments_per_turn):
+    """Generate points of arc (helix) from start to end point excluding start"""
+    a, o, n = PLANES[plane][0]
+
+    start_angle = math.atan2(start[o] - center[1], start[a] - center[0])
+    end_angle = math.atan2(end[o] - center[1], end[a] - center[0])
+    radius = math.hypot(start[a] - center[0], start[o] - center[1])
+
+    sweep = end_angle - start_angle
+    if clockwise:
+        if sweep >= -1e-9:
+            sweep -= 2 * math.pi
+        sweep -= 2 * math.pi * (turns - 1)
+    else:
+        if sweep <= 1e-9:
+            sweep += 2 * math.pi
+        sweep += 2 * math.pi * (turns - 1)
+
+    steps = max(1, int(math.ceil(abs(sweep) / (2 * math.pi) * segments_per_turn)))
+    # Radius may differ between start and end points - interpolate it
+    end_radius = math.hypot(end[a] - center[0], end[o] - center[1])
+
+    for step in range(1, steps):
+        k = float(step) / steps
+        angle = start_angle + sweep * k
+        r = radius + (end_radius - radius) * k
+        point = [0.0, 0.0, 0.0]
+        point[a] = center[0] + r * math.cos(angle)
+        point[o] = center[1] + r * math.sin(angle)
+        point[n] = start[n] + (end[n] - start[n]) * k
+        yield point
+
+    yield list(end)
+
+
+def radius_arc_center(start, end, radius, plane, clockwise):
+    """Get arc center at plane for radius format arc (negative radius - arc > 180 deg)"""
+    a, o = PLANES[plane][0][:2]
+    da = end[a] - start[a]
+    do = end[o] - start[o]
+    chord = math.hypot(da, do)
+    if chord == 0:
+        raise ValueError("radius format arc with equal start and end points")
+
+    half = chord / 2
+    h = math.sqrt(max(0.0, radius * radius - half * half))
+    # Center is at the right side of chord for clockwise arc less than 180 deg
+    side = 1 if clockwise else -1
+    if radius < 0:
+        side = -side
+
+    return (start[a] + da / 2 + side * h * do / chord,
+            start[o] + do / 2 - side * h * da / chord)
+
+
+def cycle_moves(start, x, y, r, z, retract_z, feed_out):
+    """Moves (motion, end) of one drilling cycle at hole x, y from R plane to z"""
+    moves = []
+    clear_z = max(start[2], r)
+    if start[2] < r:
+        moves.append((MOTION_RAPID, [start[0], start[1], r]))
+    moves.append((MOTION_RAPID, [x, y, clear_z]))
+    moves.append((MOTION_RAPID, [x, y, r]))
+    moves.append((MOTION_FEED, [x, y, z]))
+    if feed_out:
+        moves.append((MOTION_FEED, [x, y, r]))
+    moves.append((MOTION_RAPID, [x, y, retract_z]))
+    return moves
+
+
+def iter_segments(lines, segments_per_turn=64):
+    """Generate toolpath segments (line_no, motion, start, end, feed, tool) from g-code lines"""
+    position = [0.0, 0.0, 0.0]
+    motion = None
+    relative = False        # G90 / G91
+    arc_relative = True     # G90.1 / G91.1
+    plane = 17
+    scale = 1.0             # G21 / G20
+    feed = 0.0              # F [units/min]
+    selected_tool = 0       # T
+    tool = 0                # tool in spindle after M6
+    retract_initial = True  # G98 / G99: canned cycle returns to initial Z or R plane
+    cycle_initial_z = 0.0   # Z before first cycle of canned cycles sequence
+    cycle_r = cycle_z = 0.0 # R plane and hole bottom (sticky)
+
+    for line_no, line in enumerate(lines, 1):
+        words = parse_words(line)
+        if not words:
+            continue
+
+        params = {}
+        motion_word = None
+        tool_change = False
+        non_motion = None
+        for letter, value in words:
+            if letter == 'G':
+                code = int(round(value * 10))
+                if code in (0, 10, 20, 30):
+                    motion_word = code // 10
+                elif (code % 10 == 0) and (code // 10 in CANNED_CYCLES):
+                    motion_word = code // 10
+                elif code in NON_MOTION_CODES:
+                    non_motion = code
+                elif code == 980:
+                    retract_initial = True
+                elif code == 990:
+                    retract_initial = False
+                elif code in (170, 180, 190):
+                    plane = code // 10
+                elif code == 200:
+                    scale = 25.4
+                elif code == 210:
+                    scale = 1.0
+                elif code == 900:
+                    relative = False
+                elif code == 910:
+                    relative = True
+                elif code == 901:
+                    arc_relative = False
+                elif code == 911:
+                    arc_relative = True
+                elif code == 800:
+                    motion = None
+            elif (letter == 'M') and (int(value) == 6):
+                tool_change = True
+            else:
+                params[letter] = value
+
+        if 'F' in params:
+            feed = params['F'] * scale
+        if 'T' in params:
+            selected_tool = int(params['T'])
+        if tool_change:
+            tool = selected_tool
+
+        if motion_word is not None:
+            if (motion_word in CANNED_CYCLES) and (motion not in CANNED_CYCLES):
+                cycle_initial_z = position[2]
+            motion = motion_word
+
+        # Axis words of non-motion codes are not moves. G92 makes current
+        # point have given coordinates, other codes keep program position
+        if non_motion is not None:
+            if non_motion == 920:
+                position = list(position)
+                for i, axis in enumerate(AXES):
+                    if axis in params:
+                        position[i] = params[axis] * scale
+            continue
+
+        if motion is None:
+            continue
+
+        if motion in CANNED_CYCLES:
+            if not any(word in params for word in AXES + ('R',)):
+                continue
+            repeats = max(1, int(params.get('L', 1))) if relative else 1
+            for repeat in range(repeats):
+                if relative:
+                    x = position[0] + params.get('X', 0.0) * scale
+                    y = position[1] + params.get('Y', 0.0) * scale
+                    cycle_r = position[2] + params.get('R', 0.0) * scale
+                    cycle_z = cycle_r + params.get('Z', 0.0) * scale
+                else:
+                    x = params['X'] * scale if 'X' in params else position[0]
+                    y = params['Y'] * scale if 'Y' in params else position[1]
+                    cycle_r = params['R'] * scale if 'R' in params else cycle_r
+                    cycle_z = params['Z'] * scale if 'Z' in params else cycle_z
+                retract_z = max(cycle_initial_z, cycle_r) if retract_initial else cycle_r
+
+                for motion_type, end in cycle_moves(position, x, y, cycle_r, cycle_z, retract_z,
+                                                    motion in FEED_OUT_CYCLES):
+                    if end != position:
+                        yield line_no, motion_type, position, end, feed, tool
+                    position = end
+            continue
+
+        if not any(axis in params for axis in AXES):
+            # Full circle is programmed with center offsets only
+            if not ((motion in (MOTION_ARC_CW, MOTION_ARC_CCW)) and
+                    any(word in params for word in PLANES[plane][1])):
+                continue
+
+        end = list(position)
+        for i, axis in enumerate(AXES):
+            if axis in params:
+                value = params[axis] * scale
+                end[i] = position[i] + value if relative else value
+
+        if motion in (MOTION_RAPID, MOTION_FEED):
+            if end != position:
+                yield line_no, motion, position, end, feed, tool
+
+        else:
+            clockwise = (motion == MOTION_ARC_CW)
+            a, o = PLANES[plane][0][:2]
+            try:
+                if 'R' in params:
+                    center = radius_arc_center(position, end, params['R'] * scale, plane, clockwise)
+                else:
+                    ca, co = PLANES[plane][1]
+                    ia = params.get(ca, 0.0) * scale
+                    io = params.get(co, 0.0) * scale
+                    if arc_relative:
+                        center = (position[a] + ia, position[o] + io)
+                    else:
+                        center = (ia, io)
+            except ValueError:
+                position = end
+                continue
+
+            turns = max(1, int(params.get('P', 1)))
+            start = position
+            for point in arc_points(position, end, center, plane, clockwise, turns, segments_per_turn):
+                yield line_no, motion, start, point, feed, tool
+                start = point
+
+        position = end
+
+
+def parse_lines(lines, segments_per_turn=64):
+    """Make toolpath from iterable of g-code lines"""
+    toolpath = Toolpath()
+    for segment in iter_segments(lines, segments_per_turn):
+        toolpath.add(*segment)
+
+    return toolpath
+
+
+def parse_file(path, segments_per_turn=64):
+    """Make toolpath from g-code file. File is read line by line"""
+    with open(path, "r") as file:
+        return parse_lines(file, segments_per_turn)
+
+
+if __name__ == "__main__":
+    import time
+    start = time.time()
+    toolpath = parse_file(sys.argv[1] if len(sys.argv) > 1 else "gcodes/benchy.ngc")
+    print("%d segments, %d bytes, %.2f sec" % (len(toolpath), len(toolpath.to_bytes()), time.time() - start))
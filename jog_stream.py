@@ -0,0 +1,139 @@
+import datetime
+import json
+from collections import OrderedDict
+
+from tornado.ioloop import IOLoop
+
+import logger
+
+
+# *****************************************************
+# Jog intents streamed by one jog websocket client:
+#   {"jog": "continuous", "axis": N, "velocity": V}
+#   {"jog": "increment", "axis": N, "velocity": V, "distance": D}
+#   {"jog": "stop", "axis": N}
+#   {"heartbeat": seq}
+# Client repeats continuous intent or heartbeat while jog button is held.
+# Repeated intents are coalesced: only the newest intent of an axis waits
+# for jog lane, unchanged ones are not sent to linuxcnc at all.
+# If nothing comes from client for deadman period (lost or late stop,
+# broken connection), server stops jogging axes by itself
+# *****************************************************
+class JogSession(object):
+    def __init__(self, cnc, send, deadman_ms=500):
+        self.cnc = cnc
+        self.send = send                        # callable writing reply message to client
+        self.deadman_period = deadman_ms / 1000.0
+        self.deadman_timeout = None
+
+        self.moving = {}            # axis: velocity of running continuous jog
+        self.pending = OrderedDict()  # key: intent waiting for jog lane
+        self.increments = 0         # increments are queued, never coalesced
+        self.inflight = None        # intent executed by jog lane now
+        self.closed = False
+
+    def on_message(self, message):
+        try:
+            intent = json.loads(message)
+            action = intent.get("jog")
+            if action is not None:
+                self.add_intent(action, int(intent["axis"]), float(intent.get("velocity", 0)),
+                                float(intent.get("distance", 0)))
+        except Exception as ex:
+            logger.exception(ex)
+            self.reply({"result": {"text": str(ex), "code": -1}})
+            return
+
+        # Every message from client is heartbeat
+        self.feed_deadman()
+        self.flush()
+
+    def add_intent(self, action, axis, vel, dist):
+        if action == "continuous":
+            # Same jog is still running - nothing to do
+            if (self.moving.get(axis) == vel) and (axis not in self.pending):
+                return
+            self.pending[axis] = ("continuous", axis, vel, 0)
+        elif action == "stop":
+            self.moving.pop(axis, None)
+            self.pending.pop(axis, None)
+            self.pending[axis] = ("stop", axis, 0, 0)
+        elif action == "increment":
+            self.increments += 1
+            self.pending[(axis, self.increments)] = ("increment", axis, vel, dist)
+        else:
+            raise ValueError("unsupported jog action '%s'" % action)
+
+    def flush(self):
+        """Send next pending intent to jog lane when previous one is done"""
+        if (self.inflight is not None) or not self.pending:
+            return
+
+        key, intent = self.pending.popitem(last=False)
+        self.inflight = intent
+        future = self.cnc.jog_async(*intent)
+        IOLoop.current().add_future(future, lambda future: self.on_done(intent, future))
+
+    def on_done(self, intent, future):
+        self.inflight = None
+        action, axis, vel, dist = intent
+        try:
+            res = future.result()
+        except Exception as ex:
+            logger.exception(ex)
+            res = {"result": {"text": str(ex), "code": -1}}
+
+        # Axis keeps moving unless stop for it is already pending
+        if (action == "continuous") and (res["result"]["code"] == 0):
+            if axis not in self.pending:
+                self.moving[axis] = vel
+        else:
+            self.moving.pop(axis, None)
+
+        if res["result"]["code"] != 0:
+            self.reply(res)
+
+        self.flush()
+
+    def feed_deadman(self):
+        io_loop = IOLoop.current()
+        if self.deadman_timeout is not None:
+            io_loop.remove_timeout(self.deadman_timeout)
+            self.deadman_timeout = None
+
+        if self.moving or self.pending or (self.inflight is not None):
+            self.deadman_timeout = io_loop.add_timeout(datetime.timedelta(seconds=self.deadman_period),
+                                                       self.on_deadman)
+
+    def on_deadman(self):
+        self.deadman_timeout = None
+        if not (self.moving or self.pending or (self.inflight is not None)):
+            return
+
+        logger.warning("Jog heartbeat lost, stopping axes %s", list(self.moving))
+        self.stop_all()
+        self.reply({"result": {"text": "jog stopped: heartbeat lost", "code": -2}})
+
+    def reply(self, message):
+        if not self.closed:
+            self.send(message)
+
+    def stop_all(self):
+        """Drop pending intents and stop all jogging axes"""
+        axes = set(self.moving)
+        axes.update(intent[1] for intent in self.pending.values())
+        if self.inflight is not None:
+            axes.add(self.inflight[1])
+        self.moving.clear()
+        self.pending.clear()
+        for axis in axes:
+            self.pending[axis] = ("stop", axis, 0, 0)
+        self.flush()
+
+    def close(self):
+        """Client disconnected"""
+        self.closed = True
+        if self.deadman_timeout is not None:
+            IOLoop.current().remove_timeout(self.deadman_timeout)
+            self.deadman_timeout = None
+        self.stop_all()
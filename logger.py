@@ -1,17 +1,94 @@
 
 
+import atexit
+import gzip
 import logging
+import os
+import shutil
+import threading
 from logging.handlers import RotatingFileHandler
+try:
+	import Queue as queue
+except ImportError:
+	import queue
 
 # Shared for other modules object
 # NOTE: logger.init() should be called before any usage
 my_logger = None
 
 
-class CustomRotatingFileHandler(RotatingFileHandler):
+# Rotated files are gzipped: log.1.gz ... log.N.gz
+# (rollover is done by queue listener thread, not by logging caller)
+class CompressingRotatingFileHandler(RotatingFileHandler):
 	def doRollover(self):
-		super(CustomRotatingFileHandler, self).doRollover()
-		#print("ROTATION HAS BEEN DONE")
+		if self.stream:
+			self.stream.close()
+			self.stream = None
+
+		if self.backupCount > 0:
+			for i in range(self.backupCount - 1, 0, -1):
+				src = "%s.%d.gz" % (self.baseFilename, i)
+				dst = "%s.%d.gz" % (self.baseFilename, i + 1)
+				if os.path.exists(src):
+					if os.path.exists(dst):
+						os.remove(dst)
+					os.rename(src, dst)
+
+			rotated = self.baseFilename + ".1"
+			if os.path.exists(self.baseFilename):
+				os.rename(self.baseFilename, rotated)
+				with open(rotated, 'rb') as src, gzip.open(rotated + ".gz", 'wb') as dst:
+					shutil.copyfileobj(src, dst)
+				os.remove(rotated)
+
+		self.stream = self._open()
+
+# Puts log records to queue, so logging caller doesn't wait for file/console output.
+# Message is formatted here (only for enabled levels), because arguments
+# may be changed by caller after the call
+class QueueHandler(logging.Handler):
+	def __init__(self, records_queue):
+		logging.Handler.__init__(self)
+		self.queue = records_queue
+		self.dropped = 0	# records lost because queue was full
+
+	def prepare(self, record):
+		record.msg = record.getMessage()
+		record.args = None
+		if record.exc_info:
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+	def emit(self, record):
+		try:
+			self.queue.put_nowait(self.prepare(record))
+		except queue.Full:
+			self.dropped += 1
+		except Exception:
+			self.handleError(record)
+
+# Background thread writing queued records to real handlers
+class QueueListener(threading.Thread):
+	def __init__(self, records_queue, handlers):
+		threading.Thread.__init__(self, name="LogWriter")
+		self.daemon = True
+		self.queue = records_queue
+		self.handlers = handlers
+
+	def run(self):
+		while True:
+			record = self.queue.get()
+			if record is None:
+				break
+			for handler in self.handlers:
+				if record.levelno >= handler.level:
+					handler.handle(record)
+
+	def stop(self):
+		"""Write remaining records and stop"""
+		self.queue.put(None)
+		self.join()
 
 class MyLogger():
 	def __init__(self):
@@ -24,6 +101,8 @@ class MyLogger():
 
 		self.file_handler = None
 		self.console_handler = None
+		self.queue_handler = None
+		self.listener = None
 
 		self.log_levels = { "debug" : logging.DEBUG, 
 							"info" : logging.INFO,
@@ -32,27 +111,46 @@ class MyLogger():
 							"critical" : logging.CRITICAL,
 		}
 
-	def setup(self, level = "warning", file_path = "", file_max_size = 2*1048576, use_console = True):
+	def setup(self, level = "warning", file_path = "", file_max_size = 2*1048576, use_console = True, queue_size = 10000):
 		if self.log_levels.has_key(level):
 			self.level = self.log_levels[level]
 
+		handlers = []
 		if file_path:
-			self.file_handler = CustomRotatingFileHandler(file_path, mode='a', maxBytes=file_max_size, 
+			self.file_handler = CompressingRotatingFileHandler(file_path, mode='a', maxBytes=file_max_size, 
 											backupCount=5, encoding=None, delay=0)
 			self.file_handler.setFormatter(self.formatter)
 			self.file_handler.setLevel(self.level)
-			self.logger.addHandler(self.file_handler)
+			handlers.append(self.file_handler)
 
 		if use_console:
 			self.console_handler = logging.StreamHandler()
 			self.console_handler.setFormatter(self.formatter)
 			self.console_handler.setLevel(self.level)
-			self.logger.addHandler(self.console_handler)
+			handlers.append(self.console_handler)
+
+		# Logger only enqueues records, they are written by listener thread
+		self.shutdown()
+		records_queue = queue.Queue(queue_size)
+		self.queue_handler = QueueHandler(records_queue)
+		self.listener = QueueListener(records_queue, handlers)
+		self.listener.start()
+		self.logger.addHandler(self.queue_handler)
 
 		self.logger.setLevel(self.level)
 
+	def shutdown(self):
+		"""Flush queued records (called at exit)"""
+		if self.queue_handler is not None:
+			self.logger.removeHandler(self.queue_handler)
+			self.queue_handler = None
+		if self.listener is not None:
+			self.listener.stop()
+			self.listener = None
+
 # Common object for external modules
 my_logger = MyLogger()
+atexit.register(my_logger.shutdown)
 
 # Wraps of logging message methods to use as logger.method
 def init(level = "warning", file_path = "", file_max_size = 2*1048576, use_console = True):
@@ -0,0 +1,189 @@
+import bisect
+import datetime
+import threading
+import time
+
+from tornado.ioloop import IOLoop
+
+# Upper bounds of latency histogram buckets [sec]
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    items = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        items.append('%s="%s"' % (name, value))
+    return "{%s}" % ",".join(items)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# *****************************************************
+# Histogram with fixed buckets. Observation is a bisect and
+# three increments, so it's cheap enough for every poll and command
+# *****************************************************
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            bucket_labels = dict(labels, le=format_value(bound))
+            yield "%s_bucket%s %d" % (name, format_labels(bucket_labels), cumulative)
+        yield "%s_sum%s %s" % (name, format_labels(labels), format_value(total))
+        yield "%s_count%s %d" % (name, format_labels(labels), count)
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield "%s%s %s" % (name, format_labels(labels), format_value(self.value))
+
+
+# *****************************************************
+# Metrics of the same name split by label values (e.g. per command)
+# *****************************************************
+class Family(object):
+    def __init__(self, label_name, factory):
+        self.label_name = label_name
+        self.factory = factory
+        self.children = {}      # label value: metric
+        self.lock = threading.Lock()
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, self.factory())
+        return child
+
+    def samples(self, name, labels):
+        for value, child in sorted(self.children.items()):
+            for line in child.samples(name, dict(labels, **{self.label_name: value})):
+                yield line
+
+
+# *****************************************************
+# Gauge read at scrape time. Callback returns value or
+# list of (labels dict, value) pairs
+# *****************************************************
+class Gauge(object):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def samples(self, name, labels):
+        values = self.callback()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for value_labels, value in values:
+            yield "%s%s %s" % (name, format_labels(dict(labels, **value_labels)), format_value(value))
+
+
+# *****************************************************
+# Set of metrics rendered in Prometheus text exposition format
+# *****************************************************
+class Registry(object):
+    def __init__(self):
+        self.metrics = []   # (name, help, type, metric)
+
+    def register(self, name, help_text, metric_type, metric):
+        self.metrics.append((name, help_text, metric_type, metric))
+        return metric
+
+    def histogram(self, name, help_text, label_name=None, buckets=LATENCY_BUCKETS):
+        if label_name is None:
+            return self.register(name, help_text, "histogram", Histogram(buckets))
+        return self.register(name, help_text, "histogram", Family(label_name, lambda: Histogram(buckets)))
+
+    def counter(self, name, help_text):
+        return self.register(name, help_text, "counter", Counter())
+
+    def gauge(self, name, help_text, callback):
+        return self.register(name, help_text, "gauge", Gauge(callback))
+
+    def render(self):
+        lines = []
+        for name, help_text, metric_type, metric in self.metrics:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            lines.extend(metric.samples(name, {}))
+        lines.append("")
+        return "\n".join(lines)
+
+
+# *****************************************************
+# Measures how late IOLoop runs timer callbacks (time when loop
+# is busy with other callbacks)
+# *****************************************************
+class LoopLagMonitor(object):
+    def __init__(self, histogram, period_ms=500):
+        self.histogram = histogram
+        self.period = period_ms / 1000.0
+        self.expected = None
+
+    def start(self):
+        self.schedule()
+
+    def schedule(self):
+        self.expected = time.time() + self.period
+        IOLoop.current().add_timeout(datetime.timedelta(seconds=self.period), self.tick)
+
+    def tick(self):
+        self.histogram.observe(max(0.0, time.time() - self.expected))
+        self.schedule()
+
+
+REGISTRY = Registry()
+
+POLL_STATUS = REGISTRY.histogram("cnc_poll_status_seconds",
+                                 "Duration of poll_status (status delivery to observers)")
+POLL_ERRORS = REGISTRY.histogram("cnc_poll_errors_seconds",
+                                 "Duration of poll_errors (errors delivery to observers)")
+STAT_POLL = REGISTRY.histogram("cnc_stat_poll_seconds",
+                               "Duration of linuxcnc.stat poll in status poller thread")
+STAT_FAILURES = REGISTRY.counter("cnc_stat_failures_total",
+                                 "Number of failed linuxcnc.stat polls")
+IOLOOP_LAG = REGISTRY.histogram("ioloop_lag_seconds",
+                                "Delay of IOLoop timer callbacks")
+COMMAND = REGISTRY.histogram("cnc_command_seconds",
+                             "Duration of handle_command by command", "command")
+COMMAND_WAIT = REGISTRY.histogram("cnc_command_wait_seconds",
+                                  "Time commands wait in scheduler lane queue", "command")
+BROADCAST = REGISTRY.histogram("status_broadcast_seconds",
+                               "Duration of status frame fan-out to websocket clients")
+STATUS_DROPPED = REGISTRY.counter("status_frames_dropped_total",
+                                  "Status frames skipped for clients that have not drained previous frame")
+STATUS_STALLED = REGISTRY.counter("status_clients_stalled_total",
+                                  "Status clients disconnected for not draining frames")
@@ -0,0 +1,74 @@
+import datetime
+
+from tornado.ioloop import IOLoop
+
+import logger
+
+# *****************************************************
+# Schedules linuxcnc status/errors polling with period depending on
+# machine state and number of connected clients:
+#   active     - program is running or axis is jogging (whatever number
+#                of clients, position history is recorded at every poll)
+#   idle       - interpreter is idle
+#   no_clients - nobody is connected to websockets and machine doesn't move
+# *****************************************************
+class PollScheduler(object):
+    def __init__(self, cnc, clients_num, fast_poll_period_ms=20, active_period_ms=100,
+                 idle_period_ms=200, no_clients_period_ms=2000):
+        self.cnc = cnc
+        self.clients_num = clients_num      # callable returning number of connected clients
+
+        # tier name: (poll threads period [ms], publish period [ms])
+        self.tiers = {
+            "active": (fast_poll_period_ms, active_period_ms),
+            "idle": (idle_period_ms, idle_period_ms),
+            "no_clients": (no_clients_period_ms, no_clients_period_ms),
+        }
+        self.tier = None
+        self.timeout = None
+
+    def start(self):
+        self.tick()
+
+    def stop(self):
+        if self.timeout is not None:
+            IOLoop.current().remove_timeout(self.timeout)
+            self.timeout = None
+
+    def select_tier(self):
+        snapshot = self.cnc.snapshot
+        if (snapshot is not None) and snapshot.is_moving():
+            return "active"
+
+        if not self.clients_num():
+            return "no_clients"
+
+        return "idle"
+
+    def apply_tier(self, tier):
+        if tier == self.tier:
+            return
+
+        logger.debug("Poll scheduler: %s -> %s", self.tier, tier)
+        self.tier = tier
+        poll_period = self.tiers[tier][0]
+        self.cnc.poller.set_period(poll_period)
+        self.cnc.error_reader.set_period(poll_period)
+
+    def tick(self):
+        self.timeout = None
+
+        try:
+            self.cnc.poll_status()
+            self.cnc.poll_errors()
+            self.apply_tier(self.select_tier())
+        except Exception as ex:
+            logger.exception(ex)
+
+        publish_period = self.tiers[self.tier or "idle"][1]
+        self.timeout = IOLoop.current().add_timeout(datetime.timedelta(milliseconds=publish_period), self.tick)
+
+    def update(self):
+        """Re-evaluate polling tier immediately (client connected or disconnected)"""
+        self.stop()
+        self.tick()
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import numpy as np
+
+# Columns of history samples
+TIME, X, Y, Z, LINE = range(5)
+
+
+# *****************************************************
+# Ring buffer of machine position samples recorded by status poller
+# thread at full poll rate. Buffer is preallocated, so recording a sample
+# is a row write. Queries return samples decimated to requested budget
+# *****************************************************
+class PositionHistory(object):
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, 5), dtype=np.float64)
+        self.next = 0       # index of row for next sample
+        self.count = 0      # number of recorded samples
+        self.last = None    # last recorded position
+        self.lock = threading.Lock()
+
+    def record(self, position, line, now=None):
+        """Add sample if position changed since last one (standing machine doesn't fill buffer)"""
+        if position == self.last:
+            return
+
+        with self.lock:
+            row = self.samples[self.next]
+            row[TIME] = time.time() if now is None else now
+            row[X], row[Y], row[Z] = position
+            row[LINE] = line
+            self.last = position
+            self.next = (self.next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.next = 0
+            self.count = 0
+            self.last = None
+
+    def ordered(self):
+        """Copy of recorded samples from oldest to newest"""
+        with self.lock:
+            if self.count < self.capacity:
+                return self.samples[:self.count].copy()
+            return np.concatenate((self.samples[self.next:], self.samples[:self.next]))
+
+    @staticmethod
+    def decimate(samples, max_points):
+        """Pick evenly spaced samples keeping first and last ones"""
+        if len(samples) <= max_points:
+            return samples
+        if max_points < 2:
+            return samples[-max_points:] if max_points > 0 else samples[:0]
+
+        indexes = np.linspace(0, len(samples) - 1, max_points).round().astype(np.int64)
+        return samples[np.unique(indexes)]
+
+    def query(self, since_time=None, since_line=None, max_points=2000):
+        """Get samples newer than 'since_time' [sec] and/or since program has
+           reached line 'since_line', decimated to 'max_points'"""
+        samples = self.ordered()
+
+        if since_time is not None:
+            samples = samples[samples[:, TIME] > since_time]
+
+        if since_line is not None:
+            # Samples from the moment program has reached this line
+            reached = np.flatnonzero(samples[:, LINE] >= since_line)
+            samples = samples[reached[0]:] if len(reached) else samples[:0]
+
+        samples = PositionHistory.decimate(samples, max_points)
+
+        return {"time": samples[:, TIME].tolist(),
+                "points": samples[:, X:Z + 1].tolist(),
+                "lines": samples[:, LINE].astype(np.int64).tolist()}
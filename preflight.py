@@ -0,0 +1,39 @@
+import numpy as np
+
+import cycle_time
+
+AXES = ("x", "y", "z")
+
+
+def check(data, soft_limits, offset=(0.0, 0.0, 0.0)):
+    """Check packed toolpath against soft limits before program is opened.
+       soft_limits: (min, max) machine limits of XYZ axes (None - not limited)
+       offset: offset of program coordinates from machine ones
+       Returns program extents and first line exceeding limits per axis"""
+    start, end, lines = cycle_time.read_toolpath(data)[:3]
+    res = {"ok": True, "extents": None, "violations": []}
+    if not len(end):
+        return res
+
+    # Segments are continuous, so their end points cover whole path
+    res["extents"] = {"min": dict(zip(AXES, end.min(axis=0).tolist())),
+                      "max": dict(zip(AXES, end.max(axis=0).tolist()))}
+
+    points = end + np.asarray(offset, dtype=np.float64)
+    for axis, (min_limit, max_limit) in enumerate(soft_limits[:3]):
+        values = points[:, axis]
+        outside = np.zeros(len(values), dtype=bool)
+        if min_limit is not None:
+            outside |= values < min_limit
+        if max_limit is not None:
+            outside |= values > max_limit
+        if not outside.any():
+            continue
+
+        first = int(np.argmax(outside))
+        res["ok"] = False
+        res["violations"].append({"axis": AXES[axis], "line": int(lines[first]),
+                                  "value": float(values[first]),
+                                  "min_limit": min_limit, "max_limit": max_limit})
+
+    return res
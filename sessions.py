@@ -0,0 +1,66 @@
+import binascii
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logger
+
+
+# *****************************************************
+# Logged in devices. Each login gets random session token (kept in
+# browser cookie), request authorization is a lookup in memory, database
+# is used only at login. Sessions expire after timeout of inactivity
+# *****************************************************
+class SessionStore(object):
+    def __init__(self, timeout_s=12 * 3600, max_sessions=64):
+        self.timeout = timeout_s
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()   # token: session dict, least recently used first
+        self.lock = threading.Lock()
+
+    def create(self, user_name, device=""):
+        """Start new session of user. Returns session token"""
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.purge()
+        now = time.time()
+        with self.lock:
+            self.sessions[token] = {"user": user_name, "device": device,
+                                    "created": now, "expires": now + self.timeout}
+            # Forget least recently used sessions
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        logger.debug("Session started: %s (%s)", user_name, device)
+        return token
+
+    def get(self, token):
+        """Session of token or None if unknown or expired. Prolongs found session"""
+        if not token:
+            return None
+
+        now = time.time()
+        with self.lock:
+            session = self.sessions.pop(token, None)
+            if session is None:
+                return None
+            if session["expires"] < now:
+                logger.debug("Session expired: %s", session["user"])
+                return None
+
+            session["expires"] = now + self.timeout
+            self.sessions[token] = session
+            return session
+
+    def delete(self, token):
+        with self.lock:
+            session = self.sessions.pop(token, None)
+        if session is not None:
+            logger.debug("Session closed: %s", session["user"])
+
+    def purge(self):
+        """Drop expired sessions"""
+        now = time.time()
+        with self.lock:
+            for token in [token for token, session in self.sessions.items() if session["expires"] < now]:
+                del self.sessions[token]
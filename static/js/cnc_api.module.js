@@ -153,11 +153,58 @@ export function get_ini_params()
 
 
 /*
-* Send g-code file to cnc machine   
+* Send g-code file to cnc machine (file content is streamed to server, gzip-compressed if supported)
+*   @param  File object
 */
-export function send_gcode_file(file_name, file_content, ok_callback, fail_callback)
+export async function send_gcode_file(file, ok_callback, fail_callback, upload_progress_cb=null)
 {
-    ajax_transcieve("POST", "command/load_gcode", { "name": file_name, "content": file_content }, ok_callback, fail_callback); 
+    let body = file;
+    let compressed = false;
+
+    if(window.CompressionStream){
+        try{
+            body = await new Response(file.stream().pipeThrough(new CompressionStream("gzip"))).blob();
+            compressed = true;
+        }
+        catch(err){
+            console.warn(`g-code compression failed: ${err}`);
+        }
+    }
+
+    // Progress of this upload is available at "upload/<id>"
+    const upload_id = Date.now().toString(36) + Math.random().toString(36).slice(2);
+
+    let xhr = new XMLHttpRequest();
+    xhr.open("POST", "upload/" + encodeURIComponent(file.name) + "?id=" + upload_id, true);
+    if(compressed) xhr.setRequestHeader("Content-Encoding", "gzip");
+
+    xhr.onload = function() {
+        let rx_json = null;
+        try{
+            rx_json = JSON.parse(xhr.responseText);
+        }
+        catch(err){
+            if(fail_callback) fail_callback({result: {text: xhr.statusText, code: xhr.status}});
+            return;
+        }
+
+        if(rx_json.result.text === "OK"){
+            if(ok_callback) ok_callback(rx_json);
+        }
+        else{
+            if(fail_callback) fail_callback(rx_json);
+        }
+    }
+
+    xhr.onerror = function() {
+        if(fail_callback) fail_callback({result: {text: "ajax request failed", code: -63}});
+    }
+
+    xhr.upload.onprogress = function(event) {
+        if(upload_progress_cb) upload_progress_cb(event);
+    };
+
+    xhr.send(body);
 }
 
 /*
@@ -222,6 +269,90 @@ export function get_gcode_content()
     return promise;
 }
 
+/*
+* Get machine positions recorded by server, decimated to 'max_points'
+*/
+export function get_position_history(max_points)
+{
+    let promise = new Promise((resolve, reject) => {
+        ajax_transcieve("GET", `command/position_history?max_points=${max_points}` , null, 
+            (json) => { resolve(json); }, 
+            (json) => { reject(new Error(json.result.text)) } ); 
+    });
+
+    return promise;
+}
+
+/*
+* Get 'count' lines of current g-code file starting from line number 'from' (1-based)
+*/
+export function get_gcode_lines(from, count)
+{
+    let promise = new Promise((resolve, reject) => {
+        ajax_transcieve("GET", `command/gcode_lines?from=${from}&count=${count}` , null, 
+            (json) => { resolve(json); }, 
+            (json) => { reject(new Error(json.result.text)) } ); 
+    });
+
+    return promise;
+}
+
+/*
+* Get [line_no, tool_no] pairs of tool selections in current g-code file
+*/
+export function get_gcode_tools()
+{
+    let promise = new Promise((resolve, reject) => {
+        ajax_transcieve("GET", "command/gcode_tools" , null, 
+            (json) => { resolve(json); }, 
+            (json) => { reject(new Error(json.result.text)) } ); 
+    });
+
+    return promise;
+}
+
+/*
+* Get estimated run time [sec], cut/rapid lengths and per tool breakdown of current g-code file
+*/
+export function get_gcode_estimate()
+{
+    let promise = new Promise((resolve, reject) => {
+        ajax_transcieve("GET", "estimate" , null, 
+            (json) => { resolve(json); }, 
+            (json) => { reject(new Error(json.result.text)) } ); 
+    });
+
+    return promise;
+}
+
+/*
+* Get toolpath of current g-code file parsed by server (binary buffer)
+*/
+export function get_gcode_toolpath()
+{
+    let promise = new Promise((resolve, reject) => {
+        let xhr = new XMLHttpRequest();
+        xhr.open("GET", "toolpath", true);
+        xhr.responseType = "arraybuffer";
+
+        xhr.onload = function() {
+            if(xhr.status != 200){
+                reject(new Error(xhr.statusText));
+                return;
+            }
+            resolve(xhr.response);
+        }
+
+        xhr.onerror = function() {
+            reject(new Error("ajax request failed"));
+        }
+
+        xhr.send();
+    });
+
+    return promise;
+}
+
 /*
 * Tool change finished    
 */
@@ -96,6 +96,34 @@ function add_trajectory_line(pos_start, pos_end)
   render();
 }
 
+// Replace trajectory with positions recorded by server (lost while page was disconnected)
+function restore_trajectory(max_points = 5000)
+{
+  CNC.get_position_history(max_points).then(
+    (json) => {
+      if((scene === undefined) || (json.points.length < 2)) return;
+
+      clear_current_trajectory();
+      trajectory_lines.length = 0;
+      lines_cnt = 0;
+
+      const points = json.points.map( (p) => new THREE.Vector3(p[0], p[1], p[2]) );
+      const geometry = new THREE.BufferGeometry().setFromPoints( points );
+      trajectory_lines.push(geometry);
+
+      const line = new THREE.Line( geometry, new THREE.LineBasicMaterial({color: "green"}) );
+      line.matrixAutoUpdate = false;
+      line.name = "trajectory_line";
+      scene.add( line );
+
+      render();
+    },
+    (error) => {
+      console.warn(`position history load error: ${error.message}`);
+    }
+  );
+}
+
 // NOTE: Render should be called after clearing
 function clear_current_trajectory()
 {
@@ -500,8 +528,14 @@ class SocketListener
   onmessage(data){}
   onclose(){}
 
+  // Convert raw message to json for listeners (null - nothing to notify)
+  decode(data){
+    return JSON.parse(data);
+  }
+
   start(){
     this.ws = new WebSocket("ws://" + document.domain + ":" + this.port + "/" + this.uri, this.protocol);
+    this.ws.binaryType = "arraybuffer";
 
     this.ws.onopen = (event) => {
       console.log(`[ws_open] ${this.protocol} opened`);
@@ -517,9 +551,11 @@ class SocketListener
     // Parse status JSON and show info
     this.ws.onmessage = (event) => {
       //console.log(`[ws_message] : ${event.data}`);
+      let json = this.decode(event.data);
+
       this.onmessage(event.data);
 
-      let json = JSON.parse(event.data);
+      if(json === null) return;
 
       // Execute listeners callback-functions
       for(let callback of this.listeners){
@@ -581,9 +617,128 @@ class SocketListener
 class CNCStatusListener extends SocketListener{
 
   constructor(){
-    super(8888, "websocket/linuxcnc_status", "linuxcnc_status");
+    // Binary frames are preferred, server falls back to JSON if it doesn't support them
+    super(8888, "websocket/linuxcnc_status", ["linuxcnc_status_bin", "linuxcnc_status"]);
     this.cnc_is_available = false;
     this.cnc_avail_timer = null;
+    this.cnc_avail_tmout = 1000;  // no status frames during this period (ms) - cnc is down
+
+    // Full status assembled from keyframes and deltas
+    this.status = null;
+    // Layout of binary frames received at connect
+    this.schema = null;
+    this.text_decoder = new TextDecoder("utf-8");
+  }
+
+  // Binary frame: u8 frame (0 - full, 1 - delta) | u8 version | u16 fields mask | fields
+  decode_binary(buffer){
+    let view = new DataView(buffer);
+    let frame = view.getUint8(0);
+    let mask = view.getUint16(2, true);
+    let offset = 4;
+    let json = {result: {text: "OK", code: 0}, frame: (frame === 0) ? "full" : "delta"};
+
+    if(frame === 0) json.keyframe_period = this.schema.keyframe_period;
+
+    this.schema.fields.forEach((field, i) => {
+      if(!(mask & (1 << i))) return;
+
+      switch(field.type){
+        case "f32x3":
+          json[field.name] = { x: view.getFloat32(offset, true), 
+                               y: view.getFloat32(offset + 4, true), 
+                               z: view.getFloat32(offset + 8, true) };
+          offset += 12;
+          break;
+        case "enum":
+          json[field.name] = field.values[view.getUint8(offset)];
+          offset += 1;
+          break;
+        case "u8":
+          json[field.name] = view.getUint8(offset);
+          offset += 1;
+          break;
+        case "i32":
+          json[field.name] = view.getInt32(offset, true);
+          offset += 4;
+          break;
+        case "u8[]": {
+          let len = view.getUint8(offset);
+          json[field.name] = Array.from(new Uint8Array(buffer, offset + 1, len));
+          offset += 1 + len;
+          break;
+        }
+        case "str": {
+          let len = view.getUint16(offset, true);
+          json[field.name] = this.text_decoder.decode(new Uint8Array(buffer, offset + 2, len));
+          offset += 2 + len;
+          break;
+        }
+      }
+    });
+
+    return json;
+  }
+
+  // Server sends full status frame first and then only changed fields
+  decode(data){
+    let json = null;
+    this.got_status = false;
+
+    if(typeof data === "string"){
+      json = JSON.parse(data);
+      // Schema of binary frames
+      if(json.schema !== undefined){
+        this.schema = json.schema;
+        this.cnc_avail_tmout = Math.max(1000, 2 * this.schema.keyframe_period);
+        return null;
+      }
+      // Linuxcnc startup progress
+      if(json.supervisor !== undefined){
+        this.show_supervisor(json.supervisor);
+        return null;
+      }
+    }
+    else{
+      if(this.schema === null) return null;
+      json = this.decode_binary(data);
+    }
+
+    this.got_status = true;
+    if(json.frame === "full"){
+      this.status = json;
+      // Idle machine sends keyframes only
+      this.cnc_avail_tmout = Math.max(1000, 2 * json.keyframe_period);
+    }
+    else if(this.status !== null){
+      Object.assign(this.status, json);
+    }
+    else{
+      // Delta before first keyframe - wait for resync
+      return null;
+    }
+
+    return this.status;
+  }
+
+  // Startup states: stopped, starting, running, restarting, failed
+  show_supervisor(event)
+  {
+    let text = "LinuxCNC не запущен";
+    switch(event.state){
+      case "starting":
+        text = `LinuxCNC запускается (попытка ${event.attempt}, ${Math.round(event.elapsed)} с)`;
+        break;
+      case "restarting":
+        text = `LinuxCNC: перезапуск через ${Math.round(event.retry_in)} с (${event.text})`;
+        break;
+      case "failed":
+        text = `LinuxCNC не запустился: ${event.text}`;
+        break;
+    }
+
+    document.getElementById("cnc_availability_text").textContent = text;
+    document.getElementById("but_restart_cnc").disabled = (event.state === "starting" || event.state === "restarting");
   }
 
   cnc_is_down()
@@ -605,19 +760,26 @@ class CNCStatusListener extends SocketListener{
     console.log(this);
     //document.querySelector( "body" ).classList.remove( "hidden" );
     document.getElementById("cnc_availability").style.visibility = "hidden";
+    document.getElementById("cnc_availability_text").textContent = "LinuxCNC не запущен";
 
     //update_page_content();
   }
 
   onopen(){
+    this.status = null;
+    this.schema = null;
+    restore_trajectory();
     // Start cnc avail timer
-    this.cnc_avail_timer = setTimeout( () => { this.cnc_is_down(); }, 1000);
+    this.cnc_avail_timer = setTimeout( () => { this.cnc_is_down(); }, this.cnc_avail_tmout);
   }
 
   onmessage(data){
+    // Schema and startup progress messages don't mean linuxcnc is available
+    if( !this.got_status ) return;
+
     // Refresh availability timer
     clearTimeout(this.cnc_avail_timer);
-    this.cnc_avail_timer = setTimeout( () => { this.cnc_is_down(); }, 1000);
+    this.cnc_avail_timer = setTimeout( () => { this.cnc_is_down(); }, this.cnc_avail_tmout);
 
     // Update internal cnc state
     if( !this.cnc_is_available ) this.cnc_is_up();
@@ -648,6 +810,32 @@ class CNCErrorsListener extends SocketListener{
     super(8888, "websocket/linuxcnc_errors", "linuxcnc_errors");
     this.cnc_is_available = false;
     this.cnc_avail_timer = null;
+
+    // map <error_id> - <repeat> of already shown errors
+    this.errors = new Map();
+    this.last_id = -1;
+  }
+
+  onopen(){
+    // Request errors missed while socket was disconnected
+    if(this.last_id >= 0) this.ws.send(JSON.stringify({after_id: this.last_id}));
+  }
+
+  // Errors storm is coalesced by server: same error id comes again with new repeat counter
+  decode(data){
+    let json = JSON.parse(data);
+
+    let repeat = this.errors.get(json.id);
+    if(repeat !== undefined && repeat >= json.repeat) return null;
+
+    json.repeated = (repeat !== undefined);
+    this.errors.set(json.id, json.repeat);
+    this.last_id = Math.max(this.last_id, json.id);
+
+    // Keep only recent errors
+    if(this.errors.size > 256) this.errors.delete(this.errors.keys().next().value);
+
+    return json;
   }
 
 }
@@ -663,6 +851,81 @@ export function init_cnc_errors_listener()
   errors_listener.start();
 }
 
+// --------------------------- CNC jog channel -------------------------
+
+class CNCJogStream extends SocketListener{
+
+  constructor(){
+    super(8888, "websocket/linuxcnc_jog", "linuxcnc_jog");
+    // Held continuous jog is repeated with this period (ms) as heartbeat,
+    // server stops axis when heartbeats stop coming
+    this.heartbeat_period = 100;
+    this.heartbeat_timer = null;
+    this.held = null;
+  }
+
+  is_open(){
+    return (this.ws !== null) && (this.ws.readyState === WebSocket.OPEN);
+  }
+
+  send_intent(intent){
+    if( !this.is_open() ) return false;
+
+    this.ws.send(JSON.stringify(intent));
+    return true;
+  }
+
+  // Returns false if jog channel is not connected
+  continuous(axis, velocity){
+    this.stop_heartbeat();
+    this.held = {jog: "continuous", axis: axis, velocity: velocity};
+    if( !this.send_intent(this.held) ) return false;
+
+    this.heartbeat_timer = setInterval( () => { this.send_intent(this.held); }, this.heartbeat_period);
+    return true;
+  }
+
+  increment(axis, velocity, distance){
+    return this.send_intent({jog: "increment", axis: axis, velocity: velocity, distance: distance});
+  }
+
+  stop(axis){
+    this.stop_heartbeat();
+    return this.send_intent({jog: "stop", axis: axis});
+  }
+
+  stop_heartbeat(){
+    if(this.heartbeat_timer){
+      clearInterval(this.heartbeat_timer);
+      this.heartbeat_timer = null;
+    }
+    this.held = null;
+  }
+
+  // Server replies only to failed intents and deadman stops
+  onmessage(data){
+    let json = JSON.parse(data);
+    console.log(`[jog] (${json.result.code}): ${json.result.text}`);
+  }
+
+  onclose(){
+    // Server stops axes of closed channel by itself
+    this.stop_heartbeat();
+  }
+
+}
+
+let jog_stream = new CNCJogStream();
+
+/*
+* Start web socket for jog intents streaming
+*   @param  
+*/
+export function init_cnc_jog_stream()
+{
+  jog_stream.start();
+}
+
 // ------------------------ CNC Control bar switcher -----------------------
 
 class ControlBarSwitcher{
@@ -771,7 +1034,17 @@ class ManualControlMenu{
     //console.log("move_axis called with values: ");
     //console.log(move);
 
-    CNC.move_axis(move.type, move.data);
+    let sent = false;
+    if(move.type == "continuous"){
+      sent = jog_stream.continuous(move.data.axis_number, move.data.velocity);
+    }
+    else{
+      sent = jog_stream.increment(move.data.axis_number, move.data.velocity, move.data.distance);
+    }
+
+    // Jog channel is not connected - fall back to command requests
+    move.stream = sent;
+    if( !sent ) CNC.move_axis(move.type, move.data);
 
     return move;
   }
@@ -792,7 +1065,10 @@ class ManualControlMenu{
       if (move.type == "continuous"){
 
         function listener (event){
-          CNC.move_axis("stop", {"axis_number": move.data.axis_number});
+          // Stop with command request too if jog channel is gone meanwhile
+          if( !(move.stream && jog_stream.stop(move.data.axis_number)) ){
+            CNC.move_axis("stop", {"axis_number": move.data.axis_number});
+          }
           //console.log("mouseup listener called");
         }
 
@@ -857,6 +1133,9 @@ let mdi_ctrl = new MDIControlMenu();
 
 class GcodeControlMenu{
 
+  // Backplot colors (r, g, b) by toolpath motion type: G0, G1, G2, G3
+  static motion_colors = [[0.9, 0.2, 0.2], [1.0, 1.0, 0.0], [0.2, 0.9, 1.0], [0.2, 0.9, 1.0]];
+
   constructor()
   {
     this.paused = false;
@@ -875,6 +1154,11 @@ class GcodeControlMenu{
     // map <line_no> - <tool_no> from gcode file content
     this.tools = new Map();
 
+    // window of gcode file lines shown in textarea
+    this.window_from = 1;
+    this.window_count = 0;
+    this.window_size = 200;
+
     this.init_controls();
   }
 
@@ -978,52 +1262,106 @@ class GcodeControlMenu{
     renderer.renderLists.dispose();
   }
 
-  static backplot_gcode(content)
+  static backplot_gcode()
   {
     console.log('[backplot_gcode]');
 
-    // Remove current gcode object
-    GcodeControlMenu.clear_current_gcode();
+    // Toolpath is parsed by server. Buffer layout:
+    // header (4 x uint32) | float32 vertices[6*n] | uint32 lines[n] | float32 feeds[n] |
+    // uint32 tools[n] | uint8 motions[n]
+    let toolpath_promise = CNC.get_gcode_toolpath();
+
+    toolpath_promise.then(
+      (buffer) => {
+        const segments_num = new Uint32Array(buffer, 0, 4)[2];
+        const vertices = new Float32Array(buffer, 16, segments_num * 6);
+        const motions = new Uint8Array(buffer, 16 + segments_num * 36, segments_num);
+
+        // Both vertices of segment get color of its motion type
+        const colors = new Float32Array(segments_num * 6);
+        for (let i = 0; i < segments_num; i++) {
+          const color = GcodeControlMenu.motion_colors[motions[i]] || GcodeControlMenu.motion_colors[1];
+          colors.set(color, i * 6);
+          colors.set(color, i * 6 + 3);
+        }
 
-    // Add new gcode object to scene
-    const gloader = new NGCodeLoader();
-    gloader.parse(content, function (object){
-      scene.add( object );
-      render();
-    });
+        // Remove current gcode object
+        GcodeControlMenu.clear_current_gcode();
+
+        // Add new gcode object to scene
+        const geometry = new THREE.BufferGeometry();
+        geometry.setAttribute('position', new THREE.BufferAttribute(vertices, 3));
+        geometry.setAttribute('color', new THREE.BufferAttribute(colors, 3));
+        const object = new THREE.LineSegments(geometry, new THREE.LineBasicMaterial({vertexColors: true}));
+        object.name = "gcode";
+
+        scene.add( object );
+        render();
+      },
+      (error) => {
+        console.warn(`gcode toolpath load error: ${error.message}`);
+      }
+    );
   }
 
-  update_tools(content)
+  update_estimate()
   {
-    let gcode_lines = content.split('\n');;
-    //console.log(gcode_lines);
+    let estimate_value = document.getElementById("gcode_estimate_value");
+    estimate_value.innerHTML = "-";
 
-    this.tools.clear();
-
-    for (let i = 0; i < gcode_lines.length; ++i) {
-      //console.log(` Searching tools at line: '${gcode_lines[i]}' `);
+    CNC.get_gcode_estimate().then(
+      (json) => {
+        let time = Math.round(json.time);
+        let hours = Math.floor(time / 3600);
+        let minutes = Math.floor(time / 60) % 60;
+        let seconds = time % 60;
+        estimate_value.innerHTML = `${hours}:${String(minutes).padStart(2, "0")}:${String(seconds).padStart(2, "0")}`;
+        console.log(`gcode estimate: cut ${json.cut_length.toFixed(1)}, rapid ${json.rapid_length.toFixed(1)}`, json.tools);
+      },
+      (error) => {
+        console.warn(`gcode estimate load error: ${error.message}`);
+      }
+    );
+  }
 
-      // Searching for T-command and it's argument as tool number. Output -  array of matches
-      let tool = gcode_lines[i].match( /(?<![;(].*)(t(\d+)\s?)+/i );
-      //console.log(tool);
-      if (tool) this.tools.set(i+1, +tool[2]);
-    }
+  update_tools()
+  {
+    // Tool selections are searched by server in whole file
+    CNC.get_gcode_tools().then(
+      (json) => {
+        this.tools = new Map(json.tools);
+        console.log(this.tools);
+      },
+      (error) => {
+        console.warn(`gcode tools load error: ${error.message}`);
+      }
+    );
+  }
 
-    console.log(this.tools);
+  load_window(from)
+  {
+    // Load only window of lines around current line instead of whole file
+    return CNC.get_gcode_lines(from, this.window_size).then(
+      (json) => {
+        this.window_from = json.from;
+        this.window_count = json.lines.length;
+        this.output.textContent = json.lines.join("\n");
+      }
+    );
   }
 
   update_content()
   {
     // Update current gcode file content
-    let gcode_content_promise = CNC.get_gcode_content();
+    this.window_count = 0;
+    let gcode_content_promise = this.load_window(1);
 
     gcode_content_promise.then(
-      (json) => {
+      () => {
         console.log("gcode content load success!");
-        this.output.textContent = "";
-        this.output.textContent = json.content;
-        GcodeControlMenu.backplot_gcode(json.content);
-        this.update_tools(json.content);
+        GcodeControlMenu.backplot_gcode();
+        this.update_tools();
+        this.update_estimate();
       },
       (error) => {
         console.warn(`gcode content load error: ${error.message}`);
@@ -1036,7 +1374,18 @@ class GcodeControlMenu{
   {
     console.log(`Updating texarea line to ${line_no}`);
     document.getElementById("gcode_line_value").innerHTML = line_no;
-    if(this.output !== undefined) GcodeControlMenu.select_textarea_line("ngc_file_content", line_no);
+    if(this.output === undefined) return;
+
+    if((line_no >= this.window_from) && (line_no < this.window_from + this.window_count)){
+      GcodeControlMenu.select_textarea_line("ngc_file_content", line_no - this.window_from + 1);
+      return;
+    }
+
+    // Line is out of loaded window - load window starting a bit before it
+    this.load_window(Math.max(1, line_no - this.window_size / 4)).then(
+      () => GcodeControlMenu.select_textarea_line("ngc_file_content", line_no - this.window_from + 1),
+      (error) => console.warn(`gcode lines load error: ${error.message}`)
+    );
   }
 
   start(line_no=0)
@@ -1093,45 +1442,36 @@ class GcodeControlMenu{
     input.addEventListener("change", function () {
       if (this.files && this.files[0]) {
         const myFile = this.files[0];
-        const reader = new FileReader();
-        
-        reader.onload = function (e) {
-          
-          let ok_callback = () => {
-            //object.output.textContent = "";
-            //object.output.textContent = e.target.result;
-            object.toggle_controls(true);
-            // Save array of strings of g-code file in memory
-            //object.update_tools(e.target.result);
-            alert("Файл загружен успешно");
-          }
 
-          let fail_callback = function(res){
-            alert(`Ошибка при отправке файла (${res.result.code}): ${res.result.text}`);
-          }
+        let ok_callback = (res) => {
+          object.toggle_controls(true);
 
-          if(myFile.name.indexOf(".ngc") < 0){
-            alert("Недопустимый формат файла. Требуется расширение .ngc");
+          // Soft limits pre-flight check of program
+          if(res.preflight && !res.preflight.ok){
+            let lines = res.preflight.violations.map( 
+              (v) => `${v.axis.toUpperCase()}: строка ${v.line} (${v.value.toFixed(3)}, пределы ${v.min_limit} .. ${v.max_limit})` );
+            alert("Файл загружен, но программа выходит за пределы перемещений:\n" + lines.join("\n"));
             return;
           }
 
-          // Load g-code to CNC
-          CNC.send_gcode_file(myFile.name, e.target.result, ok_callback, fail_callback);
+          alert("Файл загружен успешно");
+        }
 
-          // Plot g-code
-          //GcodeControlMenu.backplot_gcode(e.target.result);
+        let fail_callback = function(res){
+          alert(`Ошибка при отправке файла (${res.result.code}): ${res.result.text}`);
         }
 
-        reader.onerror = function(e) {
-          console.log(reader.error);
+        let progress_callback = function(e){
+          console.log(`Upload bytes sent: ${e.loaded} of ${e.total}`);
         }
 
-        reader.onprogress = function(e) {
-          console.log(`FileLoader bytes loaded: ${e.loaded}`);
+        if(myFile.name.indexOf(".ngc") < 0){
+          alert("Недопустимый формат файла. Требуется расширение .ngc");
+          return;
         }
-        
-        // reader.readAsBinaryString(myFile);  // Deprecated !
-        reader.readAsText(myFile);
+
+        // Load g-code to CNC
+        CNC.send_gcode_file(myFile, ok_callback, fail_callback, progress_callback);
       }
     });
 
@@ -1382,7 +1722,10 @@ export function init_state_controls()
   status_listener.add_listener( (status) => sc.update_controls(status) );
 
   // CNC errors visualization
-  errors_listener.add_listener( (error) => alert(`Ошибка выполнения: ${error.text}`) );
+  errors_listener.add_listener( (error) => {
+    if(error.repeated) console.warn(`Ошибка выполнения (x${error.repeat}): ${error.text}`);
+    else alert(`Ошибка выполнения: ${error.text}`);
+  });
 
   // CNC restart button (when linuxcnc is unavailable for some reason)
   document.getElementById("but_restart_cnc").onclick = function() { CNC.cnc_start_stop("start_cnc", null, null); };
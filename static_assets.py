@@ -0,0 +1,159 @@
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+
+import tornado.web
+
+import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# File types worth compressing
+COMPRESSIBLE = (".js", ".css", ".json", ".html", ".svg")
+MIN_SIZE = 1024     # smaller files are served as is
+
+
+def is_fresh(path, source_path):
+    """Check that derived file exists and is not older than source"""
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+
+def write_atomic(path, data):
+    tmp_path = "%s.%d.tmp" % (path, threading.current_thread().ident)
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.rename(tmp_path, path)
+
+
+def compress_file(path):
+    """Make .gz (and .br if brotli is installed) variants of file if outdated"""
+    if is_fresh(path + ".gz", path) and ((brotli is None) or is_fresh(path + ".br", path)):
+        return
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    if not is_fresh(path + ".gz", path):
+        buf = io.BytesIO()
+        # Zero mtime keeps output (and etag) the same for the same content
+        with gzip.GzipFile(os.path.basename(path), "wb", 9, buf, 0) as file:
+            file.write(data)
+        write_atomic(path + ".gz", buf.getvalue())
+
+    if (brotli is not None) and not is_fresh(path + ".br", path):
+        write_atomic(path + ".br", brotli.compress(data))
+
+
+def precompress(static_path):
+    """Make compressed variants of all compressible static files"""
+    for root, dirs, files in os.walk(static_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.endswith(COMPRESSIBLE) or os.path.getsize(path) < MIN_SIZE:
+                continue
+            try:
+                compress_file(path)
+            except (IOError, OSError) as ex:
+                logger.debug("Static file compression failed (%s): %s", path, ex)
+
+    logger.debug("Static files compressed: %s", static_path)
+
+
+def precompress_in_background(static_path):
+    thread = threading.Thread(target=precompress, args=(static_path,), name="StaticCompress")
+    thread.daemon = True
+    thread.start()
+
+
+# Import map json, built once (on every render in debug mode)
+import_map_json = None
+
+
+def make_import_map(settings):
+    """Import map of all js modules to their versioned urls,
+       so relative imports between modules are fingerprinted too"""
+    static_path = settings["static_path"]
+    prefix = settings.get("static_url_prefix", "/static/")
+    handler_class = settings.get("static_handler_class", tornado.web.StaticFileHandler)
+    imports = {}
+    for root, dirs, files in os.walk(os.path.join(static_path, "js")):
+        for name in files:
+            if name.endswith(".js"):
+                path = os.path.relpath(os.path.join(root, name), static_path).replace(os.sep, "/")
+                imports[prefix + path] = handler_class.make_static_url(settings, path)
+
+    return json.dumps({"imports": imports}, sort_keys=True)
+
+
+def init_import_map(settings):
+    """Build import map at start, so page rendering doesn't walk and hash static files"""
+    global import_map_json
+    import_map_json = make_import_map(settings)
+
+
+def import_map(handler):
+    """Template method: cached import map"""
+    global import_map_json
+    if (import_map_json is None) or handler.settings.get("debug"):
+        import_map_json = make_import_map(handler.settings)
+    return import_map_json
+
+
+# *****************************************************
+# Static files handler serving precompressed variants of files
+# (brotli or gzip as accepted by browser). Requests of fingerprinted
+# urls (with 'v' argument) are cached by browser forever
+# *****************************************************
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    def initialize(self, path, default_filename=None):
+        super(StaticFileHandler, self).initialize(path, default_filename)
+        self.content_encoding = None
+        self.source_path = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(root, absolute_path)
+        if absolute_path is None:
+            return None
+
+        self.source_path = absolute_path
+        accepted = self.request.headers.get("Accept-Encoding", "")
+        for encoding, ext in StaticFileHandler.ENCODINGS:
+            if (encoding in accepted) and is_fresh(absolute_path + ext, absolute_path):
+                self.content_encoding = encoding
+                return absolute_path + ext
+
+        return absolute_path
+
+    def get_content_type(self):
+        # Type of original file, not of compressed one
+        absolute_path = self.absolute_path
+        self.absolute_path = self.source_path or absolute_path
+        try:
+            return super(StaticFileHandler, self).get_content_type()
+        finally:
+            self.absolute_path = absolute_path
+
+    def set_extra_headers(self, path):
+        self.set_header("Vary", "Accept-Encoding")
+        if self.content_encoding is not None:
+            self.set_header("Content-Encoding", self.content_encoding)
+
+        if self.get_argument("v", None) and not self.settings.get("debug"):
+            self.set_header("Cache-Control", "public, max-age=31536000, immutable")
+
+
+if __name__ == "__main__":
+    # Build time compression: python static_assets.py <static dir>
+    logger.init("debug")
+    precompress(sys.argv[1] if len(sys.argv) > 1 else "static")
@@ -0,0 +1,255 @@
+import json
+import struct
+import time
+
+import logger
+import metrics
+from cnc_agent import StatusSnapshot
+
+FRAME_FULL = 0
+FRAME_DELTA = 1
+
+# *****************************************************
+# Text status frames: JSON object with readable field names and values
+# *****************************************************
+class JsonCodec(object):
+    binary = False
+
+    @staticmethod
+    def encode(message):
+        """Serialize frame to bytes"""
+        return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+    def schema(self, keyframe_period):
+        return None
+
+    def full_frame(self, snapshot, keyframe_period):
+        message = snapshot.to_response()
+        message["frame"] = "full"
+        message["keyframe_period"] = keyframe_period
+        return JsonCodec.encode(message)
+
+    def delta_frame(self, snapshot, fields):
+        message = snapshot.to_response(fields)
+        message["frame"] = "delta"
+        return JsonCodec.encode(message)
+
+# *****************************************************
+# Binary status frames with fixed little-endian layout:
+#   u8 frame (0 - full, 1 - delta) | u8 version | u16 fields mask | fields
+# Fields present in mask follow in StatusSnapshot.FIELDS order. Layout of
+# fields is described by schema message sent to client at connect
+# *****************************************************
+class BinaryCodec(object):
+    binary = True
+    VERSION = 1
+    HEADER = "<BBH"
+
+    # field name: (type, enum values)
+    TYPES = {
+        "position": ("f32x3", None),
+        "estop": ("enum", StatusSnapshot.ESTOP_STATES),
+        "task_state": ("enum", StatusSnapshot.TASK_STATES),
+        "task_mode": ("enum", StatusSnapshot.TASK_MODES),
+        "homed": ("u8[]", None),
+        "current_line": ("i32", None),
+        "motion_line": ("i32", None),
+        "motion_mode": ("u8", None),
+        "motion_type": ("u8", None),
+        "read_line": ("i32", None),
+        "interp_state": ("enum", StatusSnapshot.INTERP_STATES),
+        "file": ("str", None),
+        "command": ("str", None),
+        "tool_in_spindle": ("i32", None),
+    }
+
+    def schema(self, keyframe_period):
+        fields = []
+        for name in StatusSnapshot.FIELDS:
+            field_type, values = BinaryCodec.TYPES[name]
+            field = {"name": name, "type": field_type}
+            if values is not None:
+                field["values"] = values
+            fields.append(field)
+
+        return JsonCodec.encode({"schema": {"version": BinaryCodec.VERSION, "fields": fields,
+                                            "keyframe_period": keyframe_period}})
+
+    @staticmethod
+    def pack_field(field_type, values, value, fmt, args):
+        if field_type == "f32x3":
+            fmt.append("3f")
+            args.extend(value)
+        elif field_type == "enum":
+            fmt.append("B")
+            args.append(values.index(value))
+        elif field_type == "u8":
+            fmt.append("B")
+            args.append(value)
+        elif field_type == "i32":
+            fmt.append("i")
+            args.append(value)
+        elif field_type == "u8[]":
+            value = value[:255]
+            fmt.append("B%dB" % len(value))
+            args.append(len(value))
+            args.extend(value)
+        elif field_type == "str":
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8')
+            value = value[:65535]
+            fmt.append("H%ds" % len(value))
+            args.append(len(value))
+            args.append(value)
+
+    def frame(self, snapshot, fields, frame_type):
+        fmt = [BinaryCodec.HEADER]
+        args = [frame_type, BinaryCodec.VERSION, 0]
+        mask = 0
+        for i, name in enumerate(StatusSnapshot.FIELDS):
+            if name not in fields:
+                continue
+            mask |= 1 << i
+            field_type, values = BinaryCodec.TYPES[name]
+            BinaryCodec.pack_field(field_type, values, getattr(snapshot, name), fmt, args)
+
+        args[2] = mask
+        return struct.pack("".join(fmt), *args)
+
+    def full_frame(self, snapshot, keyframe_period):
+        return self.frame(snapshot, StatusSnapshot.FIELDS, FRAME_FULL)
+
+    def delta_frame(self, snapshot, fields):
+        return self.frame(snapshot, fields, FRAME_DELTA)
+
+
+CODECS = {
+    "json": JsonCodec(),
+    "binary": BinaryCodec(),
+}
+
+# *****************************************************
+# Broadcasts cnc status to all subscribed websocket clients.
+# Every frame is encoded once per status snapshot and frame format,
+# then the same buffer is written to each subscriber of that format.
+# Subscriber has at most one frame being written: frames are skipped
+# while previous one is not drained, then subscriber gets full frame of
+# the newest status. Subscribers stalled for too long are disconnected
+# *****************************************************
+class StatusBroadcaster(object):
+    def __init__(self, delta=True, keyframe_period_ms=2000, stall_timeout_ms=10000):
+        self.delta = delta                          # send only changed fields between keyframes
+        self.keyframe_period = keyframe_period_ms   # period of full status frames [ms]
+        self.keyframe_time = 0
+        self.stall_timeout = stall_timeout_ms / 1000.0  # subscriber not draining frame this long is dropped [sec]
+
+        self.snapshot = None
+        self.subscribers = []
+        self.codecs = {}    # subscriber: frame codec
+        # Subscribers that have not received full frame yet (or skipped frames)
+        self.new_subscribers = set()
+
+    def add_subscriber(self, subscriber, codec_name="json"):
+        """Add subscriber receiving frames of given format. Returns schema message or None"""
+        codec = CODECS[codec_name]
+        self.subscribers.append(subscriber)
+        self.codecs[subscriber] = codec
+        self.new_subscribers.add(subscriber)
+        return codec.schema(self.keyframe_period)
+
+    def del_subscriber(self, subscriber):
+        try:
+            self.subscribers.remove(subscriber)
+        except ValueError:
+            pass
+        self.codecs.pop(subscriber, None)
+        self.new_subscribers.discard(subscriber)
+
+    def is_stalled(self, subscriber, now):
+        """Check if subscriber hasn't drained previous frame. Stalled for too long one is disconnected"""
+        busy_since = subscriber.busy_since()
+        if busy_since is None:
+            return False
+
+        if now - busy_since > self.stall_timeout:
+            logger.warning("Status client %s is stalled for %.1f s (%d frames dropped), disconnecting",
+                           subscriber.client, now - busy_since, subscriber.dropped)
+            metrics.STATUS_STALLED.inc()
+            self.del_subscriber(subscriber)
+            subscriber.close()
+        else:
+            subscriber.dropped += 1
+            metrics.STATUS_DROPPED.inc()
+            # Skipped changes are delivered with full frame
+            self.new_subscribers.add(subscriber)
+        return True
+
+    def on_drain(self, subscriber):
+        """Subscriber has written its frame: send newest status to subscriber that skipped frames"""
+        if (subscriber not in self.new_subscribers) or (self.snapshot is None):
+            return
+
+        self.new_subscribers.discard(subscriber)
+        try:
+            subscriber.send(self.codecs[subscriber].full_frame(self.snapshot, self.keyframe_period))
+        except Exception as ex:
+            logger.exception(ex)
+            self.del_subscriber(subscriber)
+
+    def broadcast_event(self, event):
+        """Send text event message (e.g. linuxcnc startup progress) to all subscribers"""
+        message = JsonCodec.encode(event)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.send_event(message)
+            except Exception as ex:
+                logger.exception(ex)
+                self.del_subscriber(subscriber)
+
+    def broadcast(self, snapshot):
+        """Status observer: send new status snapshot to subscribers"""
+        prev_snapshot = self.snapshot
+        self.snapshot = snapshot
+
+        if not self.subscribers:
+            return
+
+        now = time.time()
+        fields = None
+
+        # Full frame first, then only changed fields until next keyframe
+        keyframe = ((not self.delta) or (prev_snapshot is None) or
+                    (now - self.keyframe_time) * 1000 >= self.keyframe_period)
+        if keyframe:
+            self.keyframe_time = now
+            self.new_subscribers.clear()
+        else:
+            fields = snapshot.delta(prev_snapshot)
+
+        frames = {}     # (codec, full): encoded frame
+        for subscriber in list(self.subscribers):
+            full = keyframe or (subscriber in self.new_subscribers)
+            # Nothing changed - nothing to send
+            if not (full or fields):
+                continue
+            if self.is_stalled(subscriber, now):
+                continue
+            self.new_subscribers.discard(subscriber)
+
+            codec = self.codecs[subscriber]
+            frame = frames.get((codec, full))
+            if frame is None:
+                if full:
+                    frame = codec.full_frame(snapshot, self.keyframe_period)
+                else:
+                    frame = codec.delta_frame(snapshot, fields)
+                frames[(codec, full)] = frame
+
+            try:
+                subscriber.send(frame)
+            except Exception as ex:
+                logger.exception(ex)
+                self.del_subscriber(subscriber)
+
+        if frames:
+            metrics.BROADCAST.observe(time.time() - now)
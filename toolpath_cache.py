@@ -0,0 +1,145 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+import gcode_parser
+import logger
+
+# *****************************************************
+# On-disk cache of toolpaths made from g-code files. Toolpath is stored in
+# flat binary file named by hash of g-code content and is read back with
+# mmap. Least recently used files (toolpaths and line indexes of
+# gcode_lines sharing cache directory) are removed when cache exceeds
+# size budget
+# *****************************************************
+class ToolpathCache(object):
+    def __init__(self, cache_dir, size_budget=256*1048576, warm_num=3):
+        self.dir = cache_dir
+        self.size_budget = size_budget  # max size of all cached toolpaths and line indexes [bytes]
+        self.warm_num = warm_num        # number of last programs to warm at start
+        self.recent_file = os.path.join(self.dir, "recent.json")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_hash(path, chunk_size=65536):
+        """Get sha1 hex digest of file content"""
+        sha = hashlib.sha1()
+        with open(path, "rb") as file:
+            chunk = file.read(chunk_size)
+            while chunk:
+                sha.update(chunk)
+                chunk = file.read(chunk_size)
+
+        return sha.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.dir, key + ".tp")
+
+    def open(self, key):
+        """Get read-only mmap of cached toolpath or None"""
+        path = self.cache_path(key)
+        try:
+            with open(path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Toolpath of older format is parsed again
+            magic, version = gcode_parser.HEADER.unpack_from(data)[:2]
+            if (magic, version) != (gcode_parser.MAGIC, gcode_parser.VERSION):
+                data.close()
+                return None
+            # Update usage time for eviction
+            os.utime(path, None)
+            return data
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+
+    def put(self, key, toolpath):
+        """Store toolpath in cache"""
+        path = self.cache_path(key)
+        tmp_path = "%s.%d.tmp" % (path, threading.current_thread().ident)
+        with open(tmp_path, "wb") as file:
+            file.write(toolpath.to_bytes())
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def load(self, gcode_path, key=None, remember=True):
+        """Get mmap of toolpath for g-code file. File is parsed only if not cached"""
+        if key is None:
+            key = ToolpathCache.file_hash(gcode_path)
+
+        data = self.open(key)
+        if data is None:
+            logger.debug("Toolpath cache miss: %s (%s)", gcode_path, key)
+            self.put(key, gcode_parser.parse_file(gcode_path))
+            data = self.open(key)
+            if data is None:
+                raise IOError("toolpath of '%s' exceeds cache size budget" % gcode_path)
+
+        if remember:
+            self.add_recent(gcode_path, key)
+        return data
+
+    def evict(self):
+        """Remove least recently used toolpaths and line indexes while cache exceeds size budget"""
+        with self.lock:
+            files = []
+            total = 0
+            for name in os.listdir(self.dir):
+                if not name.endswith((".tp", ".idx")):
+                    continue
+                path = os.path.join(self.dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+            files.sort()
+            for mtime, size, path in files:
+                if total <= self.size_budget:
+                    break
+                logger.debug("Cache eviction: %s", path)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def read_recent(self):
+        try:
+            with open(self.recent_file, "r") as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return []
+
+    def add_recent(self, gcode_path, key):
+        """Remember program as recently opened"""
+        with self.lock:
+            recent = [item for item in self.read_recent() if item["path"] != gcode_path]
+            recent.insert(0, {"path": gcode_path, "key": key})
+            try:
+                with open(self.recent_file, "w") as file:
+                    json.dump(recent[:self.warm_num], file)
+            except IOError as ex:
+                logger.exception(ex)
+
+    def warm(self):
+        """Prepare toolpaths of last opened programs: parse missing and read cached into page cache"""
+        for item in self.read_recent():
+            try:
+                data = self.load(item["path"], remember=False)
+                # Touch every page
+                for offset in range(0, len(data), mmap.PAGESIZE):
+                    data[offset]
+                data.close()
+                logger.debug("Toolpath cache warmed: %s", item["path"])
+            except Exception as ex:
+                logger.debug("Toolpath cache warming failed (%s): %s", item["path"], ex)
+
+    def warm_in_background(self):
+        thread = threading.Thread(target=self.warm, name="ToolpathCacheWarm")
+        thread.daemon = True
+        thread.start()